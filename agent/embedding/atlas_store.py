@@ -0,0 +1,81 @@
+from uuid import uuid4
+from langchain_mongodb import MongoDBAtlasVectorSearch
+from pymongo import MongoClient
+
+# Field names of the Atlas documents; add() writes them directly with insert_many
+TEXT_KEY = "text"
+EMBEDDING_KEY = "embedding"
+
+
+class AtlasVectorStore:
+    """
+    MongoDB Atlas Vector Search backend for EmbeddingModel.
+    Exposes the same small surface as LocalVectorStore: existing_hashes / add / search / save.
+    """
+
+    def __init__(self, mongo_uri: str, db_name: str, collection_name: str, index_name: str, embedding, dimensions: int):
+        self.mongo_client = MongoClient(mongo_uri)
+        self.collection = self.mongo_client[db_name][collection_name]
+        self.index_name = index_name
+        self.dimensions = dimensions
+        # The langchain wrapper is only needed to manage the search index definition
+        self.vector_search = MongoDBAtlasVectorSearch(
+            collection = self.collection,
+            embedding=embedding,
+            index_name=index_name,
+            text_key=TEXT_KEY,
+            embedding_key=EMBEDDING_KEY,
+            relevance_score_fn="cosine" # We use cosine similarity as the relevance scoring function
+        )
+        self._ensure_index_exists() # We create the index if it does not exist
+
+
+    def existing_hashes(self, doc_hashes: list) -> set:
+        cursor = self.collection.find({"hash": {"$in": doc_hashes}}, {"hash": 1, "_id": 0})
+        return {doc["hash"] for doc in cursor}
+
+
+    def add(self, texts: list[str], vectors: list[list[float]], metadatas: list[dict]):
+        self.collection.insert_many(
+            [
+                {"_id": str(uuid4()), TEXT_KEY: text, EMBEDDING_KEY: vector, **metadata}
+                for text, vector, metadata in zip(texts, vectors, metadatas)
+            ],
+            ordered=False
+        )
+
+
+    def save(self):
+        # Inserts are durable once insert_many returns; the search index is maintained by Atlas
+        pass
+
+
+    def search(self, query_vector: list[float], k: int = 5) -> list[tuple[str, float]]:
+        """
+        Runs a $vectorSearch with the pre-computed query vector and returns (text, score) pairs.
+        """
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": self.index_name,
+                    "path": EMBEDDING_KEY,
+                    "queryVector": query_vector,
+                    "numCandidates": k * 10,
+                    "limit": k,
+                }
+            },
+            {"$project": {"_id": 0, TEXT_KEY: 1, "score": {"$meta": "vectorSearchScore"}}},
+        ]
+        return [(doc[TEXT_KEY], doc["score"]) for doc in self.collection.aggregate(pipeline) if TEXT_KEY in doc]
+
+
+    def _ensure_index_exists(self):
+        # Plain index backing the batched `$in` deduplication lookups in EmbeddingModel.index()
+        self.collection.create_index("hash", name="hash_lookup")
+        try:
+            self.vector_search.create_vector_search_index(dimensions=self.dimensions)
+        except Exception as e:
+            if "already defined" in str(e) or "already exists" in str(e):
+                print("Index already exists — continuing.")
+            else:
+                raise
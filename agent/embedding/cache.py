@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Optional
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCache:
+    """
+    Two-level cache of embedding vectors.
+
+    - Front: an in-memory LRU of `max_memory_entries` vectors, held as compact float32 arrays.
+    - Back: a SQLite file whose values are packed little-endian float32 blobs (4 bytes per
+      dimension, no JSON), evicted least-recently-used once it exceeds `max_disk_entries`.
+
+    Keys are a SHA-256 of (model name, dimensions, normalized text), so switching the
+    embedding model or its dimensionality never returns stale vectors.
+
+    Disk hits don't write: their `last_used` updates are queued and committed together,
+    with the next `put_many`, once `touch_batch` are pending, or on `flush()`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        model_name: str,
+        dimensions: int,
+        max_memory_entries: int = 4096,
+        max_disk_entries: int = 200_000,
+        touch_batch: int = 256,
+    ):
+        self.path = path
+        self.model_name = model_name
+        self.dimensions = dimensions
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.touch_batch = touch_batch
+        self._vector_format = struct.Struct(f"<{dimensions}f")
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._touched = {}  # key -> last use, not yet written to disk
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+    def key(self, text: str) -> bytes:
+        normalized = " ".join(unicodedata.normalize("NFC", text).split())
+        return hashlib.sha256(f"{self.model_name}\0{self.dimensions}\0{normalized}".encode("utf-8")).digest()
+
+
+    def get(self, text: str, disk: bool = True) -> Optional[list[float]]:
+        """
+        Returns the cached vector of a text, or None. With `disk=False` only the memory level is
+        consulted, and a miss is not counted (the caller is expected to look on disk next).
+        """
+        key = self.key(text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vector.tolist()
+            if not disk:
+                return None
+
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._write_touched()
+                self._db.commit()
+            self.disk_hits += 1
+            vector = array("f", self._vector_format.unpack(row[0]))
+            self._remember(key, vector)
+            return vector.tolist()
+
+
+    def put_many(self, texts: list[str], vectors: list[list[float]]):
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if len(vector) != self.dimensions:
+                    raise ValueError(f"Expected a {self.dimensions}-dimensional vector, got {len(vector)}")
+                key = self.key(text)
+                self._remember(key, array("f", vector))
+                rows.append((key, self._vector_format.pack(*vector), now))
+
+            self._write_touched()
+            before = self._db.total_changes
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self._disk_entries += self._db.total_changes - before
+            self._evict_disk()
+            self._db.commit()
+
+
+    def put(self, text: str, vector: list[float]):
+        self.put_many([text], [vector])
+
+
+    def flush(self):
+        """
+        Writes the queued `last_used` updates of disk hits.
+        """
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_entries,
+        }
+
+
+    def _remember(self, key: bytes, vector: array):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+
+    def _write_touched(self):
+        if not self._touched:
+            return
+        self._db.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(used, key) for key, used in self._touched.items()])
+        self._touched = {}
+
+
+    def _evict_disk(self):
+        if self._disk_entries <= self.max_disk_entries:
+            return
+        # Replaced keys are counted as inserts above, so confirm before deleting anything
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._disk_entries <= self.max_disk_entries:
+            return
+        # Evict a little more than needed so we don't pay for an eviction on every insert
+        excess = self._disk_entries - self.max_disk_entries + max(self.max_disk_entries // 20, 1)
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in `Embeddings` wrapper that consults an `EmbeddingCache` before calling the
+    underlying model. Misses in a batch are embedded with a single call.
+
+    Because it is a regular langchain `Embeddings`, the same instance serves both
+    query-time embedding and document embedding during indexing. The async methods answer
+    memory hits inline and do the SQLite lookups and writes in a worker thread.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = self._lookup(texts)
+        if missing:
+            computed = self.embeddings.embed_documents([texts[i] for i in missing])
+            self._fill(texts, vectors, missing, computed)
+        return vectors
+
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = self.cache.get(text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(text, vector)
+        return vector
+
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            computed = await self.embeddings.aembed_documents([texts[i] for i in missing])
+            await asyncio.to_thread(self._fill, texts, vectors, missing, computed)
+        return vectors
+
+
+    async def aembed_query(self, text: str) -> list[float]:
+        vector = self.cache.get(text, disk=False)
+        if vector is None:
+            vector = await asyncio.to_thread(self.cache.get, text)
+        if vector is None:
+            vector = await self.embeddings.aembed_query(text)
+            await asyncio.to_thread(self.cache.put, text, vector)
+        return vector
+
+
+    def _lookup(self, texts: list[str]):
+        vectors = [self.cache.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        return vectors, missing
+
+
+    def _fill(self, texts, vectors, missing, computed):
+        self.cache.put_many([texts[i] for i in missing], computed)
+        for i, vector in zip(missing, computed):
+            vectors[i] = vector
@@ -1,12 +1,13 @@
-from uuid import uuid4
 import hashlib
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_mongodb import MongoDBAtlasVectorSearch
 from langchain_ollama import OllamaEmbeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores.atlas import AtlasDB
-from pymongo import MongoClient
+from agent.embedding.cache import CachedEmbeddings, EmbeddingCache
+from agent.embedding.lexical_index import BM25Index
+from agent.models import IndexReport
 
 load_dotenv()
 
@@ -18,19 +19,42 @@ class EmbeddingModel:
         collection_name: str = os.getenv("MONGO-COLLECTION"),
         index_name: str = os.getenv("MONGO-INDEX-NAME"),
         embedding_model: str = "nomic-embed-text:v1.5",
-        dimensions: int = 768
+        dimensions: int = 768,
+        embedding_cache_path: str = os.getenv("EMBEDDING-CACHE-PATH", os.path.join(os.getenv("DATA-DIR", "data"), "embedding_cache.sqlite3")),
+        backend: str = os.getenv("VECTOR-BACKEND", "atlas"),
+        local_index_dir: str = os.getenv("LOCAL-INDEX-DIR", "vector_index"),
+        local_index_mode: str = os.getenv("LOCAL-INDEX-MODE", "flat"),
+        lexical_index_path: str = os.getenv("LEXICAL-INDEX-PATH", "lexical_index.json"),
+        rrf_k: int = 60,
+        lexical_exit_ratio: float = 2.0,
+        lexical_exit_min_score: float = 8.0
     ):
-        self.mongo_client = MongoClient(mongo_uri)
-        self.embedding = OllamaEmbeddings(model=embedding_model) 
-        self.collection = self.mongo_client[db_name][collection_name]
+        # Query and document embeddings both go through the two-level cache,
+        # so repeated messages and re-indexed chunks skip the Ollama call.
+        self.embedding_cache = EmbeddingCache(embedding_cache_path, model_name=embedding_model, dimensions=dimensions)
+        self.embedding = CachedEmbeddings(OllamaEmbeddings(model=embedding_model), self.embedding_cache)
         self.dimensions = dimensions
-        self.vector_store = MongoDBAtlasVectorSearch(
-            collection = self.collection,
-            embedding=self.embedding,
-            index_name=index_name,
-            relevance_score_fn="cosine" # We use cosine similarity as the relevance scoring function
-        )
-        self._ensure_index_exists() # We create the index if it does not exist
+
+        # Both backends expose existing_hashes / add / search. "local" needs no Atlas cluster
+        # and answers from memory-mapped files in-process.
+        if backend == "local":
+            from agent.embedding.local_store import LocalVectorStore
+            self.vector_store = LocalVectorStore(local_index_dir, dimensions=dimensions, mode=local_index_mode)
+        elif backend == "atlas":
+            from agent.embedding.atlas_store import AtlasVectorStore
+            self.vector_store = AtlasVectorStore(mongo_uri, db_name, collection_name, index_name, self.embedding, dimensions)
+        else:
+            raise ValueError(f"Unknown vector store backend: {backend}")
+
+        # BM25 side of hybrid retrieval, kept in step with the vector store by index()
+        self.lexical_index = BM25Index(lexical_index_path)
+        self.rrf_k = rrf_k
+        self.lexical_exit_ratio = lexical_exit_ratio
+        # A lone weak hit (common terms, no runner-up) is no reason to skip the vector side
+        self.lexical_exit_min_score = lexical_exit_min_score
+        self._search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="vector-search")
+        # Bumped whenever index() changes what retrieval can return; cached answers are scoped by it
+        self.kb_version = 0
 
     """
     | Scenario                            | Recommended Setting                           |
@@ -42,70 +66,158 @@ class EmbeddingModel:
 
     """
 
-    def index(self, documents, chunk_size, chunk_overlap):
+    def index(self, documents, chunk_size, chunk_overlap, batch_size: int = 64) -> IndexReport:
+        """
+        Streams documents through chunking, deduplication, embedding and insertion in
+        fixed-size batches, so memory stays bounded by `batch_size` chunks.
+
+        Per batch this costs one hash lookup in the vector store (a `$in` on the indexed
+        `hash` field for Atlas), one embedding call for the chunks we don't have yet,
+        and one bulk write.
+        """
         # Chunking the documents for faster indexing and retrieval
         splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
         )
 
-        chunks = splitter.split_documents(documents)
-        new_chunks = []
-        new_ids = []
+        started = time.perf_counter()
+        lexical_size = len(self.lexical_index)
+        total_chunks = 0
+        new_chunks = 0
+        batch = []
+
+        for chunk in self._iter_chunks(splitter, documents):
+            batch.append(chunk)
+            if len(batch) == batch_size:
+                total_chunks += len(batch)
+                new_chunks += self._index_batch(batch)
+                batch = []
+
+        if batch:
+            total_chunks += len(batch)
+            new_chunks += self._index_batch(batch)
+
+        self.lexical_index.save()
+        self.vector_store.save()
+        if new_chunks or len(self.lexical_index) != lexical_size:
+            self.kb_version += 1
+
+        elapsed = time.perf_counter() - started
+        report = IndexReport(
+            chunks=total_chunks,
+            new_chunks=new_chunks,
+            skipped_chunks=total_chunks - new_chunks,
+            elapsed_seconds=round(elapsed, 3),
+            chunks_per_sec=round(total_chunks / elapsed, 2) if elapsed else 0.0,
+            embeddings_per_sec=round(new_chunks / elapsed, 2) if elapsed else 0.0,
+        )
+        print(f"Indexed {report.new_chunks}/{report.chunks} chunks in {report.elapsed_seconds}s "
+              f"({report.chunks_per_sec} chunks/s, {report.embeddings_per_sec} embeddings/s)")
+        return report
 
+
+    def _iter_chunks(self, splitter, documents):
+        # Splitting one document at a time keeps the full chunk list out of memory
+        for document in documents:
+            yield from splitter.split_documents([document])
+
+
+    def _index_batch(self, chunks) -> int:
+        """
+        Embeds and inserts the chunks of one batch that are not stored yet. Returns how many were inserted.
+        """
+        by_hash = {}
         for chunk in chunks:
             doc_hash = self._compute_doc_hash(chunk)
-            if not self._document_exists(doc_hash):
+            by_hash.setdefault(doc_hash, chunk) # Duplicates inside the batch are embedded once
+            # Chunks indexed before the lexical index existed are picked up here too
+            if doc_hash not in self.lexical_index:
+                self.lexical_index.add(doc_hash, chunk.page_content)
+
+        existing = self.vector_store.existing_hashes(list(by_hash))
+        new_chunks = []
+        for doc_hash, chunk in by_hash.items():
+            if doc_hash not in existing:
                 chunk.metadata["hash"] = doc_hash
                 new_chunks.append(chunk)
-                new_ids.append(str(uuid4()))
 
-        if new_chunks:
-            self.vector_store.add_documents(documents=new_chunks, ids=new_ids)
+        if not new_chunks:
+            return 0
+
+        texts = [chunk.page_content for chunk in new_chunks]
+        vectors = self.embedding.embed_documents(texts)
+        self.vector_store.add(texts, vectors, [chunk.metadata for chunk in new_chunks])
+        return len(new_chunks)
 
 
     def retrieve_context(self, user_query: str, k: int = 5, score_threshold: float = 0.7) -> str:
         """
-        This performs semantic search on the vector store using the user query.
+        This performs hybrid search: semantic search on the vector store and BM25 on the
+        lexical index, merged with reciprocal-rank fusion.
+
+        The vector search (embedding + store lookup) starts in a worker thread while the
+        lexical search runs here. When the best lexical hit contains every query term, scores
+        at least `lexical_exit_min_score` and clearly beats the runner-up, it is returned on its
+        own without waiting for the vector side. If the vector search fails, the lexical results
+        are used alone.
 
         Args:
             user_query (str): The input query string from the user.
             k (int): Number of top results to return.
-            score_threshold (float): Minimum relevance score (0 to 1) for results to be considered relevant.
+            score_threshold (float): Minimum relevance score (0 to 1) for vector results to be considered relevant.
 
         Returns:
             str: A single string containing the combined content of the top relevant documents.
         """
         try:
-            results = self.vector_store.similarity_search_with_score(user_query, k=k)
-            # results = "Something "
+            vector_future = self._search_pool.submit(self._vector_search, user_query, k)
+            lexical_results = self.lexical_index.search(user_query, k=k)
+
+            if self._is_strong_lexical_match(lexical_results):
+                vector_future.cancel()
+                return lexical_results[0][0]
 
-            # Filter by relevance score if specified
-            filtered_context = [
-                doc for doc, score in results if score >= score_threshold
-            ]
+            try:
+                # Filter by relevance score if specified
+                vector_results = [
+                    text for text, score in vector_future.result() if score >= score_threshold
+                ]
+            except Exception as e:
+                print(f"Vector search failed, using the lexical results only: {e}")
+                vector_results = []
+            fused = self._reciprocal_rank_fusion([vector_results, [text for text, _, _ in lexical_results]])
 
-            return "\n\n".join(filtered_context)
+            return "\n\n".join(fused[:k])
 
         except Exception as e:
             print(f"Error retrieving context: {e}")
             return ""
 
 
-    def _ensure_index_exists(self):
-        try:
-            self.vector_store.create_vector_search_index(dimensions=self.dimensions)
-        except Exception as e:
-            if "already defined" in str(e) or "already exists" in str(e):
-                print("Index already exists — continuing.")
-            else:
-                raise
-
-        
-    
-    def _document_exists(self, doc_hash):
-        return self.collection.find_one({"hash": doc_hash}) is not None
-    
+    def _vector_search(self, user_query: str, k: int) -> list[tuple[str, float]]:
+        query_vector = self.embedding.embed_query(user_query)
+        return self.vector_store.search(query_vector, k=k)
+
+
+    def _is_strong_lexical_match(self, results) -> bool:
+        if not results:
+            return False
+        _, best_score, coverage = results[0]
+        runner_up = results[1][1] if len(results) > 1 else 0.0
+        return coverage == 1.0 and best_score >= self.lexical_exit_min_score and best_score >= self.lexical_exit_ratio * runner_up
+
+
+    def _reciprocal_rank_fusion(self, rankings: list[list[str]]) -> list[str]:
+        """
+        Merges ranked lists of chunk texts: each list contributes 1 / (rrf_k + rank) per chunk.
+        """
+        scores = {}
+        for ranking in rankings:
+            for rank, text in enumerate(ranking, start=1):
+                scores[text] = scores.get(text, 0.0) + 1.0 / (self.rrf_k + rank)
+        return sorted(scores, key=scores.get, reverse=True)
+
 
     def _compute_doc_hash(self, doc):
         raw = doc.page_content + str(doc.metadata)
@@ -0,0 +1,116 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+# Keeps identifiers such as "INV-2041", "v1.5" or "jane@acme.io" together as one token
+_TOKEN = re.compile(r"\w+(?:[-.@/]\w+)*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by do for from how i in is it me my of on or so that the this to was what when where which who why with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Incremental BM25 inverted index over the same chunks stored in the vector store,
+    keyed by the chunk content hash computed in EmbeddingModel.index().
+
+    It catches what embeddings tend to blur: exact names, IDs and acronyms. Postings
+    are plain dictionaries, so a search costs a few dictionary lookups per query term
+    and is cheap enough to run while the vector search is in flight.
+
+    The index is persisted as JSON next to the app when `path` is given.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+
+        self.postings = {}     # term -> {doc_hash: term frequency}
+        self.doc_lengths = {}  # doc_hash -> token count
+        self.texts = {}        # doc_hash -> chunk text
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self._load()
+
+
+    def __contains__(self, doc_hash: str) -> bool:
+        return doc_hash in self.doc_lengths
+
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+
+    def add(self, doc_hash: str, text: str):
+        tokens = tokenize(text)
+        with self._lock:
+            if doc_hash in self.doc_lengths:
+                return
+            for term, frequency in Counter(tokens).items():
+                self.postings.setdefault(term, {})[doc_hash] = frequency
+            self.doc_lengths[doc_hash] = len(tokens)
+            self.texts[doc_hash] = text
+            self.total_length += len(tokens)
+
+
+    def search(self, query: str, k: int = 5) -> list[tuple[str, float, float]]:
+        """
+        Returns up to k (text, bm25 score, query-term coverage) triples, best first.
+        Coverage is the fraction of distinct query terms found in the chunk.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            if not self.doc_lengths:
+                return []
+            doc_count = len(self.doc_lengths)
+            average_length = self.total_length / doc_count
+
+            scores, matched = {}, Counter()
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_hash, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_hash] / average_length)
+                    scores[doc_hash] = scores.get(doc_hash, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+                    matched[doc_hash] += 1
+
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self.texts[doc_hash], score, matched[doc_hash] / len(terms)) for doc_hash, score in best]
+
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            snapshot = {"k1": self.k1, "b": self.b, "texts": self.texts, "postings": self.postings, "doc_lengths": self.doc_lengths}
+            temporary = f"{self.path}.tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(temporary, self.path)  # atomic, so a crash never leaves half an index behind
+
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        self.k1, self.b = snapshot["k1"], snapshot["b"]
+        self.texts = snapshot["texts"]
+        self.postings = snapshot["postings"]
+        self.doc_lengths = snapshot["doc_lengths"]
+        self.total_length = sum(self.doc_lengths.values())
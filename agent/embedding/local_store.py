@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+from typing import Optional
+import numpy as np
+
+
+class LocalVectorStore:
+    """
+    In-process vector index persisted to memory-mapped files, as an alternative to
+    MongoDB Atlas Vector Search for single-box deployments and offline benchmarks.
+
+    Layout of `directory`:
+    - vectors.f32   row-major float32 matrix of L2-normalized embeddings
+    - records.jsonl one JSON record (text + metadata) per row
+    - records.idx   uint64 byte offsets of each record, so texts are read on demand
+    - ivf.npz       centroids and per-row list assignments (approximate mode only), written
+                    by `save()`; rows added since the last save are assigned again on open
+
+    Opening the store maps the files instead of reading them, so startup cost does not
+    grow with the corpus; the OS pages vectors in as searches touch them.
+
+    Modes:
+    - "flat": exact search, one matrix-vector product over every stored row.
+    - "ivf": inverted-file index. Rows are clustered with spherical k-means into
+      ~sqrt(n) lists and a query only scans the `nprobe` closest lists. Below
+      `min_train_size` rows, the flat scan is used.
+
+    Scores are reported as (1 + cosine) / 2, matching the 0-1 range Atlas returns
+    for cosine indexes, so the same relevance thresholds apply to both backends.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        dimensions: int,
+        mode: str = "flat",
+        nprobe: int = 8,
+        min_train_size: int = 2048,
+    ):
+        if mode not in ("flat", "ivf"):
+            raise ValueError(f"Unknown local index mode: {mode}")
+
+        self.directory = directory
+        self.dimensions = dimensions
+        self.mode = mode
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._records_path = os.path.join(directory, "records.jsonl")
+        self._offsets_path = os.path.join(directory, "records.idx")
+        self._ivf_path = os.path.join(directory, "ivf.npz")
+
+        self._lock = threading.Lock()
+        self._hashes: Optional[set] = None  # loaded on first use by the indexer, never at startup
+        # (centroids, assignments, lists), replaced as a whole so searches never mix two clusterings
+        self._ivf = None
+        self._ivf_saved = True
+        self._trained_size = 0
+        self._open()
+
+
+    def __len__(self):
+        return self._count
+
+
+    def existing_hashes(self, doc_hashes: list) -> set:
+        with self._lock:
+            if self._hashes is None:
+                self._hashes = {record.get("hash") for record in self._iter_records()}
+            return self._hashes.intersection(doc_hashes)
+
+
+    def add(self, texts: list[str], vectors: list[list[float]], metadatas: list[dict]):
+        """
+        Appends rows to the vector and record files, then refreshes the maps (and the IVF lists).
+        """
+        matrix = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions))
+
+        with self._lock:
+            with open(self._records_path, "ab") as records, open(self._offsets_path, "ab") as offsets:
+                position = records.tell()
+                row_offsets = []
+                for text, metadata in zip(texts, metadatas):
+                    line = json.dumps({"text": text, **metadata}, ensure_ascii=False).encode("utf-8") + b"\n"
+                    row_offsets.append(position)
+                    records.write(line)
+                    position += len(line)
+                offsets.write(np.asarray(row_offsets, dtype=np.uint64).tobytes())
+
+            with open(self._vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+
+            if self._hashes is not None:
+                self._hashes.update(metadata.get("hash") for metadata in metadatas)
+
+            first_new_row = self._count
+            self._open_maps()
+
+            if self.mode == "ivf":
+                if self._count >= self.min_train_size and self._count >= 2 * self._trained_size:
+                    # The corpus doubled since the lists were built; recluster to keep them balanced
+                    self._train()
+                elif self._ivf is not None:
+                    self._ivf = self._assign(self._ivf[0], self._ivf[1], first_new_row)
+                    self._ivf_saved = False
+
+
+    def save(self):
+        """
+        Persists the IVF clustering, once per indexing run rather than on every `add`.
+        """
+        with self._lock:
+            if self._ivf is None or self._ivf_saved:
+                return
+            centroids, assignments, _ = self._ivf
+            np.savez(self._ivf_path, centroids=centroids, assignments=assignments)
+            self._ivf_saved = True
+
+
+    def search(self, query_vector: list[float], k: int = 5) -> list[tuple[str, float]]:
+        """
+        Returns up to k (text, score) pairs, best first.
+        """
+        # The lists are read before the vectors: add() maps new rows before it assigns them to lists
+        ivf = self._ivf
+        vectors = self._vectors
+        if vectors is None or k <= 0:
+            return []
+
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+
+        if ivf is not None:
+            centroids, _, lists = ivf
+            probes = np.argsort(centroids @ query)[::-1][:self.nprobe]
+            candidates = np.concatenate([lists[probe] for probe in probes])
+            if len(candidates) == 0:
+                return []
+            candidates.sort()  # sequential access into the memory map
+            similarities = vectors[candidates] @ query
+        else:
+            candidates = None
+            similarities = vectors @ query
+
+        top = min(k, len(similarities))
+        best = np.argpartition(similarities, -top)[-top:]
+        best = best[np.argsort(similarities[best])[::-1]]
+        rows = candidates[best] if candidates is not None else best
+
+        return [(self._read_record(int(row))["text"], float((1.0 + similarities[i]) / 2.0)) for row, i in zip(rows, best)]
+
+
+    def _open(self):
+        self._open_maps()
+        if self.mode == "ivf" and os.path.exists(self._ivf_path):
+            with np.load(self._ivf_path) as ivf:
+                centroids, assignments = ivf["centroids"], ivf["assignments"]
+            self._trained_size = len(assignments)
+            self._ivf = self._assign(centroids, assignments, len(assignments))
+            self._ivf_saved = len(assignments) == self._count
+
+
+    def _open_maps(self):
+        size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        self._count = size // (4 * self.dimensions)
+        if self._count:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._count, self.dimensions))
+            self._offsets = np.memmap(self._offsets_path, dtype=np.uint64, mode="r", shape=(self._count,))
+        else:
+            self._vectors, self._offsets = None, None
+
+
+    def _read_record(self, row: int) -> dict:
+        with open(self._records_path, "rb") as f:
+            f.seek(int(self._offsets[row]))
+            return json.loads(f.readline())
+
+
+    def _iter_records(self):
+        if not os.path.exists(self._records_path):
+            return
+        with open(self._records_path, "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+    def _train(self, iterations: int = 10, sample_per_list: int = 256):
+        """
+        Spherical k-means over a sample of the stored rows, then assigns every row to its closest centroid.
+        """
+        nlist = max(1, int(np.sqrt(self._count)))
+        rng = np.random.default_rng(0)
+        sample_size = min(self._count, nlist * sample_per_list)
+        sample = np.asarray(self._vectors[np.sort(rng.choice(self._count, sample_size, replace=False))])
+
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(iterations):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            for list_id in range(nlist):
+                members = sample[nearest == list_id]
+                if len(members):
+                    centroids[list_id] = members.sum(axis=0)
+            centroids = self._normalize(centroids)
+
+        self._ivf = self._assign(centroids, np.empty(0, dtype=np.int32), 0)
+        self._ivf_saved = False
+        self._trained_size = self._count
+
+
+    def _assign(self, centroids: np.ndarray, assignments: np.ndarray, first_row: int, chunk_size: int = 65536) -> tuple:
+        """
+        Assigns the rows from `first_row` on to their closest centroid and returns the new (centroids, assignments, lists).
+        """
+        assigned = [assignments[:first_row]]
+        for start in range(first_row, self._count, chunk_size):
+            chunk = self._vectors[start:start + chunk_size]
+            assigned.append(np.argmax(chunk @ centroids.T, axis=1).astype(np.int32))
+        assignments = np.concatenate(assigned)
+
+        order = np.argsort(assignments, kind="stable")
+        boundaries = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        lists = [order[boundaries[i]:boundaries[i + 1]] for i in range(len(centroids))]
+        return centroids, assignments, lists
+
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
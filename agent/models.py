@@ -19,6 +19,22 @@ class EventCreate(BaseModel):
     end_time: datetime = Field(..., description="End time in ISO 8601 format")
     time_zone: Optional[str] = Field("UTC", description="Time zone for the event, defaults to UTC")
     attendees_emails: Optional[list[str]] = Field(default_factory=list, description="List of attendee emails")
+    recurrence: Optional[str] = Field(None, description="RFC 5545 recurrence rule for repeating events, e.g. RRULE:FREQ=WEEKLY;BYDAY=FR")
+
+
+# What event extraction asks the model for: its JSON schema is sent as the `format` of the call
+class ExtractedEvents(BaseModel):
+    events: list[EventCreate] = Field(..., description="One entry per event the user described")
+
+
+class EventCreateResult(BaseModel):
+    index: int = Field(..., description="Position of the event in the submitted batch")
+    event: Optional[dict] = Field(None, description="The created Google Calendar event resource")
+    error: Optional[str] = Field(None, description="Why the event could not be created")
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
 
 
 class EventSummary(BaseModel):
@@ -34,3 +50,11 @@ class UpcomingEventsResponse(BaseModel):
     events: list[EventSummary]
 
 
+class IndexReport(BaseModel):
+    chunks: int = Field(..., description="Chunks produced by the splitter")
+    new_chunks: int = Field(..., description="Chunks embedded and written to the store")
+    skipped_chunks: int = Field(..., description="Chunks already present (by content hash)")
+    elapsed_seconds: float
+    chunks_per_sec: float
+    embeddings_per_sec: float
+
@@ -1,9 +1,28 @@
 import os
+from typing import NamedTuple
 from jinja2  import Environment, FileSystemLoader, TemplateNotFound
 from agent.models import UserIntent
 
 
+class PromptParts(NamedTuple):
+    instructions: str  # static block, byte-identical on every call so Ollama can reuse its KV cache
+    request: str       # variable block (context, query), always appended last
+
+
+def render_block(template, block: str, variables: dict = None) -> str:
+    """
+    Renders a single `{% block %}` of a compiled template.
+    """
+    return "".join(template.blocks[block](template.new_context(variables or {}))).strip()
+
+
 class PromptOptimizer:
+    """
+    Builds the answer prompts. Each template is split into a static `instructions` block,
+    sent as the leading system message, and a `request` block holding the variable parts.
+    Templates are compiled and their instructions rendered once, at construction.
+    """
+
     def __init__(self):
         base_dir = os.path.dirname(os.path.abspath(__file__))
         template_dir = os.path.join(base_dir, "prompts")
@@ -15,22 +34,30 @@ class PromptOptimizer:
             UserIntent.GENERAL: "general_prompt.j2"
         }
 
+        self.templates = {}
+        self.instructions = {}
+        for user_intent, template_name in self.template_map.items():
+            try:
+                template = self.env.get_template(template_name)
+            except TemplateNotFound:
+                raise FileNotFoundError(f"Template '{template_name}' not found in '{self.env.loader.searchpath}'")
+            self.templates[user_intent] = template
+            self.instructions[user_intent] = render_block(template, "instructions")
+
 
-    def build(self, user_query, context, user_intent: UserIntent):
+    def build(self, user_query, context, user_intent: UserIntent) -> PromptParts:
         """
         Renders the appropriate prompt template ysing the user query, context and intent
         """
-        template_name = self.template_map.get(user_intent)
+        template = self.templates.get(user_intent)
 
-        if not template_name:
+        if not template:
             raise ValueError(f"No template defined for intent: {user_intent}")
-        
-        try:
-            template = self.env.get_template(template_name)
-        except TemplateNotFound:
-            raise FileNotFoundError(f"Template '{template_name}' not found in '{self.env.loader.searchpath}'")
-
-        return template.render({
-            "query": user_query,
-            "context": context if context else "No relevant context found"
-        })
\ No newline at end of file
+
+        return PromptParts(
+            instructions=self.instructions[user_intent],
+            request=render_block(template, "request", {
+                "query": user_query,
+                "context": context if context else "No relevant context found"
+            })
+        )
@@ -1,34 +1,147 @@
+import asyncio
+import copy
+import logging
+import os
+import re
+import threading
+import time
+import httpx
 from langchain_ollama import ChatOllama
-from agent.service.calendar import GoogleCalendar
-from agent.embedding.embedder import EmbeddingModel
 from agent.models import UserIntent
+from agent.service.answer_cache import CachedAnswer, SemanticAnswerCache, is_cacheable
 from agent.service.intents import IntentDetector
+from agent.service.llm_scheduler import LLMScheduler, Priority, SchedulerBusy, current_session
+from agent.service.ollama_client import AsyncOllamaClient, PromptEvalStats
+from agent.service.session_store import create_session_store
+from agent.service.single_flight import SingleFlight
+from agent.service.history_policy import HistoryPolicy, TokenBudgetHistory
+from agent.service.metrics import PipelineMetrics
 from agent.prompt_engineering.prompt_optimizer import PromptOptimizer
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain.chains.conversation.base import ConversationChain
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
-class QueryPipeline:
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "⚠️ I'm handling a lot of requests right now. Please try again in a moment."
+
+
+class PrefetchStats:
+    """
+    Tracks what speculative prefetching buys us. `saved` is the wall-clock time a
+    request would have spent waiting had classification and the context fetch run
+    one after the other.
+    """
+
     def __init__(self):
+        self.requests = 0
+        self.discarded_fetches = 0
+        self.total_saved = 0.0
+        self.last_saved = 0.0
+
+    def record(self, saved: float, discarded: int):
+        self.requests += 1
+        self.discarded_fetches += discarded
+        self.total_saved += saved
+        self.last_saved = saved
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "discarded_fetches": self.discarded_fetches,
+            "total_saved_ms": round(self.total_saved * 1000, 3),
+            "avg_saved_ms": round(self.total_saved * 1000 / self.requests, 3) if self.requests else 0.0,
+            "last_saved_ms": round(self.last_saved * 1000, 3),
+        }
+
+
+class QueryPipeline:
+    def __init__(
+        self,
+        llm_timeout: float = 30.0,
+        llm_max_concurrency: int = 4,
+        llm_max_queue_depth: int = 32,
+        speculative_prefetch: bool = False,
+        history_token_budget: int = 1500,
+        history_keep_turns: int = 4,
+        measure_prompt_eval: bool = os.getenv("MEASURE-PROMPT-EVAL", "false").lower() in ("1", "true", "yes"),
+        answer_cache_size: int = 1024,
+        answer_cache_threshold: float = 0.95,
+        chat_llm=None,
+        ollama_client: AsyncOllamaClient = None,
+        embedder=None,
+        calendar=None,
+        memory_store=None
+    ):
+        # The service dependencies can be passed in (e.g. the local stand-ins in benchmarks/);
+        # anything left out is built against the real services.
+
+        # We use a local LLM (Ollama-backed) to reduce latency and gain control over the model.
+        # The httpx pool is sized so streaming answers and routing calls can share keep-alive connections.
+        # Every model call takes a slot from one scheduler: routing calls first, then answer streams, then
+        # history summaries, with sessions taking turns inside each class.
+        self.scheduler = LLMScheduler(max_concurrency=llm_max_concurrency, max_queue_depth=llm_max_queue_depth)
+        self.chat_llm = chat_llm or ChatOllama(
+            model="llama3.2",
+            async_client_kwargs={"limits": httpx.Limits(max_connections=llm_max_concurrency * 2, max_keepalive_connections=llm_max_concurrency * 2)}
+        )
+
+        # In measurement mode (MEASURE-PROMPT-EVAL=true), Ollama's prompt-eval counts and durations are
+        # collected per call site, which shows how much of each prompt was served from the cached prefix.
+        # They are reported on /metrics.
+        self.prompt_stats = PromptEvalStats() if measure_prompt_eval else None
+
         # Initialize all service dependencies
-        self.embedder = EmbeddingModel()
+        # The vector store (Mongo connection, index check) and the calendar (OAuth) are the slow
+        # dependencies; they are built on first use or by warm_up(), never in the constructor.
+        self._embedder = embedder
+        self._calendar = calendar
+        self._embedder_lock = threading.Lock()
+        self._calendar_lock = threading.Lock()
         self.prompt_optimizer = PromptOptimizer()
-        self.intent_detector = IntentDetector()
-        self.calendar = GoogleCalendar()
+        # Classification and extraction reuse the ChatOllama connection pool through a non-blocking client
+        self.intent_detector = IntentDetector(
+            ollama_client=ollama_client or AsyncOllamaClient.from_chat_model(
+                self.chat_llm, max_concurrency=llm_max_concurrency, timeout=llm_timeout, prompt_stats=self.prompt_stats, scheduler=self.scheduler
+            )
+        )
+        if self.intent_detector.ollama_client.scheduler is None:
+            self.intent_detector.ollama_client.scheduler = self.scheduler
+        if self.intent_detector.ollama_client.prompt_stats is None:
+            self.intent_detector.ollama_client.prompt_stats = self.prompt_stats
+
+        # When enabled, retrieval and the upcoming-events fetch start alongside classification
+        self.speculative_prefetch = speculative_prefetch
+        self.prefetch_stats = PrefetchStats()
+
+        # Per-stage latency histograms, exposed on the /metrics route
+        self.metrics = PipelineMetrics()
+
+        # GENERAL answers are reused for near-identical questions over the same retrieved context.
+        # A size of 0 turns the cache off.
+        self.answer_cache = SemanticAnswerCache(answer_cache_size, answer_cache_threshold) if answer_cache_size else None
+
+        # Identical messages arriving together (broadcasts, webhook retries, double taps) share one
+        # classification, extraction and retrieval call; these stages don't depend on the session.
+        self.single_flight = SingleFlight()
         
-        # This dictionary keeps per-session memory instances.
+        # This store keeps per-session memory instances.
         # It allows us to persist conversational context across multiple turns using session IDs.
-        self.memory_store = {}
-
-        # We use a local LLM (Ollama-backed) to reduce latency and gain control over the model.
-        self.chat_llm = ChatOllama(model="llama3.2")
+        # The backend comes from SESSION-BACKEND: "memory" bounds how many histories stay resident
+        # (cold ones are spilled to disk), "sqlite" shares histories between worker processes.
+        self.memory_store = memory_store or create_session_store()
+        # Only a token-budgeted window of each history (rolling summary + last turns) reaches the prompt
+        self.history_policy = HistoryPolicy(
+            self.chat_llm, token_budget=history_token_budget, keep_last_turns=history_keep_turns, scheduler=self.scheduler
+        )
 
         # Define the base prompt template. We include a system message,
         # a placeholder for chat history (managed by LangChain memory), and the user's message.
+        # The static per-intent instructions lead and the variable request comes last, so the
+        # rendered prompt shares the longest possible prefix with the previous turn.
         self.prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are a personal assistant"),
+            ("system", "{instructions}"),
             MessagesPlaceholder(variable_name="history"),
             ("human", "{input}")
         ])
@@ -36,74 +149,281 @@ class QueryPipeline:
         # RunnableWithMessageHistory enables us to inject memory into our LLM chain.
         # We instantiate it only once here, since the prompt template remains static.
         # History is dynamically injected via _get_memory(), keeping the design clean.
+        # The model sees the rendered prompt ("input"), but only the raw user query ("query")
+        # is stored, so retrieved context and event dumps never pile up in the history.
         self.memory_chain = RunnableWithMessageHistory(
             self.prompt | self.chat_llm,
             get_session_history=self._get_memory,
-            input_messages_key="input",
+            input_messages_key="query",
             history_messages_key="history"
         )
 
 
+    @property
+    def embedder(self):
+        if self._embedder is None:
+            with self._embedder_lock:
+                if self._embedder is None:
+                    from agent.embedding.embedder import EmbeddingModel
+                    self._embedder = EmbeddingModel()
+        return self._embedder
+
+
+    @property
+    def calendar(self):
+        if self._calendar is None:
+            with self._calendar_lock:
+                if self._calendar is None:
+                    from agent.service.calendar import GoogleCalendar
+                    self._calendar = GoogleCalendar()
+        return self._calendar
+
+
+    def warm_up(self) -> dict:
+        """
+        Builds the lazily created clients ahead of the first request (blocking; run it in a thread).
+
+        Returns:
+            dict: seconds spent building each client.
+        """
+        timings = {}
+        for name in ("embedder", "calendar"):
+            started = time.perf_counter()
+            getattr(self, name)
+            timings[name] = round(time.perf_counter() - started, 3)
+        if self.intent_detector.router is not None:
+            # Embeds the intent exemplars now rather than on the first ambiguous query
+            started = time.perf_counter()
+            self.intent_detector.router.warm_up()
+            timings["intent_router"] = round(time.perf_counter() - started, 3)
+        return timings
+
+
     async def run(self, user_query: str, session_id: str):
         """
         Entry point for handling user queries. It detects intent and dispatches accordingly.
         """
-        print(f"Running query pipeline")
+        logger.debug("Running query pipeline for session %s", session_id)
+        started = time.perf_counter()
+
+        # Shed the turn up front, before it costs any model call, when the model server is backed up
+        try:
+            self.scheduler.check_admission()
+        except SchedulerBusy as e:
+            logger.warning("Turning away a message of session %s: %s", session_id, e)
+            yield BUSY_MESSAGE
+            return
+        # Model calls made for this turn queue up under its session
+        current_session.set(session_id)
+        # The session stays resident (and keeps its history object) until the turn is over
+        self.memory_store.acquire(session_id)
+        try:
+            async for chunk in self._run_turn(user_query, session_id, started):
+                yield chunk
+        finally:
+            self.memory_store.release(session_id, spill=False)
+
 
+    async def _run_turn(self, user_query: str, session_id: str, started: float):
         # First, we classify the user intent (create event, check calendar, or general query)
-        user_intent = self.intent_detector.classify(user_query)
+        context = None
+        if self.speculative_prefetch:
+            user_intent, context = await self._classify_with_prefetch(user_query)
+        else:
+            user_intent, classify_elapsed = await self._timed(self._classify(user_query))
+            self.metrics.observe_stage("intent_classification", classify_elapsed, user_intent.value)
         
         # Route the query to the appropriate handler based on detected intent
         if user_intent == UserIntent.CREATE_EVENT:
-            async for chunk in self._handle_create_event(user_query=user_query, user_intent=user_intent, session_id=session_id):
-                yield chunk
+            chunks = self._handle_create_event(user_query=user_query, user_intent=user_intent, session_id=session_id)
 
         elif user_intent == UserIntent.QUERY_CALENDAR:
-            async for chunk in self._handle_calendar_query(user_query=user_query, user_intent=user_intent, session_id=session_id):
-                yield chunk
+            chunks = self._handle_calendar_query(user_query=user_query, user_intent=user_intent, session_id=session_id, events=context)
 
         elif user_intent == UserIntent.GENERAL:
-            async for chunk in self._handle_general_query(user_query=user_query, user_intent=user_intent, session_id=session_id):
-                yield chunk
+            chunks = self._handle_general_query(user_query=user_query, user_intent=user_intent, session_id=session_id, context=context)
+
+        else:
+            return
+
+        first_chunk = True
+        async for chunk in chunks:
+            if first_chunk and chunk:
+                self.metrics.observe_ttft(user_intent.value, time.perf_counter() - started)
+                first_chunk = False
+            yield chunk
+
+
+    async def _classify_with_prefetch(self, user_query: str):
+        """
+        Starts vector retrieval and the upcoming-events fetch while the intent is still
+        being classified. The fetch matching the final intent is awaited; the others
+        are cancelled (or, if already running in a worker thread, their results discarded).
+
+        Returns:
+            Tuple[UserIntent, Any]: the intent and its prefetched context (None for CREATE_EVENT).
+        """
+        started = time.perf_counter()
+        fetches = {
+            UserIntent.GENERAL: asyncio.create_task(self._timed(self._fetch_context(user_query))),
+            UserIntent.QUERY_CALENDAR: asyncio.create_task(self._timed(asyncio.to_thread(self._fetch_upcoming_events))),
+        }
+        for task in fetches.values():
+            # Discarded fetches may still fail; retrieve the exception so it is not reported as unhandled
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+        try:
+            user_intent, classify_elapsed = await self._timed(self._classify(user_query))
+        except BaseException:
+            for task in fetches.values():
+                task.cancel()
+            raise
+        self.metrics.observe_stage("intent_classification", classify_elapsed, user_intent.value)
+
+        for intent, task in fetches.items():
+            if intent != user_intent:
+                task.cancel()
+
+        context, fetch_elapsed = None, 0.0
+        if user_intent in fetches:
+            context, fetch_elapsed = await fetches[user_intent]
+
+        # Sequential cost minus what we actually waited
+        saved = max(classify_elapsed + fetch_elapsed - (time.perf_counter() - started), 0.0)
+        self.prefetch_stats.record(saved, discarded=len(fetches) - (user_intent in fetches))
+        logger.debug("Speculative prefetch for %s saved %.1f ms", user_intent, saved * 1000)
+        return user_intent, context
+
+
+    async def _classify(self, user_query: str) -> UserIntent:
+        return await self.single_flight.do("classify", self._flight_key(user_query), lambda: self.intent_detector.classify(user_query))
+
+
+    async def _extract_event(self, user_query: str):
+        event_data = await self.single_flight.do("extract_event", self._flight_key(user_query), lambda: self.intent_detector.extract_event(user_query))
+        # Every caller gets its own copy of the shared result
+        return copy.deepcopy(event_data)
+
+
+    async def _fetch_context(self, user_query: str) -> str:
+        """
+        Vector retrieval in a worker thread, shared by concurrent identical queries.
+        """
+        return await self.single_flight.do("retrieve_context", self._flight_key(user_query), lambda: asyncio.to_thread(self._retrieve_context, user_query))
+
+
+    @staticmethod
+    def _flight_key(user_query: str) -> str:
+        return " ".join(user_query.split())
+
+
+    @staticmethod
+    async def _timed(awaitable):
+        started = time.perf_counter()
+        result = await awaitable
+        return result, time.perf_counter() - started
 
 
     async def _handle_create_event(self, user_query: str, session_id: str, user_intent: UserIntent):
         """
         Extracts event data from the query and creates a calendar entry.
         If successful, it passes the event back to the LLM for a confirmation message.
+        Messages describing several events are created with a single batch request.
         """
-        event_data = self.intent_detector.extract_event(user_query)
-
-        # We verify whether the model could extract a start_time.
-        if not event_data.get("start_time"):
+        try:
+            event_data, extract_elapsed = await self._timed(self._extract_event(user_query))
+            self.metrics.observe_stage("event_extraction", extract_elapsed, user_intent.value)
+        except ValueError:
+            # We could not extract a usable start/end time from the message
             yield "⚠️ I couldn't understand when to schedule the event. Please specify a clear time."
+            return
 
-        # Push the event to Google Calendar
-        added_event = self.calendar.add_event(event_data)
+        calendar_started = time.perf_counter()
+        if isinstance(event_data, list):
+            results = await asyncio.to_thread(self.calendar.add_events, event_data)
+            self.metrics.observe_stage("calendar_api", time.perf_counter() - calendar_started, user_intent.value)
+            failed = [result for result in results if not result.ok]
+            if failed:
+                titles = ", ".join(event_data[result.index].summary for result in failed)
+                yield f"⚠️ {len(failed)} of {len(results)} events couldn't be created: {titles}\n\n"
+            added_event = [result.event for result in results if result.ok]
+            if not added_event:
+                return
+        else:
+            # Push the event to Google Calendar
+            added_event = await asyncio.to_thread(self.calendar.add_event, event_data)
+            self.metrics.observe_stage("calendar_api", time.perf_counter() - calendar_started, user_intent.value)
 
         # Let the LLM generate a confirmation or summary
         async for chunk in self.stream_llm(user_query, context=added_event, user_intent=user_intent, session_id=session_id):
             yield chunk
 
 
-    async def _handle_calendar_query(self, user_query: str, session_id: str, user_intent: UserIntent):
+    async def _handle_calendar_query(self, user_query: str, session_id: str, user_intent: UserIntent, events: list = None):
         """
         Fetches upcoming events from the calendar and provides them to the LLM for summarization.
+        Events that were already prefetched are used as-is.
         """
-        events_response = self.calendar.get_upcoming_events()
-        events = [event.model_dump() for event in events_response.events]
-        print(f"events_response {events}")
+        if events is None:
+            events = await asyncio.to_thread(self._fetch_upcoming_events)
+        logger.debug("events_response %s", events)
         async for chunk in self.stream_llm(user_query, context=events, user_intent=user_intent, session_id=session_id):
             yield chunk
 
 
-    async def _handle_general_query(self, user_query: str, session_id: str, user_intent: UserIntent):
+    async def _handle_general_query(self, user_query: str, session_id: str, user_intent: UserIntent, context: str = None):
         """
         Handles open-ended queries by retrieving contextually similar documents or embeddings.
+        Context that was already prefetched is used as-is.
+        A near-identical question answered over the same context is served from the answer cache.
         """
-        context = self.embedder.retrieve_context(user_query)
+        if context is None:
+            context = await self._fetch_context(user_query)
+
+        cached, cache_key = await self._lookup_answer(user_query, context)
+        if cached is not None:
+            async for chunk in self._stream_cached_answer(user_query, cached, session_id):
+                yield chunk
+            return
+
+        started = time.perf_counter()
+        answer = []
         async for chunk in self.stream_llm(user_query, context=context, user_intent=user_intent, session_id=session_id):
+            answer.append(chunk)
             yield chunk
+        # Only answers that streamed to the end get here (a disconnect closes the generator at a yield)
+        if cache_key is not None:
+            self.answer_cache.store(*cache_key, user_query, "".join(answer), time.perf_counter() - started)
+
+
+    async def _lookup_answer(self, user_query: str, context: str):
+        """
+        Returns (cached answer or None, (query vector, scope) to store a fresh answer under, or None).
+        """
+        if self.answer_cache is None or not is_cacheable(user_query):
+            return None, None
+        started = time.perf_counter()
+        try:
+            # The retrieval above already embedded this query, so this is normally an embedding-cache hit
+            query_vector = await asyncio.to_thread(self.embedder.embedding.embed_query, user_query)
+        except Exception as e:
+            logger.warning("Answer cache skipped, the query could not be embedded: %r", e)
+            return None, None
+        scope = self.answer_cache.scope(context, getattr(self.embedder, "kb_version", 0))
+        cached = self.answer_cache.lookup(query_vector, scope)
+        self.metrics.observe_stage("answer_cache_lookup", time.perf_counter() - started, UserIntent.GENERAL.value)
+        return cached, (query_vector, scope)
+
+
+    async def _stream_cached_answer(self, user_query: str, cached: CachedAnswer, session_id: str):
+        """
+        Streams a cached answer word by word, like stream_llm, and records the turn in the session history.
+        """
+        started = time.perf_counter()
+        for match in re.finditer(r"\s*\S+", cached.answer):
+            yield match.group()
+        await self._get_memory(session_id).aadd_messages([HumanMessage(content=user_query), AIMessage(content=cached.answer)])
+        self.answer_cache.record_saving(cached.generation_seconds - (time.perf_counter() - started))
 
         
     # For normal use (no streaming)
@@ -112,35 +432,81 @@ class QueryPipeline:
         Sends the processed query to the LLM. Memory-aware behavior is handled automatically
         via RunnableWithMessageHistory and ConversationSummaryMemory.
         """
-        optimized_prompt = self.prompt_optimizer.build(user_query, context, user_intent)
-        response =  await self.memory_chain.ainvoke(
-            {"input": optimized_prompt},
-            config={"configurable": {"session_id": session_id}}
-        )
-        print(f"response {response}")
+        optimized_prompt = self._build_prompt(user_query, context, user_intent)
+        async with self.scheduler.slot(Priority.STREAMING, session_id):
+            response = await self.memory_chain.ainvoke(
+                {"query": user_query, "instructions": optimized_prompt.instructions, "input": optimized_prompt.request},
+                config={"configurable": {"session_id": session_id}}
+            )
+        logger.debug("response %s", response)
         return response.content
 
 
     # For streaming use cases only
     async def stream_llm(self, user_query: str, context: str, session_id: str, user_intent: UserIntent):
+        optimized_prompt = self._build_prompt(user_query, context, user_intent)
+        logger.debug("optimized_prompt %s", optimized_prompt)
+        # The slot is held for the whole stream; closing this generator (client gone) ends the
+        # request to Ollama and frees the slot
+        async with self.scheduler.slot(Priority.STREAMING, session_id):
+            async for chunk in self.memory_chain.astream(
+                {"query": user_query, "instructions": optimized_prompt.instructions, "input": optimized_prompt.request},
+                config={"configurable": {"session_id": session_id}}
+            ):
+                if chunk.response_metadata.get("done"):
+                    self._record_generation(user_intent, chunk.response_metadata, optimized_prompt)
+                yield chunk.content
+
+
+    def _build_prompt(self, user_query: str, context, user_intent: UserIntent):
+        started = time.perf_counter()
         optimized_prompt = self.prompt_optimizer.build(user_query, context, user_intent)
-        print(f"optimized_prompt {optimized_prompt}")
-        async for chunk in self.memory_chain.astream(
-            {"input": optimized_prompt},
-            config={"configurable": {"session_id": session_id}}
-        ):
-            print(f"chunk {chunk}")
-            yield chunk.content
+        self.metrics.observe_stage("prompt_render", time.perf_counter() - started, user_intent.value)
+        return optimized_prompt
+
+
+    def _record_generation(self, user_intent: UserIntent, response_metadata: dict, optimized_prompt):
+        """
+        Records generation speed (and prompt-eval stats in measurement mode) from Ollama's final chunk.
+        """
+        eval_count, eval_duration = response_metadata.get("eval_count"), response_metadata.get("eval_duration")
+        if eval_count and eval_duration:
+            self.metrics.observe_tokens_per_second(user_intent.value, eval_count / (eval_duration / 1e9))
+        if self.prompt_stats is not None:
+            self.prompt_stats.record(user_intent.value, response_metadata, len(optimized_prompt.instructions) + len(optimized_prompt.request))
+
+
+    def _fetch_upcoming_events(self) -> list:
+        started = time.perf_counter()
+        events_response = self.calendar.get_upcoming_events()
+        self.metrics.observe_stage("calendar_api", time.perf_counter() - started, UserIntent.QUERY_CALENDAR.value)
+        return [event.model_dump() for event in events_response.events]
+
+
+    def _retrieve_context(self, user_query: str) -> str:
+        started = time.perf_counter()
+        context = self.embedder.retrieve_context(user_query)
+        self.metrics.observe_stage("vector_retrieval", time.perf_counter() - started, UserIntent.GENERAL.value)
+        return context
 
 
     def _get_memory(self, session_id: str) -> BaseChatMessageHistory:
         """
         Returns a memory object for the session. If one doesn't exist yet, it creates it.
-        We use ChatMessageHistory for summarizing long conversations into context-efficient summaries.
+        The history is wrapped in a token-budgeted view that folds older turns into a rolling summary.
         """
-        if session_id not in self.memory_store:
-            self.memory_store[session_id] = ChatMessageHistory()
-        return self.memory_store[session_id]
-    
+        return TokenBudgetHistory(self.memory_store, session_id, self.history_policy)
 
 
+    def open_session(self, session_id: str):
+        """
+        Keeps the session's history in memory while its client is connected; pair with `release_session`.
+        """
+        self.memory_store.acquire(session_id)
+
+
+    def release_session(self, session_id: str):
+        """
+        Frees the session's in-memory history once its last client is gone. It stays resumable from disk.
+        """
+        self.memory_store.release(session_id)
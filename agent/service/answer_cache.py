@@ -0,0 +1,190 @@
+import hashlib
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+
+# Words that point back into the conversation ("summarize that", "what about it?") or at the user
+# ("what is my name?"): the answer depends on the session history, which the cache scope does not
+# cover, and the cache is shared by every session in the process
+_REFERRING_WORDS = re.compile(
+    r"\b(it|its|that|this|these|those|they|them|he|she|him|her|above|previous|earlier|again|more|else"
+    r"|i|i'm|i've|i'd|me|my|mine|myself|we|we're|us|our|ours|ourselves)\b",
+    re.IGNORECASE,
+)
+# Questions whose answer goes stale within minutes ("What's the weather today?", "What time is it
+# in Tokyo right now?"); serving them for the cache TTL would be wrong
+_TIME_SENSITIVE_WORDS = re.compile(
+    r"\b(now|today|tonight|tomorrow|yesterday|currently|current|latest|recent|recently|live|weather|forecast"
+    r"|news|headlines|score|scores|price|prices|what time|time is it|time in|what day|what date|the date"
+    r"|this (?:morning|afternoon|evening|week|weekend|month|year))\b",
+    re.IGNORECASE,
+)
+
+
+def is_self_contained(query: str) -> bool:
+    return _REFERRING_WORDS.search(query) is None
+
+
+def is_time_sensitive(query: str) -> bool:
+    return _TIME_SENSITIVE_WORDS.search(query) is not None
+
+
+def is_cacheable(query: str) -> bool:
+    """
+    Whether an answer to `query` may be served to another session, or to the same one later.
+    """
+    return is_self_contained(query) and not is_time_sensitive(query)
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    generation_seconds: float  # what producing the answer cost the first time
+    created_at: float
+
+
+class SemanticAnswerCache:
+    """
+    Cache of GENERAL-intent answers, keyed by the embedding of the question.
+
+    - Query vectors are L2-normalized rows of one preallocated float32 matrix, so a
+      lookup is a single matrix-vector product over the whole cache.
+    - Every entry is scoped by `scope(context, kb_version)`, a fingerprint of the retrieved
+      context and the knowledge-base version. A hit needs cosine similarity of at least
+      `similarity_threshold` *and* the same scope, so an answer is never served on top of
+      context that changed since (EmbeddingModel.index bumps the version).
+    - At most `max_entries` answers are kept; once full, the least recently used row is
+      overwritten. Entries older than `ttl` seconds are not served.
+    - Entries are not scoped by session: callers only store questions that pass `is_cacheable`.
+    """
+
+    def __init__(self, max_entries: int = 1024, similarity_threshold: float = 0.95, ttl: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+
+        self.lookups = 0
+        self.hits = 0
+        self.scope_misses = 0  # a similar question was cached, but over different context (or has expired)
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+        self._matrix = None  # allocated on the first store, once the dimension is known
+        self._scopes = np.zeros(max_entries, dtype=np.uint64)
+        self._last_used = np.full(max_entries, -np.inf)
+        self._entries: list[Optional[CachedAnswer]] = [None] * max_entries
+        self._size = 0
+        self._lock = threading.Lock()
+
+
+    @staticmethod
+    def scope(context, kb_version) -> int:
+        digest = hashlib.sha256(f"{kb_version}\0{context}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big")
+
+
+    def lookup(self, query_vector, scope: int) -> Optional[CachedAnswer]:
+        """
+        Returns the cached answer of the most similar question in `scope`, or None.
+        """
+        query = self._normalize(query_vector)
+        with self._lock:
+            self.lookups += 1
+            if self._matrix is None or query is None or query.shape[0] != self._matrix.shape[1]:
+                return None
+
+            similarities = self._matrix[:self._size] @ query
+            similar = similarities >= self.similarity_threshold
+            if not similar.any():
+                return None
+
+            now = time.time()
+            in_scope = similar & (self._scopes[:self._size] == np.uint64(scope))
+            candidates = np.flatnonzero(in_scope)
+            candidates = [row for row in candidates if now - self._entries[row].created_at <= self.ttl]
+            if not candidates:
+                self.scope_misses += 1
+                return None
+
+            row = max(candidates, key=similarities.__getitem__)
+            self._last_used[row] = time.monotonic()
+            self.hits += 1
+            return self._entries[row]
+
+
+    def store(self, query_vector, scope: int, query: str, answer: str, generation_seconds: float):
+        query_vector = self._normalize(query_vector)
+        if query_vector is None or not answer.strip():
+            return
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != query_vector.shape[0]:
+                # First store, or the embedding model changed: start over
+                self._matrix = np.zeros((self.max_entries, query_vector.shape[0]), dtype=np.float32)
+                self._entries = [None] * self.max_entries
+                self._last_used[:] = -np.inf
+                self._size = 0
+
+            if self._size < self.max_entries:
+                row = self._size
+                self._size += 1
+            else:
+                row = int(np.argmin(self._last_used))
+                self.evictions += 1
+
+            self._matrix[row] = query_vector
+            self._scopes[row] = np.uint64(scope)
+            self._last_used[row] = time.monotonic()
+            self._entries[row] = CachedAnswer(query, answer, generation_seconds, time.time())
+
+
+    def record_saving(self, seconds: float):
+        with self._lock:
+            self.saved_seconds += max(seconds, 0.0)
+
+
+    def stats(self) -> dict:
+        misses = self.lookups - self.hits
+        return {
+            "entries": self._size,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "misses": misses,
+            "scope_misses": self.scope_misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "latency_saved_ms": {
+                "total": round(self.saved_seconds * 1000, 1),
+                "avg_per_hit": round(self.saved_seconds * 1000 / self.hits, 1) if self.hits else 0.0,
+            },
+        }
+
+
+    def render(self, prefix: str = "assistant") -> str:
+        """
+        Counters and gauges in the Prometheus text format, appended to the /metrics output.
+        """
+        name = f"{prefix}_answer_cache"
+        lines = []
+        for metric, kind, help_text, value in (
+            ("lookups_total", "counter", "Answer cache lookups.", self.lookups),
+            ("hits_total", "counter", "Answers served from the cache.", self.hits),
+            ("scope_misses_total", "counter", "Similar questions cached over different context.", self.scope_misses),
+            ("evictions_total", "counter", "Entries overwritten to stay within the size bound.", self.evictions),
+            ("saved_seconds_total", "counter", "Generation time saved by cache hits.", round(self.saved_seconds, 6)),
+            ("entries", "gauge", "Answers currently cached.", self._size),
+        ):
+            lines.append(f"# HELP {name}_{metric} {help_text}")
+            lines.append(f"# TYPE {name}_{metric} {kind}")
+            lines.append(f"{name}_{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+    @staticmethod
+    def _normalize(vector) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
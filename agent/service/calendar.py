@@ -1,15 +1,17 @@
 from datetime import datetime, timedelta, timezone
 import os
-from agent.models import EventCreate, UpcomingEventsResponse, EventSummary
+from agent.models import EventCreate, EventCreateResult, UpcomingEventsResponse, EventSummary
+from agent.service.calendar_store import CalendarEventStore
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
+MAX_BATCH_SIZE = 50 # Calendar API limit on calls per batch request
 
 class GoogleCalendar:
-    def __init__(self):
+    def __init__(self, min_sync_interval: float = 60.0):
         creds = None
         if os.path.exists("token.json"): # We check if we haev a refresh token
             creds = Credentials.from_authorized_user_file("token.json", SCOPES)
@@ -24,14 +26,64 @@ class GoogleCalendar:
             with open("token.json", "w") as token:
                 token.write(creds.to_json())
         self.service = build('calendar', 'v3', credentials=creds)
-
+        # Calendar queries are answered from a local mirror kept fresh with sync tokens
+        self.store = CalendarEventStore(self.service.events, calendar_id="primary", min_sync_interval=min_sync_interval)
 
         
     def add_event(self, event_data: EventCreate):
         """
         Adds an event to Google Calendar and returns the event ID or URL.
         """
-        event = {
+        event = self._event_body(event_data)
+        created = self.service.events().insert(calendarId="primary", body=event).execute()
+        self.store.upsert(created)
+        return created
+
+
+    def add_events(self, events: list[EventCreate]) -> list[EventCreateResult]:
+        """
+        Adds several events using Calendar batch HTTP requests (up to 50 inserts per request).
+        A failing item does not abort the others; each one gets its own result, in input order.
+        If a whole batch request fails, or an item gets no response, its events are reported as failed.
+        """
+        results = [None] * len(events)
+
+        for offset in range(0, len(events), MAX_BATCH_SIZE):
+            batch_end = min(offset + MAX_BATCH_SIZE, len(events))
+            batch = self.service.new_batch_http_request()
+            for index, event_data in enumerate(events[offset:batch_end], start=offset):
+                batch.add(
+                    self.service.events().insert(calendarId="primary", body=self._event_body(event_data)),
+                    callback=self._batch_callback(results),
+                    request_id=str(index)
+                )
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f"[GoogleCalendar] Batch insert of events {offset}-{batch_end - 1} failed: {e!r}")
+                error = f"batch request failed: {e}"
+            else:
+                error = "no response from the batch request"
+            for index in range(offset, batch_end):
+                if results[index] is None:
+                    results[index] = EventCreateResult(index=index, error=error)
+
+        return results
+
+
+    def _batch_callback(self, results: list):
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            if exception is not None:
+                results[index] = EventCreateResult(index=index, error=str(exception))
+            else:
+                self.store.upsert(response)
+                results[index] = EventCreateResult(index=index, event=response)
+        return callback
+
+
+    def _event_body(self, event_data: EventCreate) -> dict:
+        body = {
             'summary': event_data.summary,
             'location': event_data.location,
             'description': event_data.description,
@@ -45,30 +97,20 @@ class GoogleCalendar:
             },
             'attendees': [{'email': email} for email in event_data.attendees_emails],
         }
-
-        return self.service.events().insert(calendarId="primary", body=event).execute()
+        if event_data.recurrence:
+            body['recurrence'] = [event_data.recurrence]
+        return body
 
 
     def get_upcoming_events(self, max_results: int = 10) -> UpcomingEventsResponse:
         """
         Fetches upcoming events and returns a structured summary.
+        Reads from the local mirror, which only goes to the network when it is due for a sync.
         """
-        now = datetime.now(timezone.utc).isoformat()  # UTC time
-        one_week_later = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
+        now = datetime.now(timezone.utc)  # UTC time
+        one_week_later = now + timedelta(days=7)
 
-        events_result = (
-            self.service.events()
-            .list(
-                calendarId="primary",
-                timeMin=now,
-                timeMax=one_week_later,
-                maxResults=max_results,
-                singleEvents=True,
-                orderBy="startTime"
-            )
-            .execute()
-        )
-        events = events_result.get('items', [])
+        events = self.store.upcoming(time_min=now, time_max=one_week_later, max_results=max_results)
         event_summaries = []
 
         for event in events:
@@ -82,4 +124,3 @@ class GoogleCalendar:
             ))
         
         return UpcomingEventsResponse(events=event_summaries)
-        
\ No newline at end of file
@@ -0,0 +1,173 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+from googleapiclient.errors import HttpError
+
+
+class CalendarEventStore:
+    """
+    Local mirror of one Google Calendar, kept up to date through incremental sync.
+
+    - The first sync lists the events of a bounded window, from `lookback_days` ago to
+      `lookahead_days` ahead, and keeps the `nextSyncToken` returned on the last page.
+    - Later syncs send that token and only receive what changed since; cancelled
+      events are removed from the mirror. Every sync prunes the events that ended before
+      the lookback or start after the window, so the mirror stays the size of the window.
+    - When Google invalidates the token (HTTP 410 Gone), or a read reaches past the end of
+      the window, the mirror is rebuilt from a full sync.
+
+    Reads are served from memory. A sync round-trip happens at most once every
+    `min_sync_interval` seconds, so repeated calendar questions cost a dictionary scan.
+
+    The store only needs the `service.events` callable, which makes it easy to drive
+    with an in-process fake of the Calendar API.
+    """
+
+    def __init__(
+        self,
+        events_resource: Callable,
+        calendar_id: str = "primary",
+        min_sync_interval: float = 60.0,
+        lookback_days: int = 1,
+        lookahead_days: int = 30,
+    ):
+        self.events_resource = events_resource
+        self.calendar_id = calendar_id
+        self.min_sync_interval = min_sync_interval
+        self.lookback_days = lookback_days
+        self.lookahead_days = lookahead_days
+
+        self.sync_token: Optional[str] = None
+        self.window_end: Optional[datetime] = None
+        self.last_synced: Optional[float] = None
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self._events = {}  # event id -> raw Calendar API event resource
+        self._lock = threading.Lock()
+
+
+    def sync(self, force: bool = False, time_max: Optional[datetime] = None):
+        """
+        Brings the mirror up to date, unless it was synced less than `min_sync_interval` seconds ago
+        and already covers `time_max`.
+        """
+        with self._lock:
+            beyond_window = time_max is not None and self.window_end is not None and time_max > self.window_end
+            if not force and not beyond_window and self.last_synced is not None and time.monotonic() - self.last_synced < self.min_sync_interval:
+                return
+
+            if self.sync_token is None or beyond_window:
+                self._full_sync()
+            else:
+                try:
+                    self._incremental_sync()
+                except HttpError as e:
+                    if e.resp.status != 410:
+                        raise
+                    # The sync token is no longer valid; Google asks us to wipe the store and start over
+                    print("[CalendarEventStore] Sync token invalidated — running a full resync.")
+                    self._full_sync()
+
+            self._prune()
+            self.last_synced = time.monotonic()
+
+
+    def upsert(self, event: dict):
+        """
+        Writes an event we created ourselves straight into the mirror, so it is visible
+        before the next sync picks it up.
+
+        A recurring event is not written: the mirror holds expanded instances (each with its
+        own id), not series. The next read syncs instead, which brings in its instances.
+        """
+        with self._lock:
+            if event.get("recurrence"):
+                self.last_synced = None
+                return
+            self._apply(event)
+
+
+    def upcoming(self, time_min: datetime, time_max: datetime, max_results: int = 10) -> list:
+        """
+        Returns mirrored events overlapping [time_min, time_max), ordered by start time.
+        """
+        self.sync(time_max=time_max)
+        with self._lock:
+            window = []
+            for event in self._events.values():
+                start, end = self._bound(event, "start"), self._bound(event, "end")
+                if start is None or end is None:
+                    continue
+                if start < time_max and end > time_min:
+                    window.append((start, event))
+
+        window.sort(key=lambda pair: pair[0])
+        return [event for _, event in window[:max_results]]
+
+
+    def _full_sync(self):
+        # The new mirror is built on the side: a listing that fails part-way leaves the old
+        # mirror, window and token in place, and the next sync simply tries again
+        events = {}
+        now = datetime.now(timezone.utc)
+        time_min = now - timedelta(days=self.lookback_days)
+        window_end = now + timedelta(days=self.lookahead_days)
+        sync_token = self._list_all(events, timeMin=time_min.isoformat(), timeMax=window_end.isoformat())
+        self._events, self.window_end, self.sync_token = events, window_end, sync_token
+        self.full_syncs += 1
+
+
+    def _incremental_sync(self):
+        # Applying changes is idempotent, so a failed listing is replayed whole from the same token
+        self.sync_token = self._list_all(self._events, syncToken=self.sync_token)
+        self.incremental_syncs += 1
+
+
+    def _list_all(self, events: dict, **params) -> Optional[str]:
+        """
+        Pages through events().list and applies every item to `events`. Returns the nextSyncToken.
+        """
+        page_token = None
+        while True:
+            page = (
+                self.events_resource()
+                .list(calendarId=self.calendar_id, singleEvents=True, pageToken=page_token, **params)
+                .execute()
+            )
+            for event in page.get("items", []):
+                self._apply(event, events)
+
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return page.get("nextSyncToken")
+
+
+    def _prune(self):
+        # Incremental syncs report changes anywhere in the calendar, and time moves the lookback forward
+        time_min = datetime.now(timezone.utc) - timedelta(days=self.lookback_days)
+        for event_id, event in list(self._events.items()):
+            start, end = self._bound(event, "start"), self._bound(event, "end")
+            if (end is not None and end <= time_min) or (start is not None and start >= self.window_end):
+                del self._events[event_id]
+
+
+    def _apply(self, event: dict, events: Optional[dict] = None):
+        events = self._events if events is None else events
+        if event.get("status") == "cancelled":
+            events.pop(event["id"], None)
+        else:
+            events[event["id"]] = event
+
+
+    @staticmethod
+    def _bound(event: dict, key: str) -> Optional[datetime]:
+        """
+        Parses an event's start/end, treating all-day dates as midnight UTC.
+        """
+        value = event.get(key, {})
+        raw = value.get("dateTime") or value.get("date")
+        if not raw:
+            return None
+        parsed = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
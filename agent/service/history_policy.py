@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+from typing import Sequence
+from jinja2 import Environment, FileSystemLoader
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, SystemMessage
+from agent.service.llm_scheduler import Priority
+
+logger = logging.getLogger(__name__)
+
+def approx_tokens(text: str) -> int:
+    # ~4 characters per token holds well enough for llama-family tokenizers on English text
+    return len(text) // 4 + 1
+
+
+def is_summary(message: BaseMessage) -> bool:
+    return isinstance(message, SystemMessage) and message.additional_kwargs.get("summary", False)
+
+
+class HistoryPolicy:
+    """
+    Decides which part of a session history is sent with each prompt.
+
+    - The latest `keep_last_turns` exchanges are kept verbatim.
+    - Older turns are folded, in the background, into a single rolling summary message
+      stored at the head of the history, so the stored history stays short as well. The
+      store swaps the folded messages for the summary in one step (`replace_prefix`), so
+      turns appended while the summary was generated are never lost or hidden.
+    - Whatever is sent (summary + newest messages) is trimmed to `token_budget` tokens,
+      dropping the oldest verbatim messages first.
+
+    This keeps prefill cost roughly flat as the conversation grows.
+    """
+
+    def __init__(self, summarizer_llm, token_budget: int = 1500, keep_last_turns: int = 4, fold_after_turns: int = 2, scheduler=None):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        template_dir = os.path.join(base_dir, "../prompt_engineering/prompts")
+        self.summary_template = Environment(loader=FileSystemLoader(template_dir)).get_template("conversation_summary_prompt.j2")
+        self.summarizer_llm = summarizer_llm
+        self.token_budget = token_budget
+        self.keep_last_turns = keep_last_turns
+        self.fold_after_turns = fold_after_turns
+        # Summaries are background work: with a scheduler they only get model slots nobody else is waiting for
+        self.scheduler = scheduler
+        self._folding = {}  # session_id -> background task, at most one fold per session
+        self.folds = 0
+
+
+    def window(self, messages: list[BaseMessage]) -> list[BaseMessage]:
+        """
+        Returns the summary (if any) followed by the newest messages that fit the token budget.
+        """
+        summary = messages[0] if messages and is_summary(messages[0]) else None
+        recent = messages[1:] if summary else messages
+        budget = self.token_budget - (approx_tokens(summary.content) if summary else 0)
+
+        kept = []
+        for message in reversed(recent):
+            cost = approx_tokens(str(message.content))
+            if kept and cost > budget:
+                break
+            kept.append(message)
+            budget -= cost
+        kept.reverse()
+
+        return ([summary] if summary else []) + kept
+
+
+    def maybe_fold(self, store, session_id: str):
+        """
+        Schedules a background fold once enough turns have accumulated beyond the verbatim window.
+        """
+        if session_id in self._folding:
+            return
+        # A snapshot: the in-memory store hands out its live list, which would always match itself in replace_prefix
+        messages = list(store.get(session_id).messages)
+        unsummarized = len(messages) - (1 if messages and is_summary(messages[0]) else 0)
+        if unsummarized < 2 * (self.keep_last_turns + self.fold_after_turns):
+            return
+
+        task = asyncio.get_running_loop().create_task(self._fold(store, session_id, messages))
+        self._folding[session_id] = task
+        task.add_done_callback(lambda _: self._folding.pop(session_id, None))
+
+
+    async def _fold(self, store, session_id: str, messages: list[BaseMessage]):
+        summary = messages[0] if messages and is_summary(messages[0]) else None
+        start = 1 if summary else 0
+        cutoff = len(messages) - 2 * self.keep_last_turns
+
+        prompt = self.summary_template.render(summary=summary.content if summary else "", messages=messages[start:cutoff])
+        try:
+            if self.scheduler is not None:
+                async with self.scheduler.slot(Priority.BACKGROUND):
+                    response = await self.summarizer_llm.ainvoke(prompt)
+            else:
+                response = await self.summarizer_llm.ainvoke(prompt)
+        except Exception as e:
+            logger.warning("Summary update of session %s failed: %r", session_id, e)
+            return
+
+        # Messages appended while we were summarizing sit after the cutoff and stay untouched
+        folded = [SystemMessage(content=response.content.strip(), additional_kwargs={"summary": True})]
+        if store.replace_prefix(session_id, messages[:cutoff], folded):
+            self.folds += 1
+        else:
+            logger.info("History of session %s changed during its fold, keeping it unfolded", session_id)
+
+
+class TokenBudgetHistory(BaseChatMessageHistory):
+    """
+    Session history view handed to RunnableWithMessageHistory: reads go through
+    `HistoryPolicy.window`, writes go to the session's history in `store` and may trigger a fold.
+    """
+
+    def __init__(self, store, session_id: str, policy: HistoryPolicy):
+        self.store = store
+        self.session_id = session_id
+        self.policy = policy
+
+
+    @property
+    def history(self) -> BaseChatMessageHistory:
+        return self.store.get(self.session_id)
+
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self.policy.window(self.history.messages)
+
+
+    async def aget_messages(self) -> list[BaseMessage]:
+        return self.messages
+
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.history.add_messages(messages)
+
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.history.add_messages(messages)
+        self.policy.maybe_fold(self.store, self.session_id)
+
+
+    def clear(self) -> None:
+        self.history.clear()
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import re
+import threading
+from typing import Optional, Tuple
+import numpy as np
+from langchain_ollama import OllamaEmbeddings
+from agent.models import UserIntent
+
+
+# Labels used by the section headers in intent_prompt.j2
+EXEMPLAR_LABELS = {
+    "create_event": UserIntent.CREATE_EVENT,
+    "check_calendar": UserIntent.QUERY_CALENDAR,
+    "general": UserIntent.GENERAL,
+}
+
+# nomic-embed-text is trained with task prefixes; exemplars and queries must share one
+TASK_PREFIX = "classification: "
+
+_SECTION_HEADER = re.compile(r"^(\w+) examples:\s*$")
+_QUOTED_EXAMPLE = re.compile(r'^\s*"(.+)"\s*$')
+
+
+class ExemplarIntentRouter:
+    """
+    Nearest-exemplar intent classifier backed by the labelled examples in intent_prompt.j2.
+
+    The exemplars are embedded once into a single L2-normalized float32 matrix, grouped
+    so that each intent occupies a contiguous block of rows. A query then costs one
+    embedding call plus one matrix-vector product; the per-intent best match is taken
+    with a single `np.maximum.reduceat` over those blocks.
+
+    Confidence is the margin between the best and the runner-up intent, scaled so
+    that a margin of `full_confidence_margin` (or more) maps to 1.0.
+
+    The template is re-parsed and re-embedded whenever its modification time changes.
+    Embedding the exemplars is a batch of blocking calls: `aclassify` runs it in a worker
+    thread, and `warm_up()` runs it ahead of the first query.
+    """
+
+    def __init__(
+        self,
+        template_path: Optional[str] = None,
+        embedding_model: str = "nomic-embed-text:v1.5",
+        embeddings=None,
+        full_confidence_margin: float = 0.1,
+    ):
+        if template_path is None:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+            template_path = os.path.join(base_dir, "../prompt_engineering/prompts", "intent_prompt.j2")
+        self.template_path = os.path.normpath(template_path)
+        self.embedding = embeddings or OllamaEmbeddings(model=embedding_model)
+        self.full_confidence_margin = full_confidence_margin
+
+        self._lock = threading.Lock()
+        # (mtime_ns, matrix, intents, block_offsets) swapped atomically on reload
+        self._state = None
+
+
+    def classify(self, user_query: str) -> Tuple[UserIntent, float]:
+        """
+        Returns the intent of the closest exemplar block and a margin-based confidence.
+        """
+        _, matrix, intents, offsets = self._current_state()
+        query_vector = self._normalize(np.asarray(self.embedding.embed_query(TASK_PREFIX + user_query), dtype=np.float32))
+        return self._rank(matrix @ query_vector, intents, offsets)
+
+
+    async def aclassify(self, user_query: str) -> Tuple[UserIntent, float]:
+        state = self._state
+        if state is None or state[0] != os.stat(self.template_path).st_mtime_ns:
+            state = await asyncio.to_thread(self._current_state)
+        _, matrix, intents, offsets = state
+        query_vector = self._normalize(np.asarray(await self.embedding.aembed_query(TASK_PREFIX + user_query), dtype=np.float32))
+        return self._rank(matrix @ query_vector, intents, offsets)
+
+
+    def warm_up(self):
+        """
+        Embeds the exemplars now, unless they are already up to date (blocking; run it in a thread).
+        """
+        self._current_state()
+
+
+    def reload(self):
+        """
+        Re-parses the template and rebuilds the exemplar matrix unconditionally.
+        """
+        with self._lock:
+            self._state = self._build_state()
+
+
+    def _current_state(self):
+        # A stat() per call is far cheaper than an embedding call, and keeps hot-reload simple
+        mtime_ns = os.stat(self.template_path).st_mtime_ns
+        state = self._state
+        if state is None or state[0] != mtime_ns:
+            with self._lock:
+                if self._state is None or self._state[0] != mtime_ns:
+                    self._state = self._build_state()
+                state = self._state
+        return state
+
+
+    def _build_state(self):
+        mtime_ns = os.stat(self.template_path).st_mtime_ns
+        examples = self._parse_exemplars()
+        if not examples:
+            raise ValueError(f"No labelled exemplars found in '{self.template_path}'")
+
+        intents = list(examples)
+        texts, offsets = [], []
+        for intent in intents:
+            offsets.append(len(texts))
+            texts.extend(TASK_PREFIX + example for example in examples[intent])
+
+        matrix = np.asarray(self.embedding.embed_documents(texts), dtype=np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        print(f"[ExemplarIntentRouter] Embedded {len(texts)} exemplars for {len(intents)} intents")
+        return mtime_ns, matrix, intents, np.asarray(offsets, dtype=np.intp)
+
+
+    def _parse_exemplars(self) -> dict:
+        """
+        Collects the quoted examples listed under each "<label> examples:" header.
+        """
+        examples = {}
+        current = None
+        with open(self.template_path, "r", encoding="utf-8") as f:
+            for line in f:
+                header = _SECTION_HEADER.match(line)
+                if header:
+                    current = EXEMPLAR_LABELS.get(header.group(1))
+                    continue
+                if not line.strip():
+                    continue
+                quoted = _QUOTED_EXAMPLE.match(line)
+                if quoted and current is not None:
+                    examples.setdefault(current, []).append(quoted.group(1))
+                else:
+                    # Anything else (e.g. the "Now classify" footer) closes the current block
+                    current = None
+        return examples
+
+
+    def _rank(self, similarities: np.ndarray, intents: list, offsets: np.ndarray) -> Tuple[UserIntent, float]:
+        per_intent = np.maximum.reduceat(similarities, offsets)
+        if len(per_intent) == 1:
+            return intents[0], 1.0
+        runner_up, best = np.argpartition(per_intent, -2)[-2:]
+        margin = float(per_intent[best] - per_intent[runner_up])
+        return intents[best], min(max(margin / self.full_confidence_margin, 0.0), 1.0)
+
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> np.ndarray:
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
@@ -1,10 +1,90 @@
+import asyncio
 import os 
+import re
 import json
-from typing import Tuple
-import ollama
+import time
+from datetime import datetime
+from typing import Optional, Tuple, Union
+from zoneinfo import ZoneInfo
 from jinja2 import Environment, FileSystemLoader
-from pydantic import ValidationError
-from agent.models import EventCreate, UserIntent
+from pydantic import TypeAdapter, ValidationError
+from agent.models import EventCreate, ExtractedEvents, UserIntent
+from agent.prompt_engineering.prompt_optimizer import render_block
+from agent.service.intent_router import ExemplarIntentRouter
+from agent.service.ollama_client import AsyncOllamaClient
+from agent.service.structured_output import StructuredOutputStats
+from agent.service.temporal_parser import TemporalParse, TemporalParser, is_time_zone
+
+
+class StageStats:
+    """
+    Running counters for one stage of the classification cascade.
+    A stage "hits" when it is confident enough to return an intent without
+    handing the query on to the next (more expensive) stage.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.hits = 0
+        self.total_latency = 0.0
+
+    def record(self, hit: bool, latency: float):
+        self.calls += 1
+        self.hits += int(hit)
+        self.total_latency += latency
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.calls if self.calls else 0.0
+
+    @property
+    def avg_latency_ms(self) -> float:
+        return (self.total_latency / self.calls) * 1000 if self.calls else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "hits": self.hits,
+            "hit_rate": round(self.hit_rate, 4),
+            "avg_latency_ms": round(self.avg_latency_ms, 3),
+        }
+
+
+# Keyword/pattern rules for the fixed-cost first stage. Each pattern adds its weight
+# to the matching intent; the weights are tuned so that a single strong cue
+# ("schedule a ...", "what's on my calendar") clears the default threshold on its own.
+# Generic verbs ("add", "create", "book", ...) lead plenty of other requests ("Add 2 and 3",
+# "Book recommendations for a beginner?"), so they stay just short of the threshold
+# until an event noun or a time cue backs them up.
+_LEADING_POLITENESS = r"^(?:(?:hey|hi|ok|okay|please|pls)[,!]?\s+)*(?:(?:can|could|would|will) you\s+(?:please\s+)?)?"
+
+INTENT_RULES = {
+    UserIntent.CREATE_EVENT: [
+        (re.compile(_LEADING_POLITENESS + r"(?:schedule|set up|setup|arrange)\b"), 0.8),
+        (re.compile(_LEADING_POLITENESS + r"(?:book|create|add|block|plan|put)\b"), 0.65),
+        (re.compile(_LEADING_POLITENESS + r"remind me\b"), 0.8),
+        (re.compile(r"\b(?:meeting|appointment|call|event|session|sync|reminder)\b"), 0.1),
+        (re.compile(r"\b(?:at \d{1,2}(?::\d{2})?\s*(?:am|pm)?|\d{1,2}(?::\d{2})?\s*(?:am|pm)|tomorrow|tonight|next \w+day|on \w+day)\b"), 0.1),
+    ],
+    UserIntent.QUERY_CALENDAR: [
+        (re.compile(r"\bwhat(?:'s| is|s)? on (?:my|for|today|tomorrow|this|next|(?:mon|tues|wednes|thurs|fri|satur|sun)day|the (?:calendar|schedule|agenda))\b"), 0.8),
+        (re.compile(r"\bwhat do i have\b|\bdo i have any\b|\bam i (?:free|busy|available)\b"), 0.8),
+        (re.compile(r"\b(?:show|list|display|check)(?: me)? (?:all )?(?:my|the)\b.*\b(?:calendar|schedule|events?|meetings?|appointments?|agenda)\b"), 0.8),
+        (re.compile(r"\bwhen(?:'s| is)? my next\b|\b(?:my )?upcoming (?:events?|meetings?|appointments?)\b"), 0.8),
+        (re.compile(r"\b(?:my )?(?:calendar|agenda)\b|\bscheduled\b"), 0.1),
+    ],
+    UserIntent.GENERAL: [
+        (re.compile(r"^(?:hey|hi|hello|yo|thanks|thank you|good (?:morning|afternoon|evening))\b[\s!.,?]*(?:there)?[\s!.,?]*$"), 0.9),
+        (re.compile(r"^(?:hey|hi|hello)?[,!]?\s*how are you\b"), 0.9),
+        (re.compile(r"^(?:tell me a joke|explain|who (?:is|was|won)|what is the (?:best|difference))\b"), 0.8),
+    ],
+}
+
+
+# Output format of the extraction call (Ollama's `format`), and the attendee emails it may keep
+EXTRACTION_SCHEMA = ExtractedEvents.model_json_schema()
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
 
 
 class IntentDetector:
@@ -13,122 +93,363 @@ class IntentDetector:
     to support calendar event creation and retrieval.
 
     - Uses simple rule-based logic as a fast first-pass classifier.
+    - Optionally consults an embedding nearest-exemplar router (one embedding call
+      and a matrix multiply) before resorting to generation.
     - Falls back to an LLM (via Ollama) for ambiguous or low-confidence cases.
-    - Also supports structured event extraction using a Jinja2-driven prompt.
+    - Also supports structured event extraction: a rule-based TemporalParser handles
+      common phrasings ("tomorrow at 2pm", "every Friday at 9am") without a model call;
+      other messages go to the LLM with a Jinja2-driven prompt and a JSON-schema output
+      format. Invalid fields are repaired one by one, and the fields the parser did
+      resolve override the model's.
+
+    Each stage of the cascade keeps its own hit rate and latency in `stage_stats`,
+    each extraction path in `extraction_stats`, and the LLM extractions their repairs,
+    retries and failures in `structured_output`.
+    All model calls go through a non-blocking `AsyncOllamaClient`, so a slow
+    classification never stalls the event loop shared by other sessions.
     """
 
-    def __init__(self, threshold: float = 0.7):
+    def __init__(
+        self,
+        threshold: float = 0.7,
+        embedding_router: bool = False,
+        ollama_client: Optional[AsyncOllamaClient] = None,
+        temporal_parser: Optional[TemporalParser] = None,
+        structured_output: bool = True,
+        max_extraction_retries: int = 1,
+    ):
         base_dir = os.path.dirname(os.path.abspath(__file__))
         template_dir = os.path.join(base_dir, "../prompt_engineering/prompts")
-        self.threshhold = threshold
+        self.threshold = threshold
         self.jinja_env = Environment(loader=FileSystemLoader(template_dir))
+        # Templates are compiled once; their static instructions (label set, few-shot examples,
+        # output schema) form a byte-identical system prefix that Ollama can keep in its KV cache.
+        self.intent_template = self.jinja_env.get_template("intent_prompt.j2")
+        self.extraction_template = self.jinja_env.get_template("event_extraction_prompt.j2")
+        self.intent_instructions = render_block(self.intent_template, "instructions")
+        self.extraction_instructions = render_block(self.extraction_template, "instructions")
         self.classification_model = "llama3.2"  # Ollama model to use
+        self.ollama_client = ollama_client or AsyncOllamaClient()
+        # The router embeds the exemplars of intent_prompt.j2, the same file the LLM stage uses;
+        # when the file changes, both are refreshed together (see _refresh_intent_prompt)
+        self.router = ExemplarIntentRouter(os.path.join(template_dir, "intent_prompt.j2")) if embedding_router else None
+        self._intent_prompt_lock = asyncio.Lock()
+        self.stage_stats = {
+            "rules": StageStats("rules"),
+            "embedding": StageStats("embedding"),
+            "llm": StageStats("llm"),
+        }
+        # Extraction output constrained to the ExtractedEvents schema and repaired field by field;
+        # turned off, the model's free-form output is used only if it is valid as a whole
+        self.structured_output_format = structured_output
+        self.max_extraction_retries = max_extraction_retries
+        self.structured_output = StructuredOutputStats()
+        self.temporal_parser = temporal_parser or TemporalParser()
+        self.extraction_stats = {
+            "rules": StageStats("rules"),
+            "llm": StageStats("llm"),
+        }
 
 
-    def classify(self, user_query: str) -> UserIntent:
+    async def classify(self, user_query: str) -> UserIntent:
         
         """
         Classifies the intent of a user query (e.g. create event, check calendar).
         Uses rule-based classification first, then falls back to LLM if confidence is low.
         """
-    
-        intent = self._llm_fallback_classify(user_query)
-        print(f"Handling user_query {user_query} with intent {intent}")
+        started = time.perf_counter()
+        intent, confidence = self._rule_based_classify(user_query)
+        confident = confidence >= self.threshold
+        self.stage_stats["rules"].record(confident, time.perf_counter() - started)
+
+        if confident:
+            print(f"Handling user_query {user_query} with intent {intent} (rules, confidence {confidence:.2f})")
+            return intent
+
+        await self._refresh_intent_prompt()
+        if self.router is not None:
+            started = time.perf_counter()
+            try:
+                intent, confidence = await self.router.aclassify(user_query)
+            except Exception as e:
+                print(f"[IntentDetector] Embedding router error: {e}")
+                confidence = 0.0
+            confident = confidence >= self.threshold
+            self.stage_stats["embedding"].record(confident, time.perf_counter() - started)
+
+            if confident:
+                print(f"Handling user_query {user_query} with intent {intent} (embedding, confidence {confidence:.2f})")
+                return intent
+
+        # Only ambiguous queries pay for the LLM round-trip
+        started = time.perf_counter()
+        intent = await self._llm_fallback_classify(user_query)
+        self.stage_stats["llm"].record(True, time.perf_counter() - started)
+        print(f"Handling user_query {user_query} with intent {intent} (llm)")
         return intent
 
 
-    def extract_event(self, user_query: str) -> EventCreate:
+    async def _refresh_intent_prompt(self):
+        """
+        Picks up an edited intent_prompt.j2 for the embedding and LLM stages at once: the router's
+        exemplars are re-embedded (in a worker thread) before the LLM stage's compiled template
+        and instructions are swapped, so the two never classify against different versions.
+        """
+        # Jinja re-compiles the template only when the file's mtime changed
+        template = self.jinja_env.get_template("intent_prompt.j2")
+        if template is self.intent_template:
+            return
+        async with self._intent_prompt_lock:
+            if template is self.intent_template:
+                return
+            if self.router is not None:
+                try:
+                    await asyncio.to_thread(self.router.reload)
+                except Exception as e:
+                    # The router retries on its next query; the LLM stage can move on regardless
+                    print(f"[IntentDetector] Embedding router reload error: {e!r}")
+            self.intent_instructions = render_block(template, "instructions")
+            self.intent_template = template
+
+
+    def cascade_stats(self) -> dict:
+        """
+        Returns per-stage hit rates and average latencies of the classification cascade.
         """
-        Extracts structured event information from the user's natural language query
-        using a prompt template and Ollama for LLM-based parsing.
+        return {name: stats.snapshot() for name, stats in self.stage_stats.items()}
+
+
+    def extraction_path_stats(self) -> dict:
+        """
+        Returns how many extractions the temporal parser resolved on its own, and what each path cost.
+        """
+        return {name: stats.snapshot() for name, stats in self.extraction_stats.items()}
+
+
+    async def extract_event(self, user_query: str) -> Union[EventCreate, list[EventCreate]]:
+        """
+        Extracts structured event information from the user's natural language query.
+        Messages the temporal parser fully resolves never reach the model; for the others
+        the LLM extracts the event and the parser's dates and times take precedence.
 
         Returns:
-            EventCreate: a structured Pydantic model instance containing event details.
+            EventCreate: a structured Pydantic model instance containing event details,
+            or a list of them when the message describes several events.
 
         Raises:
             ValueError: if the LLM response is not a valid JSON or can't be parsed.
         """
+        started = time.perf_counter()
+        parsed = self.temporal_parser.parse(user_query)
+        self.extraction_stats["rules"].record(parsed.complete, time.perf_counter() - started)
+        if parsed.complete:
+            print(f"Extracted event from {user_query!r} with rules")
+            return parsed.to_event()
+
+        started = time.perf_counter()
+        extract = self._llm_extract_event if self.structured_output_format else self._llm_extract_event_free_form
+        events = await extract(user_query, parsed)
+        self.extraction_stats["llm"].record(True, time.perf_counter() - started)
+        # Several events (e.g. "Mon–Fri 9am standup") are the model's call alone
+        return events if isinstance(events, list) else parsed.apply_to(events)
 
-        prompt_template = self.jinja_env.get_template("event_extraction_prompt.j2")
-        prompt = prompt_template.render(query=user_query)
 
+    async def _llm_extract_event(self, user_query: str, parsed: TemporalParse) -> Union[EventCreate, list[EventCreate]]:
+        """
+        Asks the model for an `ExtractedEvents` object, with its JSON schema as the output format.
+        The output is read as it streams and the stream is closed once the object is complete.
+        Fields that fail validation are repaired one by one; the model is asked again only when
+        a required field can't be repaired, at most `max_extraction_retries` times.
+        """
+        now = datetime.now(ZoneInfo(parsed.time_zone))
+        messages = self._messages(self.extraction_instructions, self.extraction_template, user_query, {"now": now.isoformat(timespec="minutes")})
+        self.structured_output.calls += 1
+        started = time.perf_counter()
         try:
-            response = ollama.chat(
+            for attempt in range(self.max_extraction_retries + 1):
+                if attempt:
+                    self.structured_output.retries += 1
+                response = await self.ollama_client.chat_json(
+                    model=self.classification_model,
+                    messages=messages,
+                    format=EXTRACTION_SCHEMA,
+                    # Temperature 0 for deterministic output; a retry needs a different generation
+                    options={"temperature": 0.3 if attempt else 0},
+                    stats_label="extraction"
+                )
+                scanner = response["scanner"]
+                text = scanner.closed_text()
+                self.structured_output.record_generation(response["stopped_early"], not scanner.complete and text is not None)
+
+                events = self._events_from_output(text, parsed, user_query)
+                if events:
+                    return events if len(events) > 1 else events[0]
+                print(f"[IntentDetector] Unusable extraction output: {scanner.text!r}")
+        except Exception as e:
+            print(f"[IntentDetector] Event extraction failed: {e!r}")
+        finally:
+            self.structured_output.latency.observe(time.perf_counter() - started)
+
+        self.structured_output.failures += 1
+        raise ValueError("Could not extract event data")
+
+
+    async def _llm_extract_event_free_form(self, user_query: str, parsed: TemporalParse) -> Union[EventCreate, list[EventCreate]]:
+        """
+        Extraction without an output format: one generation, read whole and accepted only if it is valid as-is.
+        """
+        now = datetime.now(ZoneInfo(parsed.time_zone))
+        self.structured_output.calls += 1
+        started = time.perf_counter()
+        try:
+            response = await self.ollama_client.chat(
                 model=self.classification_model,
-                messages=[{"role": "user", "content": prompt}],
-                options={"temperature": 0}  # Setting temperature to 0 for deterministic output
+                messages=self._messages(self.extraction_instructions, self.extraction_template, user_query, {"now": now.isoformat(timespec="minutes")}),
+                options={"temperature": 0},
+                stats_label="extraction"
             )
-            content = response['message']['content'].strip()
-            event_dict = json.loads(content)  # Parse LLM output as JSON
-
-            for field in ["summary", "start_time", "end_time"]:
-                if field not in event_dict:
-                    raise ValueError(f"Missing required field: '{field}' in model response.")
-                
-            return EventCreate(**event_dict)
-        
-        except json.JSONDecodeError:
-            print(f"[IntentDetector] Failed to parse JSON: {content}")
-            raise ValueError("LLM did not return valid JSON.")
-        except ValidationError as ve:
-            print(f"[IntentDetector] Validation error: {ve}")
-            raise ValueError("Response JSON does not match expected EventCreate structure.")
-        except Exception as e:
+            self.structured_output.record_generation(False, False)
+            payload = json.loads(response['message']['content'].strip())
+            event_dicts = payload.get("events") if isinstance(payload, dict) else None
+            if not event_dicts:
+                raise ValueError("Model response contains no events.")
+            events = [EventCreate(**event_dict) for event_dict in event_dicts]
+            return events if len(events) > 1 else events[0]
+        except (ValueError, ValidationError, TypeError, AttributeError) as e:
             print(f"[IntentDetector] Event extraction failed: {e}")
+            self.structured_output.failures += 1
             raise ValueError("Could not extract event data")
+        finally:
+            self.structured_output.latency.observe(time.perf_counter() - started)
+
+
+    def _events_from_output(self, text: Optional[str], parsed: TemporalParse, user_query: str) -> Optional[list[EventCreate]]:
+        """
+        The events of a (possibly closed-off) model output, repaired; None if it has none or one can't be repaired.
+        """
+        try:
+            payload = json.loads(text) if text else None
+        except ValueError:
+            return None
+        event_dicts = payload.get("events") if isinstance(payload, dict) else None
+        if not isinstance(event_dicts, list):
+            return None
 
+        events = []
+        for event_dict in event_dicts:
+            event = self._repair_event(event_dict, parsed, user_query) if isinstance(event_dict, dict) else None
+            if event is None:
+                return None
+            events.append(event)
+        return events or None
 
-    def __rule_based_classify(self, user_query: str) -> Tuple[UserIntent, float]:
+
+    def _repair_event(self, event_dict: dict, parsed: TemporalParse, user_query: str) -> Optional[EventCreate]:
+        """
+        Validates one extracted event, replacing each invalid field instead of discarding the event.
+
+        - summary (also when blank): the temporal parser's summary, or the start of the message
+        - start_time: the parser's start, if it found one; otherwise the event can't be repaired
+        - end_time (also when not after the start): the parser's end, or start + the default duration
+        - time_zone (also when not a known zone): the parser's zone
+        - attendees_emails: the entries that are email addresses
+        - description, location, recurrence (also when not an RRULE): dropped
+        """
+        event_dict = dict(event_dict)
+        repaired = []
+        for _ in range(len(EventCreate.model_fields)):
+            try:
+                event = EventCreate(**event_dict)
+            except ValidationError as e:
+                invalid = {error["loc"][0] for error in e.errors() if error["loc"]}
+            else:
+                invalid = set()
+                if not event.summary.strip():
+                    invalid.add("summary")
+                if not is_time_zone(event.time_zone or "UTC"):
+                    invalid.add("time_zone")
+                start, end = event.start_time, event.end_time
+                if (start.tzinfo is None) != (end.tzinfo is None):
+                    start, end = start.replace(tzinfo=None), end.replace(tzinfo=None)
+                if end <= start:
+                    invalid.add("end_time")
+                if any(not _EMAIL.fullmatch(email) for email in event.attendees_emails or []):
+                    invalid.add("attendees_emails")
+                if event.recurrence and not event.recurrence.startswith("RRULE:"):
+                    invalid.add("recurrence")
+                if not invalid:
+                    if repaired:
+                        self.structured_output.record_repair(repaired)
+                    return event
+
+            # In model field order, so end_time is repaired against a valid start_time
+            for name in [name for name in EventCreate.model_fields if name in invalid]:
+                if name == "start_time" and parsed.start is None:
+                    return None
+                event_dict[name] = self._repaired_value(name, event_dict, parsed, user_query)
+                repaired.append(name)
+        return None
+
+
+    def _repaired_value(self, name: str, event_dict: dict, parsed: TemporalParse, user_query: str):
+        if name == "summary":
+            return parsed.summary or " ".join(user_query.split()[:8])
+        if name == "start_time":
+            return parsed.start
+        if name == "end_time":
+            start = TypeAdapter(datetime).validate_python(event_dict.get("start_time"))
+            if parsed.start is not None and parsed.start == start:
+                return parsed.end
+            return start + self.temporal_parser.default_duration
+        if name == "time_zone":
+            return parsed.time_zone
+        if name == "attendees_emails":
+            emails = event_dict.get("attendees_emails")
+            return [email.strip() for email in emails if isinstance(email, str) and _EMAIL.fullmatch(email.strip())] if isinstance(emails, list) else []
+        return None
+
+
+    def _rule_based_classify(self, user_query: str) -> Tuple[UserIntent, float]:
         """
         A quick keyword-based heuristic classifier for common calendar intents.
         It outputs a confidence score to guide fallback decisions.
 
+        Conflicting cues (e.g. "schedule" in "what do I have scheduled") lower the
+        confidence by the runner-up's score so such queries fall through to the LLM.
+
         Returns:
             Tuple[UserIntent, float]: Best-guess intent and associated confidence
         """
-        query = user_query.lower()
-
-        scores = {
-            UserIntent.CREATE_EVENT: 0,
-            UserIntent.QUERY_CALENDAR: 0,
-            UserIntent.GENERAL: 0
-        }
-
-        # Simple heuristic: If query contains scheduling-related keywords
-        if any(kw in query for kw in ["schedule", "create", "book"]):
-            scores[UserIntent.CREATE_EVENT] += 0.7
-        if "meeting" in query:
-            scores[UserIntent.CREATE_EVENT] += 0.2
+        query = " ".join(user_query.lower().replace("\u2019", "'").split())
 
-        if any(kw in query for kw in ["what's on", "do i have", "upcoming", "schedule"]):
-            scores[UserIntent.QUERY_CALENDAR] += 0.7
-
-        if any(kw not in query for kw in ["schedule", "create", "book", "what's on", "do i have", "upcoming", "schedule", "meeting"]):
-            scores[UserIntent.GENERAL] += 0.8
+        scores = {intent: 0.0 for intent in INTENT_RULES}
+        for intent, rules in INTENT_RULES.items():
+            for pattern, weight in rules:
+                if pattern.search(query):
+                    scores[intent] += weight
 
         # Choose the intent with the highest score
-        best_intent = max(scores, key=scores.get)
-        best_score = scores[best_intent]
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        best_intent, runner_up = ranked[0], ranked[1]
+        best_score = min(scores[best_intent], 1.0)
 
         if best_score == 0:
             return UserIntent.GENERAL, 0.0
 
-        return best_intent, best_score
+        return best_intent, max(best_score - scores[runner_up], 0.0)
 
 
-    def _llm_fallback_classify(self, user_query: str) -> UserIntent:
+    async def _llm_fallback_classify(self, user_query: str) -> UserIntent:
         """
         Uses an LLM (via Ollama) to classify intent when rule-based confidence is low.
         This relies on a well-crafted prompt template for consistent labels.
         """
-        prompt_template = self.jinja_env.get_template("intent_prompt.j2")
-        prompt = prompt_template.render(query=user_query)
-
         try:
-            response = ollama.chat(
+            response = await self.ollama_client.chat(
                 model=self.classification_model,
-                messages=[{"role": "user", "content": prompt}],
-                options={"temperature": 0}
+                messages=self._messages(self.intent_instructions, self.intent_template, user_query),
+                options={"temperature": 0},
+                stats_label="intent"
             )
             label = response['message']['content'].strip().lower()
 
@@ -139,5 +460,14 @@ class IntentDetector:
             }
             return mapping.get(label, UserIntent.GENERAL)
         except Exception as e:
-            print(f"[IntentDetector] Ollama error: {e}")
+            print(f"[IntentDetector] Ollama error: {e!r}")
             return UserIntent.GENERAL
+
+
+    @staticmethod
+    def _messages(instructions: str, template, user_query: str, variables: Optional[dict] = None) -> list:
+        # Static instructions first, the per-query part last, so consecutive calls share their prefix
+        return [
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": render_block(template, "request", {"query": user_query, **(variables or {})})},
+        ]
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Optional
+from agent.service.metrics import Histogram
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # intent classification, event extraction: short calls on the routing path
+    STREAMING = 1    # streamed answers
+    BACKGROUND = 2   # rolling history summaries
+
+
+# The session a model call is made for; QueryPipeline.run sets it for everything it awaits
+current_session: ContextVar[str] = ContextVar("llm_session", default="")
+
+
+class SchedulerBusy(Exception):
+    """
+    Raised when the scheduler sheds a new request because too many are already waiting.
+    """
+
+
+class LLMScheduler:
+    """
+    Admission control in front of the local model server.
+
+    - At most `max_concurrency` model calls run at once; the rest wait in line.
+    - A free slot goes to the highest waiting priority class first, so short routing
+      calls overtake queued answer streams and summaries.
+    - Within a class, sessions take turns (round robin) and each session's own calls
+      keep their order, so one chatty session cannot push the others back.
+    - `check_admission()` sheds new turns once `max_queue_depth` calls are waiting.
+    - A caller cancelled while waiting (e.g. its client disconnected) leaves the line;
+      one cancelled while holding a slot gives it back when its context exits.
+
+    Instances are bound to the event loop that drives them.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_queue_depth: int = 32):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.shed = 0
+        self.cancelled_waits = 0
+        self.granted = {priority: 0 for priority in Priority}
+        self.queue_wait = {priority: Histogram() for priority in Priority}
+
+        # priority -> session id -> waiters (futures) of that session, in arrival order
+        self._lines = {priority: OrderedDict() for priority in Priority}
+
+
+    def check_admission(self):
+        """
+        Raises:
+            SchedulerBusy: if the waiting line is full; the caller should tell the user to retry shortly.
+        """
+        if self.waiting >= self.max_queue_depth:
+            self.shed += 1
+            raise SchedulerBusy(f"{self.waiting} model calls are already waiting")
+
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, session_id: Optional[str] = None):
+        await self.acquire(priority, session_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+    async def acquire(self, priority: Priority, session_id: Optional[str] = None):
+        started = time.perf_counter()
+        if self.active < self.max_concurrency and not self.waiting:
+            self.active += 1
+        else:
+            session_id = session_id if session_id is not None else current_session.get()
+            future = asyncio.get_running_loop().create_future()
+            self._lines[priority].setdefault(session_id, deque()).append(future)
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was handed over just as we were cancelled: pass it on
+                    self.release()
+                else:
+                    self._leave_line(priority, session_id, future)
+                    self.cancelled_waits += 1
+                raise
+
+        self.granted[priority] += 1
+        self.queue_wait[priority].observe(time.perf_counter() - started)
+
+
+    def release(self):
+        self.active -= 1
+        while self.active < self.max_concurrency and self.waiting:
+            future = self._next_waiter()
+            self.waiting -= 1
+            if future.cancelled():
+                continue  # its caller was cancelled and is about to leave the line
+            self.active += 1
+            future.set_result(None)
+
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "shed": self.shed,
+            "cancelled_waits": self.cancelled_waits,
+            "granted": {priority.name.lower(): count for priority, count in self.granted.items()},
+            "queue_wait_ms": {
+                priority.name.lower(): {"p50": round(h.quantile(0.5) * 1000, 1), "p99": round(h.quantile(0.99) * 1000, 1)}
+                for priority, h in self.queue_wait.items()
+            },
+        }
+
+
+    def render(self, prefix: str = "assistant") -> str:
+        """
+        Scheduler counters and gauges in the Prometheus text format, appended to the /metrics output.
+        """
+        name = f"{prefix}_llm_scheduler"
+        lines = [
+            f"# HELP {name}_granted_total Model calls admitted, by priority class.",
+            f"# TYPE {name}_granted_total counter",
+        ]
+        for priority, count in self.granted.items():
+            lines.append(f'{name}_granted_total{{priority="{priority.name.lower()}"}} {count}')
+        for metric, kind, help_text, value in (
+            ("shed_total", "counter", "Turns turned away because the waiting line was full.", self.shed),
+            ("cancelled_waits_total", "counter", "Callers that left the line before getting a slot.", self.cancelled_waits),
+            ("active", "gauge", "Model calls running.", self.active),
+            ("waiting", "gauge", "Model calls waiting for a slot.", self.waiting),
+        ):
+            lines.append(f"# HELP {name}_{metric} {help_text}")
+            lines.append(f"# TYPE {name}_{metric} {kind}")
+            lines.append(f"{name}_{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+    def _next_waiter(self) -> asyncio.Future:
+        for priority in Priority:
+            line = self._lines[priority]
+            if line:
+                session_id, waiters = next(iter(line.items()))
+                future = waiters.popleft()
+                # The session moves to the back of its class, behind the others waiting
+                del line[session_id]
+                if waiters:
+                    line[session_id] = waiters
+                return future
+        raise RuntimeError("No caller is waiting")
+
+
+    def _leave_line(self, priority: Priority, session_id: str, future: asyncio.Future):
+        waiters = self._lines[priority].get(session_id)
+        if waiters is not None and future in waiters:
+            waiters.remove(future)
+            self.waiting -= 1
+            if not waiters:
+                del self._lines[priority][session_id]
@@ -0,0 +1,146 @@
+import bisect
+import threading
+from typing import Optional
+
+# Seconds; spans sub-millisecond rule hits up to slow LLM calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+THROUGHPUT_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 100, 150, 200)
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram in the Prometheus layout (cumulative `le` buckets, sum, count).
+
+    Recording an observation is a bisect plus a few additions under a lock, which is
+    cheap enough to leave on in production. Quantiles are estimated by linear
+    interpolation inside the matching bucket, like Prometheus' histogram_quantile().
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+    def state(self) -> tuple[list, float, int]:
+        """
+        Consistent copy of (per-bucket counts, sum, count).
+        """
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+    def quantile(self, q: float) -> float:
+        counts, _, total = self.state()
+        if not total:
+            return 0.0
+
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]  # beyond the last bound, like histogram_quantile
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+class PipelineMetrics:
+    """
+    Per-stage latency histograms for QueryPipeline, labelled by stage and intent.
+
+    - `stage_seconds`: intent classification, event extraction, calendar API, vector retrieval, prompt rendering
+    - `ttft_seconds`: time from receiving the query to the first streamed chunk
+    - `tokens_per_second`: generation speed of the streamed answer
+
+    `render()` produces the Prometheus text exposition format for the /metrics route;
+    `snapshot()` reports p50/p99 per series for benchmarks and quick inspection.
+    """
+
+    PREFIX = "assistant"
+
+    def __init__(self):
+        self.stage_seconds = {}      # (stage, intent) -> Histogram
+        self.ttft_seconds = {}       # intent -> Histogram
+        self.tokens_per_second = {}  # intent -> Histogram
+        self._lock = threading.Lock()
+
+
+    def observe_stage(self, stage: str, seconds: float, intent: Optional[str] = None):
+        self._series(self.stage_seconds, (stage, intent or "unknown"), LATENCY_BUCKETS).observe(seconds)
+
+
+    def observe_ttft(self, intent: str, seconds: float):
+        self._series(self.ttft_seconds, intent, LATENCY_BUCKETS).observe(seconds)
+
+
+    def observe_tokens_per_second(self, intent: str, rate: float):
+        self._series(self.tokens_per_second, intent, THROUGHPUT_BUCKETS).observe(rate)
+
+
+    def snapshot(self) -> dict:
+        def summary(histogram: Histogram, scale: float = 1.0) -> dict:
+            return {
+                "count": histogram.count,
+                "p50": round(histogram.quantile(0.5) * scale, 3),
+                "p99": round(histogram.quantile(0.99) * scale, 3),
+            }
+
+        return {
+            "stage_ms": {f"{stage}/{intent}": summary(h, 1000) for (stage, intent), h in sorted(self.stage_seconds.copy().items())},
+            "ttft_ms": {intent: summary(h, 1000) for intent, h in sorted(self.ttft_seconds.copy().items())},
+            "tokens_per_second": {intent: summary(h) for intent, h in sorted(self.tokens_per_second.copy().items())},
+        }
+
+
+    def render(self) -> str:
+        lines = []
+        self._render_family(
+            lines, "stage_duration_seconds", "Latency of each query pipeline stage.",
+            {f'stage="{stage}",intent="{intent}"': h for (stage, intent), h in sorted(self.stage_seconds.copy().items())},
+        )
+        self._render_family(
+            lines, "time_to_first_token_seconds", "Time from receiving a query to its first streamed chunk.",
+            {f'intent="{intent}"': h for intent, h in sorted(self.ttft_seconds.copy().items())},
+        )
+        self._render_family(
+            lines, "tokens_per_second", "Generation speed of streamed answers.",
+            {f'intent="{intent}"': h for intent, h in sorted(self.tokens_per_second.copy().items())},
+        )
+        return "\n".join(lines) + "\n"
+
+
+    def _series(self, family: dict, key, buckets: tuple) -> Histogram:
+        histogram = family.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = family.setdefault(key, Histogram(buckets))
+        return histogram
+
+
+    def _render_family(self, lines: list, name: str, help_text: str, series: dict):
+        name = f"{self.PREFIX}_{name}"
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in series.items():
+            counts, value_sum, total = histogram.state()
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {total}')
+            lines.append(f"{name}_sum{{{labels}}} {value_sum:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {total}")
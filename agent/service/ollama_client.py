@@ -0,0 +1,218 @@
+import asyncio
+from typing import Optional
+import ollama
+from agent.service.llm_scheduler import LLMScheduler, Priority
+from agent.service.structured_output import JsonStreamScanner
+
+
+class PromptEvalStats:
+    """
+    Aggregates the timing fields Ollama returns with each generation, per call site.
+
+    `prompt_eval_count` only counts prompt tokens the server actually evaluated; tokens
+    served from a reused KV-cache prefix are left out. Comparing it against the
+    approximate prompt size shows how much of each prompt hit the cache.
+    """
+
+    def __init__(self):
+        self.sites = {}
+
+
+    def record(self, label: str, response, prompt_chars: int = 0):
+        prompt_eval_count = _field(response, "prompt_eval_count")
+        if prompt_eval_count is None:
+            return
+        site = self.sites.setdefault(label, {
+            "calls": 0, "prompt_tokens_approx": 0, "prompt_eval_count": 0,
+            "prompt_eval_duration_ns": 0, "eval_count": 0, "eval_duration_ns": 0,
+        })
+        site["calls"] += 1
+        site["prompt_tokens_approx"] += prompt_chars // 4
+        site["prompt_eval_count"] += prompt_eval_count
+        site["prompt_eval_duration_ns"] += _field(response, "prompt_eval_duration") or 0
+        site["eval_count"] += _field(response, "eval_count") or 0
+        site["eval_duration_ns"] += _field(response, "eval_duration") or 0
+
+
+    def snapshot(self) -> dict:
+        report = {}
+        for label, site in self.sites.items():
+            calls = site["calls"]
+            report[label] = {
+                "calls": calls,
+                "avg_prompt_tokens_approx": round(site["prompt_tokens_approx"] / calls, 1),
+                "avg_prompt_eval_count": round(site["prompt_eval_count"] / calls, 1),
+                "avg_prompt_eval_ms": round(site["prompt_eval_duration_ns"] / calls / 1e6, 2),
+                "avg_eval_count": round(site["eval_count"] / calls, 1),
+                "avg_eval_ms": round(site["eval_duration_ns"] / calls / 1e6, 2),
+            }
+        return report
+
+
+    def render(self, prefix: str = "assistant") -> str:
+        """
+        Per-call-site prompt and generation totals in the Prometheus text format, appended to the
+        /metrics output. `prompt_eval_tokens_total` over `prompt_tokens_approx_total` is the share
+        of prompt tokens the server had to evaluate, i.e. not served from its cached prefix.
+        """
+        name = f"{prefix}_prompt_eval"
+        lines = []
+        for metric, help_text, field, scale in (
+            ("calls_total", "Generations measured.", "calls", 1),
+            ("prompt_tokens_approx_total", "Approximate prompt tokens sent.", "prompt_tokens_approx", 1),
+            ("prompt_eval_tokens_total", "Prompt tokens the server evaluated (cached prefix tokens excluded).", "prompt_eval_count", 1),
+            ("prompt_eval_seconds_total", "Time spent evaluating prompts.", "prompt_eval_duration_ns", 1e9),
+            ("eval_tokens_total", "Tokens generated.", "eval_count", 1),
+            ("eval_seconds_total", "Time spent generating.", "eval_duration_ns", 1e9),
+        ):
+            lines.append(f"# HELP {name}_{metric} {help_text}")
+            lines.append(f"# TYPE {name}_{metric} counter")
+            for label, site in sorted(self.sites.items()):
+                value = site[field] / scale if scale != 1 else site[field]
+                lines.append(f'{name}_{metric}{{site="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def _field(response, name: str):
+    # ollama returns typed responses, langchain hands back plain response_metadata dicts
+    if isinstance(response, dict):
+        return response.get(name)
+    return getattr(response, name, None)
+
+
+class AsyncOllamaClient:
+    """
+    Non-blocking access to the local Ollama server for the short, structured calls
+    (intent classification, event extraction) made while a request is being routed.
+
+    - Wraps `ollama.AsyncClient`, so awaiting a generation yields the event loop to
+      the other WebSocket sessions instead of blocking it.
+    - Can share the pooled httpx connection of a `ChatOllama` instance, so the
+      pipeline keeps a single keep-alive pool to the model server.
+    - Caps the number of concurrent calls and applies a per-call timeout. With a
+      `scheduler`, calls instead take interactive-priority slots of the model
+      server shared with the streamed answers.
+    - `chat_json` streams a JSON-constrained generation and stops reading as soon as
+      the top-level object is complete.
+    - Optionally records prompt-eval statistics per call site (`prompt_stats`).
+    """
+
+    def __init__(
+        self,
+        client: Optional[ollama.AsyncClient] = None,
+        max_concurrency: int = 4,
+        timeout: float = 30.0,
+        prompt_stats: Optional[PromptEvalStats] = None,
+        scheduler: Optional[LLMScheduler] = None,
+    ):
+        self.client = client or ollama.AsyncClient()
+        self.prompt_stats = prompt_stats
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+
+
+    @classmethod
+    def from_chat_model(cls, chat_model, **kwargs) -> "AsyncOllamaClient":
+        """
+        Reuses the `ollama.AsyncClient` (and therefore the httpx connection pool)
+        that langchain's `ChatOllama` created for itself.
+        """
+        return cls(client=chat_model._async_client, **kwargs)
+
+
+    async def chat(
+        self,
+        model: str,
+        messages: list,
+        options: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        stats_label: str = "chat",
+        **kwargs
+    ):
+        """
+        Runs a non-streaming chat completion.
+
+        Raises:
+            asyncio.TimeoutError: if the call does not finish within `timeout` seconds
+                (the client default is used when omitted). Time spent waiting for a
+                concurrency slot counts towards the timeout.
+        """
+        response = await asyncio.wait_for(
+            self._bounded(model=model, messages=messages, options=options, **kwargs),
+            timeout=timeout if timeout is not None else self.timeout,
+        )
+        if self.prompt_stats is not None:
+            self.prompt_stats.record(stats_label, response, sum(len(message["content"]) for message in messages))
+        return response
+
+
+    async def chat_json(
+        self,
+        model: str,
+        messages: list,
+        format,
+        options: Optional[dict] = None,
+        timeout: Optional[float] = None,
+        stats_label: str = "chat",
+    ) -> dict:
+        """
+        Runs a streaming chat completion constrained by `format` (a JSON schema, or "json")
+        and returns as soon as the top-level JSON object is complete; the rest of the
+        generation is cancelled by closing the stream.
+
+        Returns:
+            dict: the ollama-style response; `message.content` holds the object text, `scanner`
+            the JsonStreamScanner (incomplete if the generation ended first), and `stopped_early`
+            whether the stream was closed before the model finished.
+
+        Raises:
+            asyncio.TimeoutError: as for `chat`.
+        """
+        response = await asyncio.wait_for(
+            self._bounded_json(model=model, messages=messages, options=options, format=format),
+            timeout=timeout if timeout is not None else self.timeout,
+        )
+        if self.prompt_stats is not None:
+            self.prompt_stats.record(stats_label, response, sum(len(message["content"]) for message in messages))
+        return response
+
+
+    def _slot(self):
+        return self.scheduler.slot(Priority.INTERACTIVE) if self.scheduler is not None else self._semaphore
+
+
+    async def _bounded(self, **chat_kwargs):
+        async with self._slot():
+            self.in_flight += 1
+            try:
+                return await self.client.chat(**chat_kwargs)
+            finally:
+                self.in_flight -= 1
+
+
+    async def _bounded_json(self, **chat_kwargs) -> dict:
+        scanner = JsonStreamScanner()
+        async with self._slot():
+            self.in_flight += 1
+            try:
+                stream = await self.client.chat(stream=True, **chat_kwargs)
+                last = {}
+                try:
+                    async for chunk in stream:
+                        last = chunk
+                        # In measurement mode the stream is read to the end, for the timing fields of its final chunk
+                        if scanner.feed(chunk["message"]["content"]) and self.prompt_stats is None:
+                            break
+                finally:
+                    # Closing the stream closes the HTTP response, which makes Ollama stop generating
+                    await stream.aclose()
+            finally:
+                self.in_flight -= 1
+
+        # The timing fields only come with the final chunk, when the model finished on its own
+        response = {field: _field(last, field) for field in ("done", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")}
+        response.update(message={"role": "assistant", "content": scanner.text}, scanner=scanner, stopped_early=not response["done"])
+        return response
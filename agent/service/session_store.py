@@ -0,0 +1,528 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Sequence
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict, messages_to_dict
+
+
+class SessionStore:
+    """
+    Bounded, per-process store of conversation histories keyed by session id.
+
+    - At most `max_sessions` histories stay resident; the least recently used one is
+      spilled to disk when a new session would exceed the limit.
+    - Sessions idle for longer than `idle_ttl` seconds are spilled on the next access to the store.
+    - A session in use is pinned: `acquire()` (a connection opening, a turn starting) adds a
+      reference and `release()` drops it. Pinned sessions are never evicted, and a session
+      is spilled by `release()` only once its last reference is gone (e.g. the last of
+      several connections resuming the same session id disconnects).
+    - A session has one history object: if something still holds a spilled history, the
+      next access restores that same object rather than a copy, so no write is lost.
+
+    Spilled sessions live in a single SQLite file as zlib-compressed JSON and are restored
+    transparently the next time their id is requested. Spilled sessions untouched for
+    `spill_ttl` seconds are deleted for good.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        idle_ttl: float = 30 * 60,
+        spill_path: str = "sessions.sqlite3",
+        spill_ttl: float = 7 * 24 * 60 * 60,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.spill_ttl = spill_ttl
+
+        self._sessions = OrderedDict()  # session_id -> [history, last_used, references], oldest first
+        self._histories = weakref.WeakValueDictionary()  # session_id -> history, resident or still referenced
+        self._lock = threading.RLock()
+        self.spilled = 0
+        self.restored = 0
+
+        self._db = sqlite3.connect(spill_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spilled_sessions (session_id TEXT PRIMARY KEY, payload BLOB NOT NULL, spilled_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+
+    def get(self, session_id: str) -> ChatMessageHistory:
+        """
+        Returns the history for a session, restoring it from disk or creating it as needed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+
+            return self._entry(session_id, now)[0]
+
+
+    def acquire(self, session_id: str) -> ChatMessageHistory:
+        """
+        Pins a session in memory until the matching `release()`, and returns its history.
+        """
+        with self._lock:
+            entry = self._entry(session_id, time.monotonic())
+            entry[2] += 1
+            return entry[0]
+
+
+    def release(self, session_id: str, spill: bool = True):
+        """
+        Drops one reference to a session. Once none is left, the session is spilled so it can be
+        resumed (e.g. on WebSocket disconnect), or, with `spill=False` (the end of a turn),
+        left resident for the LRU and idle eviction to handle.
+        """
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            entry[2] = max(entry[2] - 1, 0)
+            if not entry[2] and spill:
+                del self._sessions[session_id]
+                self._spill(session_id, entry[0])
+
+
+    def replace_prefix(self, session_id: str, prefix: Sequence[BaseMessage], messages: Sequence[BaseMessage]) -> bool:
+        """
+        Replaces the first messages of a session, if they are still `prefix`, with `messages` in one
+        step, leaving everything after them untouched. Returns False when the history has changed
+        underneath (e.g. it was folded or cleared meanwhile) and nothing was replaced.
+        """
+        with self._lock:
+            history = self._histories.get(session_id)
+            if history is not None:
+                if history.messages[:len(prefix)] != list(prefix):
+                    return False
+                history.messages[:len(prefix)] = messages
+                return True
+
+            row = self._db.execute("SELECT payload FROM spilled_sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return False
+            stored = messages_from_dict(json.loads(zlib.decompress(row[0])))
+            if stored[:len(prefix)] != list(prefix):
+                return False
+            payload = zlib.compress(json.dumps(messages_to_dict(list(messages) + stored[len(prefix):]), separators=(",", ":")).encode("utf-8"))
+            self._db.execute("UPDATE spilled_sessions SET payload = ? WHERE session_id = ?", (payload, session_id))
+            self._db.commit()
+            return True
+
+
+    @property
+    def resident_sessions(self) -> int:
+        return len(self._sessions)
+
+
+    def resident_bytes(self) -> int:
+        """
+        Approximate memory held by resident histories (UTF-8 size of the message contents).
+        """
+        with self._lock:
+            return sum(
+                len(str(message.content).encode("utf-8"))
+                for history, _, _ in self._sessions.values()
+                for message in history.messages
+            )
+
+
+    def stats(self) -> dict:
+        return {
+            "resident_sessions": self.resident_sessions,
+            "pinned_sessions": sum(1 for entry in self._sessions.values() if entry[2]),
+            "resident_bytes": self.resident_bytes(),
+            "spilled": self.spilled,
+            "restored": self.restored,
+        }
+
+
+    def render(self, prefix: str = "assistant") -> str:
+        """
+        Resident-session gauges and spill counters in the Prometheus text format, appended to the /metrics output.
+        """
+        stats = self.stats()
+        name = f"{prefix}_session_store"
+        lines = []
+        for metric, kind, help_text, value in (
+            ("resident_sessions", "gauge", "Session histories held in memory.", stats["resident_sessions"]),
+            ("pinned_sessions", "gauge", "Resident sessions in use by a connection or a turn.", stats["pinned_sessions"]),
+            ("resident_bytes", "gauge", "Approximate size of the resident message contents.", stats["resident_bytes"]),
+            ("spilled_total", "counter", "Sessions spilled to disk.", stats["spilled"]),
+            ("restored_total", "counter", "Sessions restored from disk.", stats["restored"]),
+        ):
+            lines.append(f"# HELP {name}_{metric} {help_text}")
+            lines.append(f"# TYPE {name}_{metric} {kind}")
+            lines.append(f"{name}_{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+    def _entry(self, session_id: str, now: float) -> list:
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            entry[1] = now
+            self._sessions.move_to_end(session_id)
+            return entry
+
+        entry = self._sessions[session_id] = [self._restore(session_id), now, 0]
+        self._evict_lru()
+        return entry
+
+
+    def _evict_lru(self):
+        # Oldest first, skipping pinned sessions; if every session is pinned the store stays over the limit
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            history, _, references = self._sessions[session_id]
+            if not references:
+                del self._sessions[session_id]
+                self._spill(session_id, history)
+
+
+    def _evict_idle(self, now: float):
+        # The dict is ordered by last use, so idle sessions are always at the front
+        for session_id, (history, last_used, references) in list(self._sessions.items()):
+            if now - last_used < self.idle_ttl:
+                break
+            if not references:
+                del self._sessions[session_id]
+                self._spill(session_id, history)
+
+
+    def _spill(self, session_id: str, history: ChatMessageHistory):
+        if not history.messages:
+            return
+        payload = zlib.compress(json.dumps(messages_to_dict(history.messages), separators=(",", ":")).encode("utf-8"))
+        now = time.time()
+        self._db.execute(
+            "INSERT OR REPLACE INTO spilled_sessions (session_id, payload, spilled_at) VALUES (?, ?, ?)",
+            (session_id, payload, now)
+        )
+        self._db.execute("DELETE FROM spilled_sessions WHERE spilled_at < ?", (now - self.spill_ttl,))
+        self._db.commit()
+        self.spilled += 1
+
+
+    def _restore(self, session_id: str) -> ChatMessageHistory:
+        row = self._db.execute("SELECT payload FROM spilled_sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM spilled_sessions WHERE session_id = ?", (session_id,))
+            self._db.commit()
+            self.restored += 1
+
+        history = self._histories.get(session_id)
+        if history is None:
+            # Nothing holds the old object anymore: the spilled copy is the whole history
+            history = ChatMessageHistory(messages=messages_from_dict(json.loads(zlib.decompress(row[0])))) if row is not None else ChatMessageHistory()
+            self._histories[session_id] = history
+        # Otherwise the live object has everything that was spilled, plus anything written to it since
+        return history
+
+
+class SharedChatMessageHistory(BaseChatMessageHistory):
+    """
+    One session's history in a SharedSessionStore. Reads come from the database plus this
+    process's not-yet-flushed appends, so a worker always sees its own writes.
+    """
+
+    def __init__(self, store: "SharedSessionStore", session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        return self.store._read(self.session_id)
+
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store._append(self.session_id, messages)
+
+
+    def clear(self) -> None:
+        self.store._clear(self.session_id)
+
+
+class SharedSessionStore:
+    """
+    Session histories in a SQLite database in WAL mode, shared by every worker process on
+    the host, so a client that reconnects to another worker resumes the same conversation.
+
+    - Messages are stored one row each and only ever appended (folding replaces the oldest
+      rows in place), so a turn costs an INSERT, never a rewrite of the whole history.
+    - Appends are batched: a background writer commits everything queued by all sessions
+      of this process in one transaction every `flush_interval` seconds (or sooner, once
+      `max_batch` messages are queued). `flush_interval=0` commits each append directly.
+    - `release()` flushes, so a disconnecting client's last turn is visible to the other
+      workers by the time it can reconnect. Like SessionStore, `acquire()`/`release()` count
+      references, and a session's view is forgotten only once the last one is released.
+    - Sessions without new messages for `session_ttl` seconds are deleted.
+    """
+
+    def __init__(
+        self,
+        path: str = "shared_sessions.sqlite3",
+        flush_interval: float = 0.01,
+        max_batch: int = 512,
+        session_ttl: float = 7 * 24 * 60 * 60,
+        max_views: int = 1000,
+    ):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.session_ttl = session_ttl
+        self.max_views = max_views
+
+        self.appends = 0
+        self.reads = 0
+        self.commits = 0
+        self.committed_messages = 0
+
+        self._pending = []           # (session_id, message), in append order
+        self._unflushed = {}         # session_id -> messages queued but not yet committed
+        self._views = OrderedDict()  # session_id -> SharedChatMessageHistory, so a session keeps one identity
+        self._references = {}        # session_id -> acquire() calls not yet released
+        self._lock = threading.RLock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+        self._last_expiry = 0.0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        # WAL lets the workers read while one of them writes; NORMAL sync is durable across app crashes
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS session_messages (seq INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, payload TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS session_messages_session ON session_messages (session_id, seq)")
+        self._db.commit()
+
+        self._writer = None
+        if flush_interval > 0:
+            self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+            self._writer.start()
+
+
+    def get(self, session_id: str) -> SharedChatMessageHistory:
+        with self._lock:
+            view = self._views.get(session_id)
+            if view is None:
+                view = self._views[session_id] = SharedChatMessageHistory(self, session_id)
+                for oldest_id in list(self._views):
+                    if len(self._views) <= self.max_views:
+                        break
+                    if oldest_id != session_id and not self._references.get(oldest_id):
+                        del self._views[oldest_id]
+            self._views.move_to_end(session_id)
+            return view
+
+
+    def acquire(self, session_id: str) -> SharedChatMessageHistory:
+        with self._lock:
+            view = self.get(session_id)
+            self._references[session_id] = self._references.get(session_id, 0) + 1
+            return view
+
+
+    def release(self, session_id: str, spill: bool = True):
+        """
+        Drops one reference to a session. With `spill` (a disconnect), its appends are made visible
+        to every worker, and its view is forgotten once no reference is left.
+        """
+        if spill:
+            self.flush()
+        with self._lock:
+            references = self._references.get(session_id, 0) - 1
+            if references > 0:
+                self._references[session_id] = references
+                return
+            self._references.pop(session_id, None)
+            if spill:
+                self._views.pop(session_id, None)
+
+
+    def replace_prefix(self, session_id: str, prefix: Sequence[BaseMessage], messages: Sequence[BaseMessage]) -> bool:
+        """
+        Replaces the first messages of a session, if they are still `prefix`, with `messages` in one
+        transaction, so rows other workers append meanwhile are kept. Returns False when the
+        history has changed underneath and nothing was replaced.
+        """
+        if len(messages) > len(prefix):
+            raise ValueError("replace_prefix can only shrink the prefix")
+        with self._lock:
+            self._commit_pending()
+            try:
+                # BEGIN IMMEDIATE takes the write lock up front, so no other worker can fold or clear in between
+                self._db.execute("BEGIN IMMEDIATE")
+                rows = self._db.execute(
+                    "SELECT seq, payload FROM session_messages WHERE session_id = ? ORDER BY seq LIMIT ?", (session_id, len(prefix))
+                ).fetchall()
+                if not rows or messages_from_dict([json.loads(payload) for _, payload in rows]) != list(prefix):
+                    self._db.rollback()
+                    return False
+                self._db.execute("DELETE FROM session_messages WHERE session_id = ? AND seq <= ?", (session_id, rows[-1][0]))
+                # The replacement reuses the oldest seqs, so it still sorts before the messages it did not cover
+                now = time.time()
+                self._db.executemany(
+                    "INSERT INTO session_messages (seq, session_id, payload, created_at) VALUES (?, ?, ?, ?)",
+                    [(seq, session_id, json.dumps(message_to_dict(message), separators=(",", ":")), now) for (seq, _), message in zip(rows, messages)]
+                )
+                self._db.commit()
+            except sqlite3.Error:
+                self._db.rollback()
+                raise
+            return True
+
+
+    def flush(self):
+        with self._lock:
+            self._commit_pending()
+
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        if self._writer is not None:
+            self._writer.join()
+        self.flush()
+        self._db.close()
+
+
+    @property
+    def resident_sessions(self) -> int:
+        return len(self._views)
+
+
+    def stats(self) -> dict:
+        return {
+            "resident_sessions": self.resident_sessions,
+            "appends": self.appends,
+            "reads": self.reads,
+            "commits": self.commits,
+            "messages_per_commit": round(self.committed_messages / self.commits, 2) if self.commits else 0.0,
+            "pending": len(self._pending),
+        }
+
+
+    def render(self, prefix: str = "assistant") -> str:
+        """
+        Resident-session gauges and write-batching counters in the Prometheus text format, appended to the /metrics output.
+        """
+        name = f"{prefix}_session_store"
+        lines = []
+        for metric, kind, help_text, value in (
+            ("resident_sessions", "gauge", "Session histories with an in-process view.", self.resident_sessions),
+            ("pending_messages", "gauge", "Appended messages waiting for the next commit.", len(self._pending)),
+            ("appends_total", "counter", "Messages appended.", self.appends),
+            ("reads_total", "counter", "History reads from the database.", self.reads),
+            ("commits_total", "counter", "Write transactions committed.", self.commits),
+            ("committed_messages_total", "counter", "Messages committed.", self.committed_messages),
+        ):
+            lines.append(f"# HELP {name}_{metric} {help_text}")
+            lines.append(f"# TYPE {name}_{metric} {kind}")
+            lines.append(f"{name}_{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+    def _read(self, session_id: str) -> list[BaseMessage]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT payload FROM session_messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            unflushed = list(self._unflushed.get(session_id, ()))
+            self.reads += 1
+        return messages_from_dict([json.loads(payload) for payload, in rows]) + unflushed
+
+
+    def _append(self, session_id: str, messages: Sequence[BaseMessage]):
+        with self._lock:
+            for message in messages:
+                self._pending.append((session_id, message))
+            self._unflushed.setdefault(session_id, []).extend(messages)
+            self.appends += len(messages)
+            if self._writer is None:
+                self._commit_pending()
+            elif len(self._pending) >= self.max_batch:
+                self._wakeup.notify()
+
+
+    def _clear(self, session_id: str):
+        with self._lock:
+            # Queued appends precede the clear, so they go first
+            self._commit_pending()
+            self._db.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            self._db.commit()
+
+
+    def _write_loop(self):
+        with self._lock:
+            while not self._closed:
+                self._wakeup.wait(self.flush_interval)
+                try:
+                    self._commit_pending()
+                except sqlite3.Error as e:
+                    # Keep the queue; the next round retries
+                    print(f"[SharedSessionStore] Flush failed: {e!r}")
+
+
+    def _commit_pending(self):
+        if not self._pending:
+            return
+        now = time.time()
+        batch = self._pending
+        try:
+            self._db.executemany(
+                "INSERT INTO session_messages (session_id, payload, created_at) VALUES (?, ?, ?)",
+                [(session_id, json.dumps(message_to_dict(message), separators=(",", ":")), now) for session_id, message in batch]
+            )
+            self._db.commit()
+        except sqlite3.Error:
+            self._db.rollback()
+            raise
+
+        self._pending = []
+        self._unflushed.clear()
+        self.commits += 1
+        self.committed_messages += len(batch)
+        self._expire()
+
+
+    def _expire(self):
+        now = time.time()
+        if now - self._last_expiry < 60:
+            return
+        self._last_expiry = now
+        self._db.execute(
+            "DELETE FROM session_messages WHERE session_id IN (SELECT session_id FROM session_messages GROUP BY session_id HAVING MAX(created_at) < ?)",
+            (now - self.session_ttl,)
+        )
+        self._db.commit()
+
+
+def create_session_store(backend: str = None):
+    """
+    Builds the session-history backend named by `backend` (or the SESSION-BACKEND env var):
+    "memory" keeps histories in this process, "sqlite" shares them between workers.
+    """
+    backend = backend or os.getenv("SESSION-BACKEND", "memory")
+    if backend == "memory":
+        return SessionStore()
+    if backend == "sqlite":
+        return SharedSessionStore(os.getenv("SESSION-DB-PATH", "shared_sessions.sqlite3"))
+    raise ValueError(f"Unknown session backend: {backend}")
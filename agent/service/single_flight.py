@@ -0,0 +1,87 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls. While a call for (name, key) is in flight,
+    further callers with the same name and key await its result (or exception) instead
+    of starting their own upstream call.
+
+    - The call runs as its own task, so a caller that goes away (cancelled request,
+      closed WebSocket) does not cancel it for the others; it is cancelled only once
+      every caller waiting on it is gone.
+    - Results are not kept once the call finishes: this removes duplicate concurrent
+      work, it is not a cache.
+    - Per `name`, `stats()` reports calls, upstream calls and the calls avoided.
+
+    Instances are bound to the event loop that drives them.
+    """
+
+    def __init__(self):
+        self._flights = {}  # (name, key) -> [task, callers waiting on it]
+        self._counters = {}  # name -> [calls, upstream calls]
+
+
+    async def do(self, name: str, key, call):
+        """
+        Returns the result of `call()` (a coroutine function), shared with concurrent callers of the same name and key.
+        """
+        flight_key = (name, key)
+        counters = self._counters.setdefault(name, [0, 0])
+        counters[0] += 1
+
+        flight = self._flights.get(flight_key)
+        if flight is None:
+            counters[1] += 1
+            task = asyncio.ensure_future(call())
+            flight = self._flights[flight_key] = [task, 0]
+            task.add_done_callback(lambda t: self._finish(flight_key, t))
+
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0])
+        except asyncio.CancelledError:
+            if flight[1] == 1 and not flight[0].done():
+                # The last caller is gone, so nobody needs the result
+                self._forget(flight_key, flight[0])
+                flight[0].cancel()
+            raise
+        finally:
+            flight[1] -= 1
+
+
+    def stats(self) -> dict:
+        return {
+            name: {"calls": calls, "upstream_calls": upstream, "avoided": calls - upstream}
+            for name, (calls, upstream) in sorted(self._counters.copy().items())
+        }
+
+
+    def render(self, prefix: str = "assistant") -> str:
+        """
+        Per-stage call counters in the Prometheus text format, appended to the /metrics output.
+        """
+        lines = []
+        for metric, help_text, field in (
+            ("calls_total", "Calls to coalesced pipeline stages.", "calls"),
+            ("upstream_calls_total", "Calls that reached the upstream service.", "upstream_calls"),
+            ("avoided_calls_total", "Calls that joined an identical call in flight.", "avoided"),
+        ):
+            name = f"{prefix}_single_flight_{metric}"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, counts in self.stats().items():
+                lines.append(f'{name}{{stage="{stage}"}} {counts[field]}')
+        return "\n".join(lines) + "\n"
+
+
+    def _finish(self, flight_key, task: asyncio.Task):
+        self._forget(flight_key, task)
+        # Retrieve the outcome so a failure nobody awaited anymore is not reported as unhandled
+        task.cancelled() or task.exception()
+
+
+    def _forget(self, flight_key, task: asyncio.Task):
+        flight = self._flights.get(flight_key)
+        if flight is not None and flight[0] is task:
+            del self._flights[flight_key]
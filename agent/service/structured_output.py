@@ -0,0 +1,127 @@
+from typing import Optional
+from agent.service.metrics import Histogram
+
+_CLOSING = {"{": "}", "[": "]"}
+
+
+class JsonStreamScanner:
+    """
+    Follows streamed JSON text chunk by chunk and tells when the top-level object is complete,
+    so the caller can stop reading (constrained decoding tends to pad the output with
+    whitespace until it reaches EOS or the token limit).
+
+    - Text before the first `{` or `[` and after the closing one is ignored.
+    - It remembers the last point where the text could be cut and closed (after a complete
+      member or element), so `closed_text()` can salvage an output cut off mid-way,
+      dropping only the unfinished member.
+    """
+
+    def __init__(self):
+        self.complete = False
+        self._chars = []
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._safe_point = None  # (text length, containers open there)
+
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Returns True once the top-level value is complete.
+        """
+        for char in chunk:
+            if self.complete:
+                break
+            if not self._stack and char not in _CLOSING:
+                continue  # preamble before the value starts
+            self._chars.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in _CLOSING:
+                self._stack.append(char)
+            elif char in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    self.complete = True
+                else:
+                    self._safe_point = (len(self._chars), list(self._stack))
+            elif char == ",":
+                self._safe_point = (len(self._chars) - 1, list(self._stack))
+        return self.complete
+
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chars)
+
+
+    def closed_text(self) -> Optional[str]:
+        """
+        The complete value, or the text up to the last safe point with the open containers closed; None if there is none.
+        """
+        if self.complete:
+            return self.text
+        if self._safe_point is None:
+            return None
+        length, stack = self._safe_point
+        return "".join(self._chars[:length]) + "".join(_CLOSING[opening] for opening in reversed(stack))
+
+
+class StructuredOutputStats:
+    """
+    Outcome counters and latency of schema-constrained extraction calls.
+
+    - `truncated`: the output ended before the object was complete and was closed by the scanner.
+    - `repaired_fields`: fields that failed validation and were fixed in place.
+    - `retries`: full regenerations, only when a required field could not be repaired.
+    - `failures`: extractions that gave up and raised.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.generations = 0
+        self.stopped_early = 0
+        self.truncated = 0
+        self.repaired_events = 0
+        self.repaired_fields = {}
+        self.retries = 0
+        self.failures = 0
+        self.latency = Histogram()
+
+
+    def record_generation(self, stopped_early: bool, truncated: bool):
+        self.generations += 1
+        self.stopped_early += int(stopped_early)
+        self.truncated += int(truncated)
+
+
+    def record_repair(self, fields: list[str]):
+        self.repaired_events += 1
+        for name in fields:
+            self.repaired_fields[name] = self.repaired_fields.get(name, 0) + 1
+
+
+    def stats(self) -> dict:
+        calls = self.calls or 1
+        return {
+            "calls": self.calls,
+            "generations": self.generations,
+            "stopped_early": self.stopped_early,
+            "truncated": self.truncated,
+            "repaired_events": self.repaired_events,
+            "repaired_fields": dict(sorted(self.repaired_fields.items())),
+            "retries": self.retries,
+            "retry_rate": round(self.retries / calls, 3),
+            "failures": self.failures,
+            "failure_rate": round(self.failures / calls, 3),
+            "latency_ms": {"p50": round(self.latency.quantile(0.5) * 1000, 1), "p95": round(self.latency.quantile(0.95) * 1000, 1)},
+        }
+
@@ -0,0 +1,548 @@
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from agent.models import EventCreate
+
+WEEKDAY_INDEX = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+RRULE_DAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+MONTH_INDEX = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "fifteen": 15, "twenty": 20,
+    "thirty": 30, "forty": 40, "forty-five": 45, "forty five": 45, "ninety": 90,
+}
+# Abbreviations people write after a time; each maps to the zone it usually means
+# (so "EST" in July is still New York time, with its daylight offset)
+ZONE_ABBREVIATIONS = {
+    "UTC": "UTC", "GMT": "UTC",
+    "EST": "America/New_York", "EDT": "America/New_York",
+    "CST": "America/Chicago", "CDT": "America/Chicago",
+    "MST": "America/Denver", "MDT": "America/Denver",
+    "PST": "America/Los_Angeles", "PDT": "America/Los_Angeles",
+    "BST": "Europe/London", "CET": "Europe/Berlin", "CEST": "Europe/Berlin",
+    "EAT": "Africa/Nairobi", "WAT": "Africa/Lagos", "SAST": "Africa/Johannesburg",
+    "IST": "Asia/Kolkata", "JST": "Asia/Tokyo", "AEST": "Australia/Sydney",
+}
+# Default clock time for a day part mentioned without one, and how it reads a bare hour
+DAY_PARTS = {
+    "morning": (time(9, 0), "a"),
+    "afternoon": (time(14, 0), "p"),
+    "evening": (time(18, 0), "p"),
+    "tonight": (time(19, 0), "p"),
+    "night": (time(19, 0), "p"),
+}
+
+_WEEKDAY = r"(?:mon(?:day)?|tue(?:s(?:day)?)?|wed(?:nesday)?|thu(?:r(?:s(?:day)?)?)?|fri(?:day)?|sat(?:urday)?|sun(?:day)?)"
+_FULL_WEEKDAY = r"(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday)"
+_MONTH = r"(?:jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)"
+_COUNT = r"(?:\d+(?:\.\d+)?|an?|one|two|three|four|five|six|seven|eight|nine|ten|fifteen|twenty|thirty|forty[- ]five|forty|ninety)"
+_CLOCK = r"(\d{1,2})(?::([0-5]\d))?\s*(?:([ap])\.?m\.?(?![a-z]))?"
+_NAMED_CLOCK = r"(?P<{0}h>\d{{1,2}})(?::(?P<{0}m>[0-5]\d))?\s*(?:(?P<{0}ap>[ap])\.?m\.?(?![a-z]))?"
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+_IANA_ZONE = re.compile(r"(?:\bin\s+)?\b([A-Z][A-Za-z_]+/[A-Z][A-Za-z_]+(?:/[A-Z][A-Za-z_]+)?)\b(?:\s+time\b)?")
+_ABBREVIATED_ZONE = re.compile(r"(?:\bin\s+)?\b(" + "|".join(ZONE_ABBREVIATIONS) + r")\b(?:\s+time\b)?")
+
+_RECURRING_INTERVAL = re.compile(rf"\bevery\s+(other|\d+|two|three|four)\s+(day|week|month|year|{_FULL_WEEKDAY})s?\b", re.I)
+_RECURRING_WEEKDAYS = re.compile(rf"\b(?:every|each)\s+({_WEEKDAY}s?(?:\s*(?:,\s*and|,|and|&)\s*{_WEEKDAY}s?)*)\b", re.I)
+_RECURRING_WEEKDAY_PLURAL = re.compile(rf"\b(?:on\s+)?((?:{_FULL_WEEKDAY}s)(?:\s*(?:,\s*and|,|and|&)\s*{_FULL_WEEKDAY}s)*)\b", re.I)
+_RECURRING_PERIOD = re.compile(r"\b(?:every|each)\s+(day|weekday|week|month|year|morning|afternoon|evening|night)\b|\b(daily|weekly|monthly|yearly|annually)\b", re.I)
+
+_RELATIVE_OFFSET = re.compile(rf"\bin\s+(half an|{_COUNT})\s*(minute|min|hour|hr|day|week)s?\b", re.I)
+_ISO_DATE = re.compile(r"\b(?:on\s+)?(\d{4})-(\d{2})-(\d{2})\b")
+_MONTH_DAY = re.compile(rf"\b(?:on\s+)?({_MONTH})\.?\s+(\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(\d{{4}}))?", re.I)
+_DAY_MONTH = re.compile(rf"\b(?:on\s+)?(?:the\s+)?(\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?({_MONTH})\b(?:,?\s+(\d{{4}}))?", re.I)
+_DAY_OF_MONTH = re.compile(r"\bon\s+the\s+(\d{1,2})(?:st|nd|rd|th)\b", re.I)
+_DAY_AFTER_TOMORROW = re.compile(r"\b(?:the\s+)?day\s+after\s+tomorrow\b", re.I)
+_TOMORROW = re.compile(r"\b(?:tomorrow|tmrw|tmr)\b", re.I)
+_TODAY = re.compile(r"\b(?:today|tonight)\b", re.I)
+_NEXT_WEEKDAY = re.compile(rf"\bnext\s+({_WEEKDAY})\b", re.I)
+_THIS_WEEKDAY = re.compile(rf"\b(?:this|coming|on)\s+({_WEEKDAY})\b", re.I)
+_BARE_WEEKDAY = re.compile(rf"\b({_FULL_WEEKDAY})\b", re.I)
+_DAY_PART = re.compile(r"\b(?:in\s+the\s+|this\s+|at\s+)?(morning|afternoon|evening|tonight|night)\b", re.I)
+
+_TIME_RANGE = re.compile(
+    r"\b(?:(?P<keyword>from|between)\s+)?(?:at\s+)?" + _NAMED_CLOCK.format("start")
+    + r"\s*(?P<separator>-|–|—|\bto\b|\buntil\b|\btill\b|\band\b)\s*" + _NAMED_CLOCK.format("end"),
+    re.I,
+)
+_CLOCK_12H = re.compile(r"(?:\bat\s+|@\s*|\b)(\d{1,2})(?::([0-5]\d))?\s*([ap])\.?m\.?(?![a-z])", re.I)
+_CLOCK_24H = re.compile(r"(?:\bat\s+|@\s*|\b)([01]?\d|2[0-3]):([0-5]\d)\b", re.I)
+_NOON = re.compile(r"\b(?:at\s+)?(noon|midday|midnight)\b", re.I)
+_BARE_HOUR = re.compile(r"(?:\bat\s+(\d{1,2})(?:\s*o'?clock)?|\b(\d{1,2})\s*o'?clock)\b", re.I)
+_END_CLOCK = re.compile(rf"\b(?:until|till|to|ending\s+at)\s+{_CLOCK}", re.I)
+
+_DURATION = re.compile(
+    rf"\bfor\s+(?:(half\s+an\s+hour)|(an?\s+hour\s+and\s+a\s+half)|({_COUNT})\s*(hours?|hrs?|h|minutes?|mins?|m)\b(\s+and\s+a\s+half)?)",
+    re.I,
+)
+_ADJECTIVE_DURATION = re.compile(rf"\b({_COUNT})[- ](hour|hr|minute|min)\b", re.I)
+
+_ONLINE_LOCATION = re.compile(r"\b(?:on|via|over)\s+(zoom|google meet|meet|teams|microsoft teams|skype|whatsapp)\b", re.I)
+_NAMED_LOCATION = re.compile(r"\b(?:at|in)\s+((?:the\s+)?[A-Z][\w'&.-]*(?:\s+(?:[A-Z][\w'&.-]*|\d+[A-Za-z]?))*)")
+
+# Anything date- or time-like left after parsing means we may have misread the message
+_TEMPORAL_LEFTOVER = re.compile(
+    r"\d|\b(?:mon|tues?|wed|thu|thurs?|fri|monday|tuesday|wednesday|thursday|friday|saturday|sunday|today|tonight|"
+    r"tomorrow|tmrw|noon|midnight|morning|afternoon|evening|night|days?|weeks?|weekends?|weekdays?|months?|years?|"
+    r"daily|weekly|monthly|yearly|annually|every|each|until|till|through|thru|hours?|minutes?|mins?|hrs?|o'?clock|"
+    r"am|pm|jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|june?|july?|aug(?:ust)?|sept?(?:ember)?|oct(?:ober)?|"
+    r"nov(?:ember)?|dec(?:ember)?|later|soon|next|last|tbd|asap)\b",
+    re.I,
+)
+
+_COMMAND = re.compile(
+    r"^(?:(?:hey|hi|ok|okay|please|pls)[,!]?\s+)*(?:(?:can|could|would|will)\s+you\s+(?:please\s+)?)?"
+    r"(?:set\s+(?:up\s+)?(?:a\s+|an\s+)?reminder\s+(?:to|for|about)|remind\s+me\s+(?:to|about|of)?|"
+    r"schedule|book|create|add|set\s+up|setup|put|plan|arrange|block(?:\s+out)?|organi[sz]e|reserve|"
+    r"i\s+have|i've\s+got|i\s+got)\s+",
+    re.I,
+)
+_CALENDAR_PHRASE = re.compile(r"\b(?:to|on|in|into)\s+(?:my|the)\s+(?:calendar|schedule|agenda)\b|\bfor\s+me\b|\bplease\b", re.I)
+_LEADING_FILLER = re.compile(r"^(?:a|an|the|my|for|on|at|in|from|with|and|to|starting|,|-)\s+", re.I)
+_TRAILING_FILLER = re.compile(r"\s+(?:for|on|at|in|from|with|and|to|starting|every|,|-)$", re.I)
+
+
+def is_time_zone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+@dataclass
+class TemporalParse:
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    time_zone: str = "UTC"
+    recurrence: Optional[str] = None
+    summary: Optional[str] = None
+    location: Optional[str] = None
+    attendees_emails: list[str] = field(default_factory=list)
+    resolved: bool = False  # start and end found, and nothing date- or time-like left unexplained
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether an EventCreate can be built without the LLM.
+        """
+        return self.resolved and bool(self.summary)
+
+
+    def to_event(self) -> EventCreate:
+        return EventCreate(
+            summary=self.summary,
+            location=self.location,
+            start_time=self.start,
+            end_time=self.end,
+            time_zone=self.time_zone,
+            attendees_emails=self.attendees_emails,
+            recurrence=self.recurrence,
+        )
+
+
+    def apply_to(self, event: EventCreate) -> EventCreate:
+        """
+        Overrides the fields of an LLM-extracted event that we resolved ourselves. The
+        summary stays the model's: ours only reaches the LLM when it could not be trusted.
+        """
+        update = {"attendees_emails": list(dict.fromkeys((event.attendees_emails or []) + self.attendees_emails))}
+        if self.resolved:
+            update.update(start_time=self.start, end_time=self.end, time_zone=self.time_zone, recurrence=self.recurrence)
+        if self.location and not event.location:
+            update["location"] = self.location
+        return event.model_copy(update=update)
+
+
+class _UpcomingWeekday:
+    """
+    "Friday": the next one, today included if the event's time is still ahead.
+    """
+
+    def __init__(self, weekday: int):
+        self.weekday = weekday
+
+
+class _Message:
+    """
+    The message text plus which character ranges a rule has already consumed.
+    """
+
+    def __init__(self, text: str):
+        self.text = text
+        self.consumed = [False] * len(text)
+
+
+    def take(self, pattern: re.Pattern, accept=None) -> Optional[re.Match]:
+        """
+        First match of `pattern` that doesn't overlap consumed text (and passes `accept`); marks it consumed.
+        """
+        for match in pattern.finditer(self.text):
+            if match.end() > match.start() and not any(self.consumed[match.start():match.end()]) and (accept is None or accept(match)):
+                self.consumed[match.start():match.end()] = [True] * (match.end() - match.start())
+                return match
+        return None
+
+
+    def release(self, match: re.Match):
+        """
+        Gives a consumed match back to the other rules.
+        """
+        self.consumed[match.start():match.end()] = [False] * (match.end() - match.start())
+
+
+    def remaining(self) -> str:
+        return "".join(" " if used else char for char, used in zip(self.text, self.consumed))
+
+
+class TemporalParser:
+    """
+    Rule-based reader of the dates, times and recurrences in create-event messages,
+    e.g. "tomorrow at 2pm", "next Tuesday 3:30pm for an hour", "every Friday at 9am".
+
+    - Times are resolved in the zone named in the message ("3pm EST", "Europe/Paris"),
+      or `time_zone` otherwise, and come back as aware datetimes in that zone.
+    - "Friday" / "this Friday" is the next Friday (today if its time is still ahead);
+      "next Friday" is the Friday of the following week.
+    - A time without a date is today if still ahead, else tomorrow; an hour without
+      am/pm is read within business hours ("at 3" is 15:00, "at 9" is 09:00).
+    - Without a duration or end time, events last `default_duration`.
+    - "every Friday", "every weekday", "daily", "every other week" become an RFC 5545
+      RRULE, and the start moves to the first occurrence.
+
+    The result is `resolved` only when a start was found and nothing date- or time-like
+    is left unexplained; anything else (numeric dates, "Mon–Fri", "sometime next week")
+    is left to the LLM. The summary is what remains once the times and the command
+    ("schedule", "remind me to") are stripped.
+    """
+
+    def __init__(self, time_zone: str = os.getenv("TIME-ZONE", "UTC"), default_duration: timedelta = timedelta(hours=1)):
+        self.time_zone = time_zone
+        self.default_duration = default_duration
+
+
+    def parse(self, text: str, now: Optional[datetime] = None) -> TemporalParse:
+        message = _Message(" ".join(text.split()))
+        result = TemporalParse(time_zone=self.time_zone)
+
+        while (match := message.take(_EMAIL)) is not None:
+            result.attendees_emails.append(match.group())
+
+        zone_name = self._take_zone(message) or self.time_zone
+        zone = ZoneInfo(zone_name)
+        result.time_zone = zone_name
+        now = (now or datetime.now(zone)).astimezone(zone)
+        today = now.date()
+
+        recurrence, recurring_days, recurring_part = self._take_recurrence(message)
+        result.recurrence = recurrence
+
+        relative_start, day = self._take_relative(message, now)
+        if relative_start is None and day is None:
+            day = self._take_date(message, now)
+            if day is False:
+                return result  # a date that doesn't exist, e.g. February 30
+
+        day_part = self._take_day_part(message) or recurring_part
+        hint = DAY_PARTS[day_part][1] if day_part else None
+        clock, end_clock = self._take_times(message, hint)
+        if clock is None and day_part:
+            clock = DAY_PARTS[day_part][0]
+
+        duration = self._take_duration(message)
+        result.location = self._take_location(message)
+
+        if relative_start is not None:
+            start = relative_start
+        elif clock is None:
+            start = None
+        else:
+            if isinstance(day, _UpcomingWeekday):
+                day = self._first_matching_day(today, [day.weekday], clock, now)
+            elif day is None and recurring_days:
+                day = self._first_matching_day(today, recurring_days, clock, now)
+            elif day is None:
+                day = today if datetime.combine(today, clock, tzinfo=zone) > now else today + timedelta(days=1)
+            start = datetime.combine(day, clock, tzinfo=zone)
+
+        if start is not None:
+            if end_clock is not None:
+                end = datetime.combine(start.date(), end_clock, tzinfo=zone)
+                if end <= start:
+                    end += timedelta(days=1)
+            else:
+                end = start + (duration or self.default_duration)
+            result.start, result.end = start, end
+
+        remaining = message.remaining()
+        result.resolved = start is not None and not _TEMPORAL_LEFTOVER.search(remaining)
+        result.summary = self._summary(remaining)
+        return result
+
+
+    @staticmethod
+    def _take_zone(message: _Message) -> Optional[str]:
+        match = message.take(_IANA_ZONE, accept=lambda m: is_time_zone(m.group(1)))
+        if match is not None:
+            return match.group(1)
+        match = message.take(_ABBREVIATED_ZONE)
+        return ZONE_ABBREVIATIONS[match.group(1)] if match is not None else None
+
+
+    def _take_recurrence(self, message: _Message) -> tuple[Optional[str], list[int], Optional[str]]:
+        """
+        Returns (RRULE line, weekdays it repeats on, day part it implies).
+        """
+        match = message.take(_RECURRING_INTERVAL)
+        if match is not None:
+            every, unit = match.group(1).lower(), match.group(2).lower()
+            interval = 2 if every == "other" else int(NUMBER_WORDS.get(every, every))
+            if unit == "week" and (weekday := message.take(_THIS_WEEKDAY)) is not None:
+                unit = weekday.group(1).lower()  # "every other week on Thursday"
+            if unit[:3] in WEEKDAY_INDEX:
+                day = WEEKDAY_INDEX[unit[:3]]
+                return f"RRULE:FREQ=WEEKLY;INTERVAL={interval};BYDAY={RRULE_DAYS[day]}", [day], None
+            frequency = {"day": "DAILY", "week": "WEEKLY", "month": "MONTHLY", "year": "YEARLY"}[unit]
+            return f"RRULE:FREQ={frequency};INTERVAL={interval}", [], None
+
+        # "every Friday", "on Mondays and Thursdays"
+        match = message.take(_RECURRING_WEEKDAYS) or message.take(_RECURRING_WEEKDAY_PLURAL)
+        if match is not None:
+            days = sorted({WEEKDAY_INDEX[name[:3].lower()] for name in re.findall(_WEEKDAY, match.group(1), re.I)})
+            return f"RRULE:FREQ=WEEKLY;BYDAY={','.join(RRULE_DAYS[d] for d in days)}", days, None
+
+        match = message.take(_RECURRING_PERIOD)
+        if match is None:
+            return None, [], None
+        period = (match.group(1) or match.group(2)).lower()
+        if period == "weekday":
+            return "RRULE:FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR", [0, 1, 2, 3, 4], None
+        if period in DAY_PARTS:
+            return "RRULE:FREQ=DAILY", [], period
+        frequency = {
+            "day": "DAILY", "daily": "DAILY", "week": "WEEKLY", "weekly": "WEEKLY", "month": "MONTHLY",
+            "monthly": "MONTHLY", "year": "YEARLY", "yearly": "YEARLY", "annually": "YEARLY",
+        }[period]
+        return f"RRULE:FREQ={frequency}", [], None
+
+
+    @staticmethod
+    def _take_relative(message: _Message, now: datetime) -> tuple[Optional[datetime], Optional[date]]:
+        """
+        "in 2 hours" gives a start, "in 3 days" a date.
+        """
+        match = message.take(_RELATIVE_OFFSET)
+        if match is None:
+            return None, None
+        amount, unit = match.group(1).lower(), match.group(2).lower()
+        count = 0.5 if amount == "half an" else float(NUMBER_WORDS.get(amount, amount))
+        if unit in ("minute", "min", "hour", "hr"):
+            minutes = count * (60 if unit in ("hour", "hr") else 1)
+            return (now + timedelta(minutes=minutes)).replace(second=0, microsecond=0), None
+        return None, now.date() + timedelta(days=int(count * (7 if unit == "week" else 1)))
+
+
+    def _take_date(self, message: _Message, now: datetime):
+        """
+        Returns the date named in the message, None if there is none, or False if it doesn't exist.
+        """
+        today = now.date()
+        try:
+            explicit = self._take_calendar_date(message, today)
+        except ValueError:
+            return False
+        if explicit is not None:
+            # "Friday, June 6": a weekday naming the same date is redundant; a different one is left over
+            message.take(_THIS_WEEKDAY, accept=lambda m: WEEKDAY_INDEX[m.group(1)[:3].lower()] == explicit.weekday()) or \
+                message.take(_BARE_WEEKDAY, accept=lambda m: WEEKDAY_INDEX[m.group(1)[:3].lower()] == explicit.weekday())
+            return explicit
+
+        if message.take(_DAY_AFTER_TOMORROW):
+            return today + timedelta(days=2)
+        if message.take(_TOMORROW):
+            return today + timedelta(days=1)
+        match = message.take(_TODAY)
+        if match is not None:
+            if match.group().lower() == "tonight":
+                # Also means the evening: leave the word for the day-part rule
+                message.release(match)
+            return today
+
+        match = message.take(_NEXT_WEEKDAY)
+        if match is not None:
+            next_monday = today + timedelta(days=7 - today.weekday())
+            return next_monday + timedelta(days=WEEKDAY_INDEX[match.group(1)[:3].lower()])
+
+        match = message.take(_THIS_WEEKDAY) or message.take(_BARE_WEEKDAY)
+        if match is not None:
+            # Resolved against the clock time later, once we know whether today still works
+            return _UpcomingWeekday(WEEKDAY_INDEX[match.group(1)[:3].lower()])
+        return None
+
+
+    def _take_calendar_date(self, message: _Message, today: date) -> Optional[date]:
+        match = message.take(_ISO_DATE)
+        if match is not None:
+            return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+
+        match = message.take(_MONTH_DAY)
+        if match is not None:
+            return self._calendar_date(today, MONTH_INDEX[match.group(1)[:3].lower()], int(match.group(2)), match.group(3))
+
+        match = message.take(_DAY_MONTH)
+        if match is not None:
+            return self._calendar_date(today, MONTH_INDEX[match.group(2)[:3].lower()], int(match.group(1)), match.group(3))
+
+        match = message.take(_DAY_OF_MONTH)
+        if match is not None:
+            day_of_month = int(match.group(1))
+            if day_of_month >= today.day:
+                return today.replace(day=day_of_month)
+            month = today.month % 12 + 1
+            return date(today.year + (month == 1), month, day_of_month)
+        return None
+
+
+    @staticmethod
+    def _calendar_date(today: date, month: int, day: int, year: Optional[str]) -> date:
+        if year:
+            return date(int(year), month, day)
+        candidate = date(today.year, month, day)
+        # "June 1" said on June 4 means next year's
+        return candidate if candidate >= today else date(today.year + 1, month, day)
+
+
+    @staticmethod
+    def _take_day_part(message: _Message) -> Optional[str]:
+        match = message.take(_DAY_PART)
+        return match.group(1).lower() if match is not None else None
+
+
+    def _take_times(self, message: _Message, hint: Optional[str]) -> tuple[Optional[time], Optional[time]]:
+        """
+        Returns (start clock time, end clock time), either of which may be None.
+        """
+        match = message.take(_TIME_RANGE, accept=self._is_time_range)
+        if match is not None:
+            start_hour, start_minute = int(match["starth"]), int(match["startm"] or 0)
+            end = self._clock(int(match["endh"]), int(match["endm"] or 0), match["endap"], hint)
+            start = self._clock(start_hour, start_minute, match["startap"] or match["endap"], hint)
+            if start is not None and end is not None and start > end and not match["startap"]:
+                # "11-1pm": the start is in the morning
+                start = self._clock(start_hour, start_minute, "a", None)
+            if start is not None and end is not None:
+                return start, end
+            message.release(match)
+
+        start = None
+        match = message.take(_CLOCK_12H)
+        if match is not None:
+            start = self._clock(int(match.group(1)), int(match.group(2) or 0), match.group(3), hint)
+        else:
+            match = message.take(_CLOCK_24H)
+            if match is not None:
+                start = self._clock(int(match.group(1)), int(match.group(2)), None, hint)
+            else:
+                match = message.take(_NOON)
+                if match is not None:
+                    start = time(0, 0) if match.group(1).lower() == "midnight" else time(12, 0)
+                else:
+                    match = message.take(_BARE_HOUR)
+                    if match is not None:
+                        start = self._clock(int(match.group(1) or match.group(2)), 0, None, hint)
+
+        end = None
+        if start is not None:
+            match = message.take(_END_CLOCK)
+            if match is not None:
+                end = self._clock(int(match.group(1)), int(match.group(2) or 0), match.group(3), hint or ("p" if start.hour >= 12 else None))
+        return start, end
+
+
+    @staticmethod
+    def _is_time_range(match: re.Match) -> bool:
+        """
+        "2-3pm", "from 2 to 4", "between 2 and 3", but not "2-3 people" or "1 and 2".
+        """
+        keyword = (match["keyword"] or "").lower()
+        if match["separator"].lower() == "and":
+            return keyword == "between"
+        return bool(keyword or match["startap"] or match["endap"] or match["startm"] or match["endm"])
+
+
+    @staticmethod
+    def _clock(hour: int, minute: int, meridiem: Optional[str], hint: Optional[str]) -> Optional[time]:
+        if meridiem:
+            if not 1 <= hour <= 12:
+                return None
+            hour = hour % 12 + (12 if meridiem.lower() == "p" else 0)
+        elif hint == "p" and 1 <= hour < 12:
+            hour += 12
+        elif hint is None and 1 <= hour <= 6:
+            hour += 12  # "at 3" during the working day
+        if hour > 23:
+            return None
+        return time(hour, minute)
+
+
+    @staticmethod
+    def _take_duration(message: _Message) -> Optional[timedelta]:
+        match = message.take(_DURATION)
+        if match is not None:
+            half_hour, hour_and_half, amount, unit, and_a_half = match.groups()
+            if half_hour:
+                return timedelta(minutes=30)
+            if hour_and_half:
+                return timedelta(minutes=90)
+        else:
+            match = message.take(_ADJECTIVE_DURATION)
+            if match is None:
+                return None
+            amount, unit, and_a_half = match.group(1), match.group(2), None
+
+        count = float(NUMBER_WORDS.get(amount.lower(), amount))
+        if and_a_half:
+            count += 0.5
+        minutes = count * 60 if unit.lower().startswith("h") else count
+        return timedelta(minutes=minutes)
+
+
+    @staticmethod
+    def _take_location(message: _Message) -> Optional[str]:
+        match = message.take(_ONLINE_LOCATION)
+        if match is not None:
+            return match.group(1).title() if match.group(1).islower() else match.group(1)
+        # "at Java House", "in Room 4B"; a capitalized month or weekday is not a place
+        match = message.take(_NAMED_LOCATION, accept=lambda m: not _TEMPORAL_LEFTOVER.search(re.sub(r"\s\d+[A-Za-z]?$", "", m.group(1))))
+        return match.group(1).rstrip(".") if match is not None else None
+
+
+    @staticmethod
+    def _first_matching_day(today: date, weekdays: list[int], clock: time, now: datetime) -> date:
+        for offset in range(8):
+            day = today + timedelta(days=offset)
+            if day.weekday() in weekdays and (offset or datetime.combine(day, clock, tzinfo=now.tzinfo) > now):
+                return day
+        return today + timedelta(days=7)
+
+
+    @staticmethod
+    def _summary(remaining: str) -> Optional[str]:
+        summary = _CALENDAR_PHRASE.sub(" ", remaining)
+        summary = " ".join(summary.split()).strip(" ,.;:!?-")
+        summary = _COMMAND.sub("", summary)
+        previous = None
+        while previous != summary:
+            previous = summary
+            summary = _LEADING_FILLER.sub("", summary)
+            summary = _TRAILING_FILLER.sub("", summary).strip(" ,.;:!?-")
+        if len(summary) < 2:
+            return None
+        return summary[0].upper() + summary[1:]
@@ -1,3 +1,1362 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+from django.test import SimpleTestCase
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from agent.models import UserIntent
 
-# Create your tests here.
+
+class ScriptedOllama:
+    """
+    Stands in for `ollama.AsyncClient`: answers every chat with `content` and counts the calls.
+    """
+
+    def __init__(self, content: str = "general"):
+        self.content = content
+        self.calls = 0
+
+
+    async def chat(self, model: str, messages: list, options=None, stream: bool = False, **kwargs):
+        self.calls += 1
+        return {"message": {"role": "assistant", "content": self.content}, "done": True}
+
+
+class IntentCascadeTests(SimpleTestCase):
+
+    def detector(self, llm_label: str = "general"):
+        from agent.service.intents import IntentDetector
+        from agent.service.ollama_client import AsyncOllamaClient
+
+        model = ScriptedOllama(llm_label)
+        return IntentDetector(ollama_client=AsyncOllamaClient(client=model)), model
+
+
+    async def test_confident_rules_skip_the_model(self):
+        detector, model = self.detector()
+        self.assertEqual(await detector.classify("Schedule a meeting with Sarah tomorrow at 10am"), UserIntent.CREATE_EVENT)
+        self.assertEqual(await detector.classify("What's on my calendar this week?"), UserIntent.QUERY_CALENDAR)
+        self.assertEqual(model.calls, 0)
+        self.assertEqual(detector.cascade_stats()["rules"]["hits"], 2)
+
+
+    async def test_confident_router_skips_the_model(self):
+        detector, model = self.detector()
+
+        async def aclassify(user_query):
+            return UserIntent.QUERY_CALENDAR, 0.95
+
+        detector.router = SimpleNamespace(aclassify=aclassify, reload=lambda: None)
+        self.assertEqual(await detector.classify("anything going on with the board thing"), UserIntent.QUERY_CALENDAR)
+        self.assertEqual(model.calls, 0)
+        self.assertEqual(detector.cascade_stats()["embedding"]["hits"], 1)
+
+
+    async def test_ambiguous_queries_fall_back_to_the_model(self):
+        detector, model = self.detector("check_calendar")
+
+        async def aclassify(user_query):
+            return UserIntent.GENERAL, 0.2
+
+        detector.router = SimpleNamespace(aclassify=aclassify, reload=lambda: None)
+        self.assertEqual(await detector.classify("anything going on with the board thing"), UserIntent.QUERY_CALENDAR)
+        self.assertEqual(model.calls, 1)
+        stats = detector.cascade_stats()
+        self.assertEqual((stats["rules"]["hits"], stats["embedding"]["calls"], stats["embedding"]["hits"], stats["llm"]["calls"]), (0, 1, 0, 1))
+
+
+    async def test_unknown_model_labels_mean_general(self):
+        detector, _ = self.detector("something else")
+        self.assertEqual(await detector.classify("the board thing"), UserIntent.GENERAL)
+
+
+    def test_generic_verbs_need_an_event_or_time_cue(self):
+        detector, _ = self.detector()
+        for text in ("Create a Python function to reverse a string", "Add 2 and 3", "Plan a 3-day trip to Rome",
+                     "Book recommendations for a beginner?", "Put simply, what is recursion?", "What's on TV tonight?"):
+            with self.subTest(text=text):
+                self.assertLess(detector._rule_based_classify(text)[1], detector.threshold)
+        for text, intent in (("Book a meeting with the design team", UserIntent.CREATE_EVENT), ("Add dentist tomorrow at 3pm", UserIntent.CREATE_EVENT),
+                             ("What's on the agenda for Monday?", UserIntent.QUERY_CALENDAR), ("what's on tomorrow", UserIntent.QUERY_CALENDAR)):
+            with self.subTest(text=text):
+                predicted, confidence = detector._rule_based_classify(text)
+                self.assertEqual(predicted, intent)
+                self.assertGreaterEqual(confidence, detector.threshold)
+
+
+class KeywordEmbeddings:
+    """
+    Stands in for `OllamaEmbeddings`: one dimension per vocabulary word, counting the documents it embeds.
+    """
+    VOCABULARY = ("schedule", "meeting", "calendar", "week", "joke", "weather")
+
+    def __init__(self):
+        self.embedded_documents = 0
+
+
+    def embed_query(self, text: str) -> list:
+        words = text.lower().replace("?", "").split()
+        return [float(word in words) for word in self.VOCABULARY] + [0.1]
+
+
+    async def aembed_query(self, text: str) -> list:
+        return self.embed_query(text)
+
+
+    def embed_documents(self, texts: list) -> list:
+        self.embedded_documents += len(texts)
+        return [self.embed_query(text) for text in texts]
+
+
+class ExemplarIntentRouterTests(SimpleTestCase):
+    TEMPLATE = """{% block instructions %}
+create_event examples:
+"schedule a meeting"
+
+check_calendar examples:
+"calendar this week"
+"what is on my calendar"
+
+general examples:
+"tell me a joke"
+
+Now classify the message.
+{% endblock %}
+"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.template_path = os.path.join(directory.name, "intent_prompt.j2")
+        with open(self.template_path, "w") as f:
+            f.write(self.TEMPLATE)
+
+
+    def router(self):
+        from agent.service.intent_router import ExemplarIntentRouter
+        return ExemplarIntentRouter(self.template_path, embeddings=KeywordEmbeddings())
+
+
+    def test_exemplars_are_grouped_by_intent(self):
+        router = self.router()
+        self.assertEqual(router._parse_exemplars(), {
+            UserIntent.CREATE_EVENT: ["schedule a meeting"],
+            UserIntent.QUERY_CALENDAR: ["calendar this week", "what is on my calendar"],
+            UserIntent.GENERAL: ["tell me a joke"],
+        })
+
+
+    async def test_queries_take_the_intent_of_the_closest_exemplar(self):
+        router = self.router()
+        self.assertEqual(await router.aclassify("calendar next week?"), (UserIntent.QUERY_CALENDAR, 1.0))
+        intent, confidence = await router.aclassify("the weather")
+        self.assertLess(confidence, 0.7)
+        self.assertEqual(router.embedding.embedded_documents, 4)
+
+
+    async def test_an_edited_template_is_embedded_again(self):
+        router = self.router()
+        router.warm_up()
+        await router.aclassify("joke")
+        self.assertEqual(router.embedding.embedded_documents, 4)
+
+        with open(self.template_path, "w") as f:
+            f.write(self.TEMPLATE.replace('"tell me a joke"', '"tell me a joke"\n"what is the weather"'))
+        os.utime(self.template_path, ns=(0, os.stat(self.template_path).st_mtime_ns + 1_000_000))
+        self.assertEqual(await router.aclassify("weather today"), (UserIntent.GENERAL, 1.0))
+        self.assertEqual(router.embedding.embedded_documents, 9)
+
+
+class StreamingOllama:
+    """
+    Stands in for `ollama.AsyncClient` streaming `chunks`, or failing with `error` before the first one.
+    """
+
+    def __init__(self, chunks: list, error: Exception = None):
+        self.chunks = chunks
+        self.error = error
+        self.read = 0
+        self.closed = False
+
+
+    async def chat(self, model: str, messages: list, stream: bool = False, **kwargs):
+        if self.error is not None:
+            raise self.error
+        return self._stream()
+
+
+    async def _stream(self):
+        try:
+            for chunk in self.chunks:
+                self.read += 1
+                yield {"message": {"role": "assistant", "content": chunk}, "done": False}
+            yield {"message": {"role": "assistant", "content": ""}, "done": True, "prompt_eval_count": 10}
+        finally:
+            self.closed = True
+
+
+class AsyncOllamaClientTests(SimpleTestCase):
+    MESSAGES = [{"role": "user", "content": "Lunch with Ana on Tuesday"}]
+
+    async def test_json_streams_are_closed_once_the_object_is_complete(self):
+        from agent.service.ollama_client import AsyncOllamaClient
+
+        model = StreamingOllama(['{"events": ', '[{"summary": "Lunch"}]', "}", "\n", "\n", "\n"])
+        response = await AsyncOllamaClient(client=model).chat_json("llama3.2", self.MESSAGES, format="json")
+        self.assertEqual(response["message"]["content"], '{"events": [{"summary": "Lunch"}]}')
+        self.assertTrue(response["stopped_early"])
+        self.assertEqual((model.read, model.closed), (3, True))
+
+
+    async def test_failed_calls_release_their_slot(self):
+        from agent.service.ollama_client import AsyncOllamaClient
+
+        client = AsyncOllamaClient(client=StreamingOllama([], error=ConnectionError("refused")), max_concurrency=1)
+        for call in (client.chat("llama3.2", self.MESSAGES), client.chat_json("llama3.2", self.MESSAGES, format="json")):
+            with self.assertRaises(ConnectionError):
+                await call
+        self.assertEqual(client.in_flight, 0)
+        self.assertFalse(client._semaphore.locked())
+
+
+    async def test_slow_calls_time_out(self):
+        from agent.service.ollama_client import AsyncOllamaClient
+
+        class SlowOllama:
+            async def chat(self, **kwargs):
+                await asyncio.sleep(1)
+
+        client = AsyncOllamaClient(client=SlowOllama(), timeout=0.01)
+        with self.assertRaises(asyncio.TimeoutError):
+            await client.chat("llama3.2", self.MESSAGES)
+        self.assertEqual(client.in_flight, 0)
+
+
+def offline_pipeline(test: SimpleTestCase, **kwargs):
+    """
+    A QueryPipeline over the benchmark stand-ins (instant model, retrieval and calendar) and a throwaway session store.
+    """
+    from agent.query_pipeline import QueryPipeline
+    from agent.service.ollama_client import AsyncOllamaClient
+    from agent.service.session_store import SessionStore
+    from benchmarks.fakes import FakeCalendar, FakeChatOllama, FakeOllamaClient, FakeVectorSearch
+
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    options = {
+        "chat_llm": FakeChatOllama(token_rate=10_000, prompt_latency=0, reply_tokens=5),
+        "ollama_client": AsyncOllamaClient(client=FakeOllamaClient(latency=0)),
+        "embedder": FakeVectorSearch(latency=0),
+        "calendar": FakeCalendar(latency=0),
+        "memory_store": SessionStore(spill_path=os.path.join(directory.name, "sessions.sqlite3")),
+    }
+    options.update(kwargs)
+    return QueryPipeline(**options)
+
+
+async def answer(pipeline, user_query: str, session_id: str = "session") -> str:
+    return "".join([chunk async for chunk in pipeline.run(user_query, session_id)])
+
+
+class SpeculativePrefetchTests(SimpleTestCase):
+
+    async def test_the_fetch_for_the_detected_intent_is_used_and_the_other_discarded(self):
+        pipeline = offline_pipeline(self, speculative_prefetch=True)
+        self.assertTrue(await answer(pipeline, "How does Rust compare to Go for network services?"))
+        self.assertEqual(pipeline.embedder.calls, 1)
+        self.assertEqual((pipeline.prefetch_stats.requests, pipeline.prefetch_stats.discarded_fetches), (1, 1))
+
+        await answer(pipeline, "Schedule a meeting with Sarah tomorrow at 10am")
+        self.assertEqual(pipeline.prefetch_stats.discarded_fetches, 3)
+        self.assertEqual(len(pipeline.calendar.events), 1)
+
+
+    async def test_prefetched_context_is_not_fetched_again(self):
+        pipeline = offline_pipeline(self, speculative_prefetch=True, answer_cache_size=0)
+        with mock.patch.object(pipeline.embedder, "retrieve_context", wraps=pipeline.embedder.retrieve_context) as retrieve:
+            await answer(pipeline, "Tell me about Python")
+        retrieve.assert_called_once_with("Tell me about Python")
+
+
+    async def test_a_failed_classification_cancels_the_fetches(self):
+        pipeline = offline_pipeline(self, speculative_prefetch=True)
+        fetch_started = asyncio.Event()
+
+        async def fetch_context(user_query):
+            fetch_started.set()
+            await asyncio.sleep(10)
+
+        async def classify(user_query):
+            await fetch_started.wait()
+            raise RuntimeError("classification failed")
+
+        with mock.patch.object(pipeline, "_fetch_context", fetch_context), mock.patch.object(pipeline.intent_detector, "classify", classify):
+            with self.assertRaises(RuntimeError):
+                await pipeline._classify_with_prefetch("Tell me about Python")
+        pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        await asyncio.sleep(0)
+        self.assertTrue(all(task.done() for task in pending))
+
+
+class FakeEventsResource:
+    """
+    Stands in for `service.events` of the Calendar API: full syncs list `events`, incremental
+    ones return `changes`, or fail with 410 Gone when `expired` is set.
+    """
+
+    def __init__(self, events: list):
+        self.events = events
+        self.changes = []
+        self.expired = False
+        self.failing = False
+        self.requests = []
+
+
+    def __call__(self):
+        return self
+
+
+    def list(self, **params):
+        self.requests.append(params)
+        return SimpleNamespace(execute=lambda: self._page(params))
+
+
+    def _page(self, params: dict) -> dict:
+        from googleapiclient.errors import HttpError
+        if self.failing:
+            raise HttpError(SimpleNamespace(status=503, reason="Service Unavailable"), b"")
+        if "syncToken" not in params:
+            return {"items": self.events, "nextSyncToken": f"token-{len(self.requests)}"}
+        if self.expired:
+            raise HttpError(SimpleNamespace(status=410, reason="Gone"), b"")
+        return {"items": self.changes, "nextSyncToken": f"token-{len(self.requests)}"}
+
+
+def calendar_event(event_id: str, days: float, **fields) -> dict:
+    start = datetime.now(timezone.utc) + timedelta(days=days)
+    return {"id": event_id, "start": {"dateTime": start.isoformat()}, "end": {"dateTime": (start + timedelta(hours=1)).isoformat()}, **fields}
+
+
+class CalendarEventStoreTests(SimpleTestCase):
+
+    def store(self, resource):
+        from agent.service.calendar_store import CalendarEventStore
+        return CalendarEventStore(resource, min_sync_interval=0)
+
+
+    def upcoming_ids(self, store, days: int = 7) -> list:
+        now = datetime.now(timezone.utc)
+        return [event["id"] for event in store.upcoming(now, now + timedelta(days=days))]
+
+
+    def test_incremental_sync_applies_changes_and_cancellations(self):
+        resource = FakeEventsResource([calendar_event("a", 1), calendar_event("b", 2)])
+        store = self.store(resource)
+        self.assertEqual(self.upcoming_ids(store), ["a", "b"])
+        self.assertIn("timeMax", resource.requests[0])
+
+        resource.changes = [{"id": "a", "status": "cancelled"}, calendar_event("c", 3), calendar_event("old", -5), calendar_event("far", 400)]
+        self.assertEqual(self.upcoming_ids(store), ["b", "c"])
+        self.assertEqual(resource.requests[-1]["syncToken"], "token-1")
+        self.assertEqual((store.full_syncs, store.incremental_syncs), (1, 1))
+        # Changes outside the sync window are pruned, not mirrored
+        self.assertEqual(sorted(store._events), ["b", "c"])
+
+
+    def test_an_invalidated_sync_token_triggers_a_full_resync(self):
+        resource = FakeEventsResource([calendar_event("a", 1)])
+        store = self.store(resource)
+        self.upcoming_ids(store)
+
+        resource.expired = True
+        resource.events = [calendar_event("z", 1)]
+        self.assertEqual(self.upcoming_ids(store), ["z"])
+        self.assertEqual(store.full_syncs, 2)
+        self.assertNotIn("syncToken", resource.requests[-1])
+
+
+    def test_recurring_events_wait_for_the_synced_instances(self):
+        resource = FakeEventsResource([])
+        store = self.store(resource)
+        self.upcoming_ids(store)
+
+        store.upsert(calendar_event("series", 1, recurrence=["RRULE:FREQ=DAILY"]))
+        store.upsert(calendar_event("single", 1))
+        resource.changes = [calendar_event("series_20250605", 1, recurringEventId="series")]
+        self.assertEqual(sorted(self.upcoming_ids(store)), ["series_20250605", "single"])
+
+
+    def test_a_failed_resync_keeps_the_mirror_and_its_sync_token(self):
+        resource = FakeEventsResource([calendar_event("a", 1)])
+        store = self.store(resource)
+        self.upcoming_ids(store)
+        window_end = store.window_end
+
+        # Reading past the window needs a full resync, which fails
+        resource.failing = True
+        from googleapiclient.errors import HttpError
+        with self.assertRaises(HttpError):
+            self.upcoming_ids(store, days=60)
+        self.assertEqual((store.sync_token, store.window_end, list(store._events)), ("token-1", window_end, ["a"]))
+
+        resource.failing = False
+        resource.changes = [calendar_event("b", 2)]
+        self.assertEqual(self.upcoming_ids(store), ["a", "b"])
+        self.assertEqual(resource.requests[-1]["syncToken"], "token-1")
+
+
+class FakeBatchService:
+    """
+    Stands in for the Calendar API service: batches answer each insert through its callback,
+    failing the events titled "invalid", skipping those titled "lost", and the whole request when `failing_batch` is its number.
+    """
+
+    def __init__(self, failing_batch: int = None):
+        self.failing_batch = failing_batch
+        self.batch_sizes = []
+
+
+    def events(self):
+        return SimpleNamespace(insert=lambda calendarId, body: body)
+
+
+    def new_batch_http_request(self):
+        service, requests = self, []
+
+        class Batch:
+            def add(self, body, callback, request_id):
+                requests.append((body, callback, request_id))
+
+            def execute(self):
+                service.batch_sizes.append(len(requests))
+                if len(service.batch_sizes) == service.failing_batch:
+                    raise ConnectionError("connection reset")
+                for body, callback, request_id in requests:
+                    if body["summary"] == "invalid":
+                        callback(request_id, None, ValueError("invalid time range"))
+                    elif body["summary"] != "lost":
+                        callback(request_id, {"id": f"event{request_id}", **body}, None)
+
+        return Batch()
+
+
+class GoogleCalendarBatchTests(SimpleTestCase):
+
+    def calendar(self, service):
+        from agent.service.calendar import GoogleCalendar
+
+        calendar = GoogleCalendar.__new__(GoogleCalendar)
+        calendar.service = service
+        calendar.store = SimpleNamespace(upserted=[])
+        calendar.store.upsert = calendar.store.upserted.append
+        return calendar
+
+
+    def events(self, *summaries):
+        from agent.models import EventCreate
+
+        start = datetime(2025, 6, 5, 10, 0, tzinfo=timezone.utc)
+        return [EventCreate(summary=summary, start_time=start, end_time=start + timedelta(hours=1)) for summary in summaries]
+
+
+    def test_events_are_sent_in_batches_of_fifty_and_reported_in_order(self):
+        service = FakeBatchService()
+        calendar = self.calendar(service)
+        results = calendar.add_events(self.events(*(f"event {number}" for number in range(120))))
+
+        self.assertEqual(service.batch_sizes, [50, 50, 20])
+        self.assertEqual([result.index for result in results], list(range(120)))
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(results[119].event["summary"], "event 119")
+        self.assertEqual(len(calendar.store.upserted), 120)
+
+
+    def test_failures_are_reported_per_event(self):
+        calendar = self.calendar(FakeBatchService())
+        results = calendar.add_events(self.events("standup", "invalid", "lost"))
+        self.assertEqual([result.ok for result in results], [True, False, False])
+        self.assertEqual(results[1].error, "invalid time range")
+        self.assertEqual(results[2].error, "no response from the batch request")
+        self.assertEqual(len(calendar.store.upserted), 1)
+
+
+    def test_a_failed_batch_request_fails_only_its_own_events(self):
+        calendar = self.calendar(FakeBatchService(failing_batch=1))
+        results = calendar.add_events(self.events(*(f"event {number}" for number in range(60))))
+        self.assertEqual([result.ok for result in results], [False] * 50 + [True] * 10)
+        self.assertTrue(results[0].error.startswith("batch request failed"))
+
+
+class CountingEmbeddings:
+    """
+    Wraps the benchmark FakeEmbeddings (8 dimensions) and records the texts sent to the model.
+    """
+
+    def __init__(self):
+        from benchmarks.fakes import FakeEmbeddings
+
+        self.embeddings = FakeEmbeddings(dimensions=8)
+        self.embedded = []
+
+
+    def embed_query(self, text: str) -> list:
+        self.embedded.append([text])
+        return self.embeddings.embed_query(text)
+
+
+    async def aembed_query(self, text: str) -> list:
+        return self.embed_query(text)
+
+
+    def embed_documents(self, texts: list) -> list:
+        self.embedded.append(list(texts))
+        return self.embeddings.embed_documents(texts)
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "embedding_cache.sqlite3")
+
+
+    def cache(self, **kwargs):
+        from agent.embedding.cache import EmbeddingCache
+
+        options = {"model_name": "nomic-embed-text", "dimensions": 3}
+        options.update(kwargs)
+        cache = EmbeddingCache(self.path, **options)
+        self.addCleanup(cache._db.close)
+        return cache
+
+
+    def test_vectors_fall_back_from_memory_to_disk(self):
+        cache = self.cache(max_memory_entries=1)
+        cache.put_many(["a", "b"], [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        self.assertEqual(cache.get("b"), [0.0, 1.0, 0.0])
+        self.assertEqual(cache.get("a"), [1.0, 0.0, 0.0])
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual({name: cache.stats()[name] for name in ("memory_hits", "disk_hits", "misses")}, {"memory_hits": 1, "disk_hits": 1, "misses": 1})
+
+        # The disk level outlives the process
+        self.assertEqual(self.cache().get("  b "), [0.0, 1.0, 0.0])
+
+
+    def test_keys_depend_on_the_model_and_dimensions(self):
+        self.cache().put("a", [1.0, 0.0, 0.0])
+        self.assertIsNone(self.cache(model_name="other-model").get("a"))
+        self.assertIsNone(self.cache(dimensions=4).get("a"))
+        with self.assertRaises(ValueError):
+            self.cache().put("a", [1.0, 0.0])
+
+
+    def test_the_least_recently_used_vectors_leave_the_disk_first(self):
+        cache = self.cache(max_memory_entries=1, max_disk_entries=20, touch_batch=1)
+        for number in range(20):
+            cache.put(str(number), [float(number), 0.0, 0.0])
+        cache.get("0")
+        cache.put("20", [20.0, 0.0, 0.0])
+
+        # One entry over: the overflow and a 5% margin go, oldest use first
+        self.assertEqual(cache.stats()["disk_entries"], 19)
+        fresh = self.cache()
+        self.assertEqual([fresh.get(text) is not None for text in ("0", "1", "2", "3", "20")], [True, False, False, True, True])
+
+
+    def test_disk_hits_are_written_back_in_batches(self):
+        cache = self.cache(max_memory_entries=1, touch_batch=10)
+        cache.put_many(["a", "b"], [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]])
+        last_used = lambda: dict(cache._db.execute("SELECT key, last_used FROM embeddings").fetchall())[cache.key("a")]
+        written = last_used()
+
+        cache.get("a")
+        self.assertEqual(last_used(), written)
+        cache.flush()
+        self.assertGreater(last_used(), written)
+
+
+    async def test_only_missing_texts_reach_the_model(self):
+        from agent.embedding.cache import CachedEmbeddings
+
+        model = CountingEmbeddings()
+        embeddings = CachedEmbeddings(model, self.cache(dimensions=8))
+        first = embeddings.embed_documents(["python", "rust"])
+        self.assertEqual(embeddings.embed_documents(["rust", "go", "python"])[::2], first[::-1])
+        self.assertEqual(await embeddings.aembed_query("go"), embeddings.embed_query("go"))
+        self.assertEqual(model.embedded, [["python", "rust"], ["go"]])
+
+
+class LocalVectorStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        rng = np.random.default_rng(7)
+        # 16 well separated topics of 25 documents each
+        topics = rng.normal(size=(16, 32))
+        self.vectors = np.repeat(topics, 25, axis=0) + rng.normal(scale=0.05, size=(400, 32))
+        self.texts = [f"doc {row}" for row in range(400)]
+
+
+    def store(self, **kwargs):
+        from agent.embedding.local_store import LocalVectorStore
+        return LocalVectorStore(self.directory, dimensions=32, **kwargs)
+
+
+    def fill(self, store, rows: slice = slice(None)):
+        texts = self.texts[rows]
+        store.add(texts, self.vectors[rows].tolist(), [{"hash": text} for text in texts])
+
+
+    def test_flat_search_is_exact_and_survives_a_reopen(self):
+        store = self.store()
+        self.fill(store)
+        results = store.search(self.vectors[30].tolist(), k=3)
+        self.assertEqual(results[0][0], "doc 30")
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+        self.assertTrue(all(text.startswith("doc ") and 25 <= int(text.split()[1]) < 50 for text, _ in results))
+
+        reopened = self.store()
+        self.assertEqual(len(reopened), 400)
+        self.assertEqual(reopened.search(self.vectors[30].tolist(), k=3), results)
+        self.assertEqual(reopened.existing_hashes(["doc 1", "doc 999"]), {"doc 1"})
+
+
+    def test_ivf_search_finds_the_flat_results_on_clustered_data(self):
+        store = self.store(mode="ivf", min_train_size=100, nprobe=2)
+        self.fill(store)
+        centroids, assignments, lists = store._ivf
+        self.assertEqual((len(centroids), len(assignments)), (20, 400))
+
+        flat = self.store()
+        for row in (0, 130, 399):
+            with self.subTest(row=row):
+                self.assertEqual(store.search(self.vectors[row].tolist(), k=5)[0], flat.search(self.vectors[row].tolist(), k=5)[0])
+
+
+    def test_ivf_lists_are_saved_once_and_new_rows_assigned_on_open(self):
+        store = self.store(mode="ivf", min_train_size=100)
+        self.fill(store, slice(0, 300))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "ivf.npz")))
+        store.save()
+        self.fill(store, slice(300, 400))
+
+        reopened = self.store(mode="ivf", min_train_size=100)
+        centroids, assignments, _ = reopened._ivf
+        np.testing.assert_array_equal(centroids, store._ivf[0])
+        self.assertEqual(len(assignments), 400)
+        self.assertFalse(reopened._ivf_saved)
+        self.assertEqual(reopened.search(self.vectors[350].tolist(), k=1)[0][0], "doc 350")
+
+
+class HybridRetrievalTests(SimpleTestCase):
+
+    def test_bm25_ranks_exact_terms_first_and_reports_coverage(self):
+        from agent.embedding.lexical_index import BM25Index
+
+        index = BM25Index()
+        index.add("1", "Invoice INV-2041 was paid on March 3rd")
+        index.add("2", "Invoices are paid within thirty days")
+        index.add("3", "The office is closed on public holidays")
+
+        results = index.search("invoice INV-2041 paid")
+        self.assertEqual(results[0][0], "Invoice INV-2041 was paid on March 3rd")
+        self.assertEqual(results[0][2], 1.0)
+        self.assertNotIn("The office is closed on public holidays", [text for text, _, _ in results])
+
+
+    # Unrelated chunks, so the test corpora score like a real knowledge base
+    FILLER = [f"Section {number} of the employee handbook covers topic {number}" for number in range(100)]
+
+    def embedding_model(self, lexical_texts: list, vector_results):
+        from agent.embedding.embedder import EmbeddingModel
+        from agent.embedding.lexical_index import BM25Index
+
+        def search(vector, k):
+            if isinstance(vector_results, Exception):
+                raise vector_results
+            return vector_results
+
+        model = EmbeddingModel.__new__(EmbeddingModel)
+        model.lexical_index = BM25Index()
+        for number, text in enumerate(lexical_texts + self.FILLER):
+            model.lexical_index.add(str(number), text)
+        model.embedding = SimpleNamespace(embed_query=lambda text: [1.0])
+        model.vector_store = SimpleNamespace(search=search)
+        model.rrf_k = 60
+        model.lexical_exit_ratio = 2.0
+        model.lexical_exit_min_score = 8.0
+        model._search_pool = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(model._search_pool.shutdown)
+        return model
+
+
+    def test_reciprocal_rank_fusion_favours_chunks_both_sides_found(self):
+        model = self.embedding_model([], [])
+        fused = model._reciprocal_rank_fusion([["semantic only", "both"], ["lexical only", "both"]])
+        self.assertEqual(fused[0], "both")
+        self.assertEqual(set(fused[1:]), {"semantic only", "lexical only"})
+
+
+    def test_retrieval_fuses_vector_and_lexical_results(self):
+        model = self.embedding_model(
+            ["Refunds are processed in five days", "Refund requests need the order number"],
+            [("Refund requests need the order number", 0.9), ("Shipping takes a week", 0.8), ("Unrelated", 0.2)],
+        )
+        context = model.retrieve_context("how long do refunds take", k=3)
+        self.assertEqual(context.split("\n\n"), ["Refund requests need the order number", "Refunds are processed in five days", "Shipping takes a week"])
+
+
+    def test_a_clear_lexical_match_answers_on_its_own(self):
+        model = self.embedding_model(
+            ["Invoice INV-2041 was paid on March 3rd", "The office is closed on public holidays"],
+            [("Something semantically close", 0.95)],
+        )
+        self.assertEqual(model.retrieve_context("INV-2041 paid"), "Invoice INV-2041 was paid on March 3rd")
+
+
+    def test_a_weak_lexical_match_still_waits_for_the_vector_side(self):
+        model = self.embedding_model(["Our office is open on weekdays"], [("Opening hours are 9 to 5", 0.9)])
+        self.assertEqual(model.retrieve_context("office").split("\n\n"), ["Opening hours are 9 to 5", "Our office is open on weekdays"])
+
+
+    def test_a_failed_vector_search_falls_back_to_the_lexical_results(self):
+        model = self.embedding_model(["Refunds are processed in five days", "Refund requests need the order number"], ConnectionError("atlas unreachable"))
+        self.assertEqual(model.retrieve_context("refund or refunds").split("\n\n"), ["Refunds are processed in five days", "Refund requests need the order number"])
+
+
+class SessionStoreTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+
+    def memory_store(self, **kwargs):
+        from agent.service.session_store import SessionStore
+        return SessionStore(spill_path=os.path.join(self.directory, "sessions.sqlite3"), **kwargs)
+
+
+    def shared_store(self, **kwargs):
+        from agent.service.session_store import SharedSessionStore
+
+        store = SharedSessionStore(os.path.join(self.directory, "shared.sqlite3"), **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+
+    def test_least_recently_used_sessions_spill_and_come_back(self):
+        store = self.memory_store(max_sessions=1)
+        store.get("a").add_messages([HumanMessage("hi"), AIMessage("hello")])
+        store.get("b")
+        self.assertNotIn("a", store)
+
+        self.assertEqual([message.content for message in store.get("a").messages], ["hi", "hello"])
+        self.assertEqual((store.spilled, store.restored), (1, 1))
+
+
+    def test_pinned_sessions_are_not_spilled_and_keep_their_history_object(self):
+        store = self.memory_store(max_sessions=1, idle_ttl=0)
+        history = store.acquire("a")
+        store.get("b")
+        store.get("c")
+        self.assertIn("a", store)
+        self.assertIs(store.get("a"), history)
+
+
+    def test_release_spills_only_after_the_last_connection(self):
+        store = self.memory_store()
+        history = store.acquire("a")
+        store.acquire("a")
+        history.add_messages([HumanMessage("hi")])
+
+        store.release("a")
+        self.assertIn("a", store)
+        store.release("a")
+        self.assertNotIn("a", store)
+        self.assertEqual([message.content for message in store.get("a").messages], ["hi"])
+
+
+    def test_shared_appends_are_committed_in_batches(self):
+        store = self.shared_store(flush_interval=60)
+        other_worker = self.shared_store(flush_interval=0)
+        store.get("a").add_messages([HumanMessage("q1"), AIMessage("a1")])
+        store.get("b").add_messages([HumanMessage("q2")])
+
+        # Queued appends are visible to their own worker only, until the batch is committed
+        self.assertEqual(len(store.get("a").messages), 2)
+        self.assertEqual(other_worker.get("a").messages, [])
+        self.assertEqual(store.stats()["commits"], 0)
+
+        store.release("a")
+        self.assertEqual([message.content for message in other_worker.get("a").messages], ["q1", "a1"])
+        self.assertEqual([message.content for message in other_worker.get("b").messages], ["q2"])
+        self.assertEqual((store.stats()["commits"], store.stats()["messages_per_commit"]), (1, 3.0))
+
+
+    def test_resident_sessions_are_reported_on_metrics(self):
+        import ai_assistant.chat_interface.main as chat_app
+
+        pipeline = offline_pipeline(self, memory_store=self.memory_store())
+        pipeline.memory_store.acquire("a").add_messages([HumanMessage("hello")])
+        with mock.patch.object(chat_app, "query_pipeline", pipeline):
+            body = asyncio.run(chat_app.metrics()).body.decode()
+        self.assertIn("assistant_session_store_resident_sessions 1\n", body)
+        self.assertIn("assistant_session_store_pinned_sessions 1\n", body)
+        self.assertIn("assistant_session_store_resident_bytes 5\n", body)
+
+
+
+    def test_replace_prefix_keeps_messages_appended_meanwhile(self):
+        summary = SystemMessage(content="summary", additional_kwargs={"summary": True})
+        for store in (self.memory_store(), self.shared_store(flush_interval=0)):
+            with self.subTest(store=type(store).__name__):
+                history = store.get("a")
+                history.add_messages([HumanMessage("q1"), AIMessage("a1")])
+                prefix = list(history.messages)
+                history.add_messages([HumanMessage("q2")])
+
+                self.assertTrue(store.replace_prefix("a", prefix, [summary]))
+                self.assertEqual([message.content for message in store.get("a").messages], ["summary", "q2"])
+                # The prefix is gone now, so a second fold of it is refused
+                self.assertFalse(store.replace_prefix("a", prefix, [summary]))
+
+
+class GatedSummarizer:
+    """
+    Stands in for the summarizer LLM: answers "summary of N messages" once `release` is set.
+    """
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.prompts = []
+
+
+    async def ainvoke(self, prompt: str):
+        self.prompts.append(prompt)
+        await self.release.wait()
+        return SimpleNamespace(content=" rolling summary ")
+
+
+class HistoryPolicyTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+
+    def policy(self, **kwargs):
+        from agent.service.history_policy import HistoryPolicy
+        return HistoryPolicy(GatedSummarizer(), **kwargs)
+
+
+    @staticmethod
+    def turns(count: int) -> list:
+        return [message for number in range(count) for message in (HumanMessage(f"question {number}"), AIMessage(f"answer {number}"))]
+
+
+    def test_the_window_keeps_the_summary_and_the_newest_messages_within_budget(self):
+        policy = self.policy(token_budget=13)
+        summary = SystemMessage(content="s" * 20, additional_kwargs={"summary": True})
+        window = policy.window([summary] + self.turns(5))
+        self.assertIs(window[0], summary)
+        self.assertEqual([message.content for message in window[1:]], ["question 4", "answer 4"])
+
+        # The newest message is sent even when it alone is over budget
+        self.assertEqual(len(policy.window([HumanMessage("x" * 400)])), 1)
+
+
+    async def test_old_turns_fold_into_a_summary_and_later_messages_stay(self):
+        from agent.service.session_store import SessionStore
+
+        store = SessionStore(spill_path=os.path.join(self.directory, "sessions.sqlite3"))
+        policy = self.policy(keep_last_turns=2, fold_after_turns=1)
+        history = store.get("a")
+        history.add_messages(self.turns(6))
+        policy.maybe_fold(store, "a")
+        await asyncio.sleep(0)
+        self.assertIn("question 0", policy.summarizer_llm.prompts[0])
+        self.assertNotIn("question 4", policy.summarizer_llm.prompts[0])
+
+        history.add_messages([HumanMessage("question 6")])
+        policy.summarizer_llm.release.set()
+        await asyncio.gather(*policy._folding.values())
+
+        contents = [message.content for message in store.get("a").messages]
+        self.assertEqual(contents, ["rolling summary", "question 4", "answer 4", "question 5", "answer 5", "question 6"])
+        self.assertEqual(policy.folds, 1)
+
+
+    async def test_a_history_changed_during_the_fold_is_left_alone(self):
+        from agent.service.session_store import SessionStore
+
+        store = SessionStore(spill_path=os.path.join(self.directory, "sessions.sqlite3"))
+        policy = self.policy(keep_last_turns=2, fold_after_turns=1)
+        history = store.get("a")
+        history.add_messages(self.turns(6))
+        policy.maybe_fold(store, "a")
+        await asyncio.sleep(0)
+
+        # Folded by someone else meanwhile, in place
+        other_summary = SystemMessage(content="other summary", additional_kwargs={"summary": True})
+        self.assertTrue(store.replace_prefix("a", history.messages[:2], [other_summary]))
+        policy.summarizer_llm.release.set()
+        with self.assertLogs("agent.service.history_policy", level="INFO"):
+            await asyncio.gather(*policy._folding.values())
+        self.assertEqual([message.content for message in store.get("a").messages][:2], ["other summary", "question 1"])
+        self.assertEqual(policy.folds, 0)
+
+
+class PromptEvalMeasurementTests(SimpleTestCase):
+
+    def test_intent_prompts_share_their_static_prefix(self):
+        from agent.service.intents import IntentDetector
+
+        detector = IntentDetector(ollama_client=SimpleNamespace())
+        first = detector._messages(detector.intent_instructions, detector.intent_template, "How does Rust compare to Go?")
+        second = detector._messages(detector.intent_instructions, detector.intent_template, "Thanks!")
+        self.assertEqual(first[0], second[0])
+        self.assertNotIn("Rust", first[0]["content"])
+        self.assertIn("Rust", first[1]["content"])
+
+
+    def test_an_injected_routing_client_is_measured_too(self):
+        pipeline = offline_pipeline(self, measure_prompt_eval=True)
+        self.assertIs(pipeline.intent_detector.ollama_client.prompt_stats, pipeline.prompt_stats)
+        self.assertIsNone(offline_pipeline(self, measure_prompt_eval=False).prompt_stats)
+
+
+    async def test_prompt_eval_counts_are_reported_per_call_site(self):
+        import ai_assistant.chat_interface.main as chat_app
+
+        pipeline = offline_pipeline(self, measure_prompt_eval=True, answer_cache_size=0)
+        await answer(pipeline, "How does Rust compare to Go for network services?")
+        snapshot = pipeline.prompt_stats.snapshot()
+        self.assertEqual(set(snapshot), {"intent", "general"})
+        self.assertGreater(snapshot["general"]["avg_prompt_eval_count"], 0)
+
+        with mock.patch.object(chat_app, "query_pipeline", pipeline):
+            body = (await chat_app.metrics()).body.decode()
+        self.assertIn('assistant_prompt_eval_calls_total{site="intent"} 1\n', body)
+        self.assertIn('assistant_prompt_eval_prompt_eval_tokens_total{site="general"}', body)
+
+
+class RecordingWebSocket:
+    """
+    Stands in for a FastAPI WebSocket, keeping the JSON frames sent to it. Each send takes `send_delay` seconds.
+    """
+
+    def __init__(self, send_delay: float = 0.0):
+        self.send_delay = send_delay
+        self.frames = []
+
+    async def send_text(self, text: str):
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        self.frames.append(json.loads(text))
+
+
+async def chunked(text: str, size: int = 1, delay: float = 0.0, error: Exception = None):
+    for start in range(0, len(text), size):
+        if delay:
+            await asyncio.sleep(delay)
+        yield text[start:start + size]
+    if error is not None:
+        raise error
+
+
+class CoalescingStreamerTests(SimpleTestCase):
+
+    async def test_chunks_are_coalesced_into_a_few_frames(self):
+        from ai_assistant.chat_interface.streaming import CoalescingStreamer, StreamStats
+
+        websocket, stats = RecordingWebSocket(), StreamStats()
+        text = "".join(f"word{i} " for i in range(200))
+        await CoalescingStreamer(websocket, max_chars=256, flush_interval=1.0, stats=stats).stream(chunked(text, size=3), message_id="m1")
+
+        deltas, end = websocket.frames[:-1], websocket.frames[-1]
+        self.assertEqual("".join(frame["text"] for frame in deltas), text)
+        self.assertTrue(all(frame["type"] == "delta" for frame in deltas))
+        self.assertLessEqual(len(deltas), len(text) // 256 + 1)
+        self.assertEqual((end["type"], end["message_id"], end["chars"], end["frames"]), ("end", "m1", len(text), len(deltas)))
+        self.assertEqual(stats.snapshot()["chunks"], -(-len(text) // 3))
+        self.assertEqual(stats.frames, len(deltas))
+
+
+    async def test_a_slow_model_is_flushed_after_the_interval(self):
+        from ai_assistant.chat_interface.streaming import CoalescingStreamer
+
+        websocket = RecordingWebSocket()
+        await CoalescingStreamer(websocket, max_chars=256, flush_interval=0.01).stream(chunked("abcdef", delay=0.03), message_id="m1")
+        deltas = [frame["text"] for frame in websocket.frames if frame["type"] == "delta"]
+        self.assertEqual("".join(deltas), "abcdef")
+        self.assertGreater(len(deltas), 1)
+
+
+    async def test_a_slow_client_pauses_the_model(self):
+        from ai_assistant.chat_interface.streaming import CoalescingStreamer, StreamStats
+
+        websocket, stats = RecordingWebSocket(send_delay=0.02), StreamStats()
+        text = "x" * 400
+        streamer = CoalescingStreamer(websocket, max_chars=16, flush_interval=0.0, max_buffer_chars=32, stats=stats)
+        await streamer.stream(chunked(text, size=4), message_id="m1")
+        self.assertEqual("".join(frame.get("text", "") for frame in websocket.frames), text)
+        self.assertGreater(stats.producer_stalls, 0)
+        self.assertTrue(all(len(frame.get("text", "")) <= 32 + 4 for frame in websocket.frames))
+
+
+    async def test_a_failed_stream_ends_with_an_error_frame(self):
+        from ai_assistant.chat_interface.streaming import CoalescingStreamer
+
+        websocket = RecordingWebSocket()
+        with self.assertLogs("ai_assistant.chat_interface.streaming", level="ERROR"):
+            await CoalescingStreamer(websocket).stream(chunked("partial", error=RuntimeError("model went away")), message_id="m1")
+        self.assertEqual(websocket.frames[-1]["type"], "error")
+        self.assertEqual(websocket.frames[-1]["message_id"], "m1")
+        self.assertNotIn("model went away", websocket.frames[-1]["error"])
+        self.assertEqual("".join(frame.get("text", "") for frame in websocket.frames[:-1]), "partial")
+
+
+    async def test_cancelling_the_reply_stops_reading_the_model(self):
+        from ai_assistant.chat_interface.streaming import CoalescingStreamer
+
+        closed = asyncio.Event()
+
+        async def endless():
+            try:
+                while True:
+                    await asyncio.sleep(0.005)
+                    yield "tok "
+            finally:
+                closed.set()
+
+        reply = asyncio.create_task(CoalescingStreamer(RecordingWebSocket()).stream(endless(), message_id="m1"))
+        await asyncio.sleep(0.05)
+        reply.cancel()
+        await asyncio.gather(reply, return_exceptions=True)
+        await asyncio.wait_for(closed.wait(), 1)
+
+
+class SemanticAnswerCacheTests(SimpleTestCase):
+
+    def test_similar_questions_hit_only_within_their_scope(self):
+        from agent.service.answer_cache import SemanticAnswerCache
+
+        cache = SemanticAnswerCache(max_entries=4, similarity_threshold=0.95)
+        scope = cache.scope("context", kb_version=1)
+        cache.store([1.0, 0.0, 0.0], scope, "What is Python?", "A language.", generation_seconds=2.0)
+
+        self.assertEqual(cache.lookup([2.0, 0.1, 0.0], scope).answer, "A language.")
+        self.assertIsNone(cache.lookup([0.0, 1.0, 0.0], scope))
+        self.assertIsNone(cache.lookup([1.0, 0.0, 0.0], cache.scope("context", kb_version=2)))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["scope_misses"], 1)
+
+
+    def test_expired_and_least_recently_used_entries_are_not_served(self):
+        from agent.service.answer_cache import SemanticAnswerCache
+
+        cache = SemanticAnswerCache(max_entries=2, ttl=60)
+        for index, question in enumerate(("a", "b")):
+            cache.store(np.eye(3)[index], 0, question, f"answer {question}", 1.0)
+        cache.lookup(np.eye(3)[0], 0)
+        cache.store(np.eye(3)[2], 0, "c", "answer c", 1.0)
+        self.assertIsNone(cache.lookup(np.eye(3)[1], 0))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+        with mock.patch("agent.service.answer_cache.time.time", return_value=time.time() + 61):
+            self.assertIsNone(cache.lookup(np.eye(3)[0], 0))
+
+
+    def test_history_dependent_and_time_sensitive_questions_are_not_cacheable(self):
+        from agent.service.answer_cache import is_cacheable
+
+        for query in (
+            "What is my name?",
+            "Summarize what we discussed",
+            "Tell me more about it",
+            "What's the weather today?",
+            "What time is it in Tokyo right now?",
+            "What are the latest news headlines?",
+        ):
+            self.assertFalse(is_cacheable(query), query)
+        for query in ("How does Rust compare to Go?", "What is the capital of France?", "Explain the time complexity of quicksort"):
+            self.assertTrue(is_cacheable(query), query)
+
+
+    async def test_answers_are_shared_across_sessions_only_for_cacheable_questions(self):
+        pipeline = offline_pipeline(self)
+        await answer(pipeline, "How does Rust compare to Go?", session_id="a")
+        await answer(pipeline, "How does Rust compare to Go?", session_id="b")
+        self.assertEqual(pipeline.answer_cache.stats()["hits"], 1)
+
+        for query in ("What is my name?", "What's the weather today?"):
+            await answer(pipeline, query, session_id="a")
+            await answer(pipeline, query, session_id="b")
+        self.assertEqual(pipeline.answer_cache.stats()["entries"], 1)
+        self.assertEqual(pipeline.answer_cache.stats()["hits"], 1)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    async def test_concurrent_identical_calls_share_one_upstream_call(self):
+        from agent.service.single_flight import SingleFlight
+
+        flight = SingleFlight()
+        calls = 0
+
+        async def upstream():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flight.do("classify", "same query", upstream) for _ in range(5)))
+        self.assertEqual(results, ["answer"] * 5)
+        self.assertEqual(calls, 1)
+        self.assertEqual(flight.stats()["classify"], {"calls": 5, "upstream_calls": 1, "avoided": 4})
+
+        # Nothing is kept once the call is over
+        await flight.do("classify", "same query", upstream)
+        self.assertEqual(calls, 2)
+
+
+    async def test_an_upstream_error_reaches_every_waiting_caller(self):
+        from agent.service.single_flight import SingleFlight
+
+        flight = SingleFlight()
+
+        async def upstream():
+            await asyncio.sleep(0.01)
+            raise ValueError("no usable time")
+
+        results = await asyncio.gather(*(flight.do("extract", "key", upstream) for _ in range(3)), return_exceptions=True)
+        self.assertEqual([type(result) for result in results], [ValueError] * 3)
+        self.assertEqual(flight.stats()["extract"]["upstream_calls"], 1)
+
+
+    async def test_a_caller_leaving_does_not_cancel_the_call_for_the_others(self):
+        from agent.service.single_flight import SingleFlight
+
+        flight = SingleFlight()
+
+        async def upstream():
+            await asyncio.sleep(0.02)
+            return 42
+
+        leaving = asyncio.create_task(flight.do("retrieve_context", "key", upstream))
+        staying = asyncio.create_task(flight.do("retrieve_context", "key", upstream))
+        await asyncio.sleep(0)
+        leaving.cancel()
+        self.assertEqual(await staying, 42)
+
+
+class LLMSchedulerTests(SimpleTestCase):
+
+    async def test_free_slots_go_to_the_highest_priority_first(self):
+        from agent.service.llm_scheduler import LLMScheduler, Priority
+
+        scheduler = LLMScheduler(max_concurrency=1)
+        order = []
+
+        async def call(priority, label):
+            async with scheduler.slot(priority, session_id=label):
+                order.append(label)
+
+        await scheduler.acquire(Priority.INTERACTIVE)
+        waiters = [
+            asyncio.create_task(call(Priority.BACKGROUND, "summary")),
+            asyncio.create_task(call(Priority.STREAMING, "answer")),
+            asyncio.create_task(call(Priority.INTERACTIVE, "classify")),
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.waiting, 3)
+
+        scheduler.release()
+        await asyncio.gather(*waiters)
+        self.assertEqual(order, ["classify", "answer", "summary"])
+        self.assertEqual(scheduler.active, 0)
+
+
+    async def test_sessions_take_turns_within_a_priority(self):
+        from agent.service.llm_scheduler import LLMScheduler, Priority
+
+        scheduler = LLMScheduler(max_concurrency=1)
+        order = []
+
+        async def call(session_id, label):
+            async with scheduler.slot(Priority.STREAMING, session_id=session_id):
+                order.append(label)
+
+        await scheduler.acquire(Priority.INTERACTIVE)
+        waiters = [asyncio.create_task(call(session_id, label)) for session_id, label in (("a", "a1"), ("a", "a2"), ("b", "b1"))]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*waiters)
+        self.assertEqual(order, ["a1", "b1", "a2"])
+
+
+    async def test_new_turns_are_shed_once_the_line_is_full(self):
+        from agent.service.llm_scheduler import LLMScheduler, Priority, SchedulerBusy
+
+        scheduler = LLMScheduler(max_concurrency=1, max_queue_depth=1)
+        await scheduler.acquire(Priority.INTERACTIVE)
+        scheduler.check_admission()
+        waiter = asyncio.create_task(scheduler.acquire(Priority.STREAMING, session_id="a"))
+        await asyncio.sleep(0)
+
+        with self.assertRaises(SchedulerBusy):
+            scheduler.check_admission()
+        self.assertEqual(scheduler.stats()["shed"], 1)
+
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        self.assertEqual((scheduler.waiting, scheduler.cancelled_waits), (0, 1))
+        scheduler.check_admission()
+
+
+class TemporalParserTests(SimpleTestCase):
+    NOW = datetime(2025, 6, 4, 10, 0, tzinfo=timezone.utc)  # a Wednesday
+
+    def parse(self, text: str):
+        from agent.service.temporal_parser import TemporalParser
+        return TemporalParser(time_zone="UTC").parse(text, self.NOW)
+
+
+    def test_relative_day_and_time(self):
+        parse = self.parse("Schedule a meeting with Sarah tomorrow at 10am")
+        self.assertTrue(parse.complete)
+        self.assertEqual((parse.summary, parse.start, parse.end), ("Meeting with Sarah", datetime(2025, 6, 5, 10, 0, tzinfo=timezone.utc), datetime(2025, 6, 5, 11, 0, tzinfo=timezone.utc)))
+
+
+    def test_weekday_with_duration(self):
+        parse = self.parse("Dentist next Tuesday 3:30pm for an hour")
+        self.assertEqual((parse.start.isoformat(), parse.end.isoformat()), ("2025-06-10T15:30:00+00:00", "2025-06-10T16:30:00+00:00"))
+
+
+    def test_recurrence(self):
+        parse = self.parse("Gym every Monday and Wednesday at 7am")
+        self.assertEqual(parse.recurrence, "RRULE:FREQ=WEEKLY;BYDAY=MO,WE")
+        self.assertEqual(parse.start.isoformat(), "2025-06-09T07:00:00+00:00")
+
+
+    def test_location_and_offsets(self):
+        parse = self.parse("Coffee with Ana on the 20th at 8:30am at Java House")
+        self.assertEqual((parse.location, parse.start.isoformat()), ("Java House", "2025-06-20T08:30:00+00:00"))
+        self.assertEqual(self.parse("Call with Bob in 2 hours").start.isoformat(), "2025-06-04T12:00:00+00:00")
+
+
+    def test_vague_or_impossible_phrasings_are_left_to_the_model(self):
+        for text in ("Schedule something next week", "Schedule a meeting on February 30 at 10am", "Block Mon-Fri 9am standup"):
+            with self.subTest(text=text):
+                self.assertFalse(self.parse(text).complete)
+
+
+    def test_the_corpus_resolves_as_recorded(self):
+        from agent.service.temporal_parser import TemporalParser
+        from benchmarks.temporal_parser import DEFAULT_CORPUS, describe
+
+        with open(DEFAULT_CORPUS) as f:
+            corpus = json.load(f)
+        parser = TemporalParser(time_zone=corpus["time_zone"])
+        now = datetime.fromisoformat(corpus["now"])
+        for phrasing in corpus["phrasings"]:
+            with self.subTest(text=phrasing["text"]):
+                parse = parser.parse(phrasing["text"], now)
+                self.assertEqual(describe(parse) if parse.complete else None, phrasing["expected"])
+
+
+class JsonStreamScannerTests(SimpleTestCase):
+
+    def scan(self, *chunks):
+        from agent.service.structured_output import JsonStreamScanner
+
+        scanner = JsonStreamScanner()
+        for chunk in chunks:
+            scanner.feed(chunk)
+        return scanner
+
+
+    def test_completes_at_the_closing_brace_and_ignores_padding(self):
+        scanner = self.scan('Sure! {"events": [{"summary": "a } b"', ', "n": [1, 2]}]}', "\n\n\n\n")
+        self.assertTrue(scanner.complete)
+        self.assertEqual(json.loads(scanner.closed_text()), {"events": [{"summary": "a } b", "n": [1, 2]}]})
+
+
+    def test_escaped_quotes_stay_inside_strings(self):
+        scanner = self.scan('{"summary": "say \\"}\\" now"', "}")
+        self.assertTrue(scanner.complete)
+        self.assertEqual(json.loads(scanner.text)["summary"], 'say "}" now')
+
+
+    def test_truncated_output_is_closed_after_the_last_complete_member(self):
+        scanner = self.scan('{"events": [{"summary": "A"}, {"summary": "B", "start_ti')
+        self.assertFalse(scanner.complete)
+        self.assertEqual(json.loads(scanner.closed_text()), {"events": [{"summary": "A"}, {"summary": "B"}]})
+
+        scanner = self.scan('{"events": [{"summary": "A"}, {"summ')
+        self.assertEqual(json.loads(scanner.closed_text()), {"events": [{"summary": "A"}]})
+
+
+    def test_nothing_to_salvage(self):
+        self.assertIsNone(self.scan('{"events": [{"summ').closed_text())
+
+
+class EventRepairTests(SimpleTestCase):
+    NOW = datetime(2025, 6, 4, 10, 0, tzinfo=timezone.utc)
+    QUERY = "Schedule a meeting with Sarah tomorrow at 10am"
+
+    def repair(self, event_dict: dict, parsed=None):
+        from agent.service.intents import IntentDetector
+        from agent.service.temporal_parser import TemporalParser
+
+        detector = IntentDetector(ollama_client=SimpleNamespace(), temporal_parser=TemporalParser(time_zone="UTC"))
+        if parsed is None:
+            parsed = detector.temporal_parser.parse(self.QUERY, self.NOW)
+        return detector, detector._repair_event(event_dict, parsed, self.QUERY)
+
+
+    def test_invalid_fields_are_replaced_and_the_rest_kept(self):
+        detector, event = self.repair({
+            "summary": "   ",
+            "start_time": "2025-06-05T10:00:00+00:00",
+            "end_time": "TBD",
+            "time_zone": "Eastern",
+            "attendees_emails": ["Sarah", " sarah@example.com "],
+            "location": "Room 4",
+        })
+        self.assertEqual(event.summary, "Meeting with Sarah")
+        self.assertEqual(event.end_time, datetime(2025, 6, 5, 11, 0, tzinfo=timezone.utc))
+        self.assertEqual(event.time_zone, "UTC")
+        self.assertEqual(event.attendees_emails, ["sarah@example.com"])
+        self.assertEqual(event.location, "Room 4")
+        self.assertEqual(detector.structured_output.repaired_events, 1)
+        self.assertEqual(set(detector.structured_output.repaired_fields), {"summary", "end_time", "time_zone", "attendees_emails"})
+
+
+    def test_an_end_before_the_start_gets_the_default_duration(self):
+        from agent.service.temporal_parser import TemporalParse
+
+        _, event = self.repair(
+            {"summary": "Standup", "start_time": "2025-06-06T09:00:00", "end_time": "2025-06-06T08:00:00"},
+            parsed=TemporalParse(),
+        )
+        self.assertEqual(event.end_time - event.start_time, timedelta(hours=1))
+
+
+    def test_a_missing_start_is_taken_from_the_parser_or_the_event_dropped(self):
+        from agent.service.temporal_parser import TemporalParse
+
+        _, event = self.repair({"summary": "Meeting with Sarah", "start_time": "soon"})
+        self.assertEqual(event.start_time, datetime(2025, 6, 5, 10, 0, tzinfo=timezone.utc))
+        self.assertIsNone(self.repair({"summary": "Meeting with Sarah", "start_time": "soon"}, parsed=TemporalParse())[1])
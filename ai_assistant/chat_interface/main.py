@@ -1,13 +1,107 @@
+import time
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from uuid import uuid4
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
+import asyncio
+import logging
 import os
+import re
+
+from ai_assistant.chat_interface.streaming import CoalescingStreamer, StreamStats
+
+logger = logging.getLogger(__name__)
+
+
+def build_query_pipeline():
+    # Imported here so that importing this module (and starting the server) does not load LangChain
+    from agent.query_pipeline import QueryPipeline
+    pipeline = QueryPipeline()
+    timings = pipeline.warm_up()
+    logger.info("Query pipeline clients built: %s", timings)
+    return pipeline
+
+
+# Replaceable before the app starts (the benchmarks install one backed by local stand-ins)
+pipeline_factory = build_query_pipeline
+query_pipeline = None
+stream_stats = StreamStats()
+
+# Client-supplied session ids must look like the ones we hand out
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+# Startup phases, in seconds since this module started importing
+phases = {"started": None, "ready": None, "error": None}
+_pipeline_task = None
+# The event loop the app serves on, set by the lifespan
+_app_loop = None
+
+
+def start_warm_up() -> asyncio.Task:
+    """
+    Starts building the query pipeline in a worker thread, unless it is already built or being built.
+    The server keeps accepting connections meanwhile; /readyz reports when it is done.
+    """
+    global _pipeline_task
+    if _pipeline_task is None or (_pipeline_task.done() and query_pipeline is None):
+        _pipeline_task = asyncio.create_task(_warm_up())
+        # The failure is reported through /readyz and the next caller retries
+        _pipeline_task.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return _pipeline_task
+
+
+async def _warm_up():
+    global query_pipeline
+    try:
+        pipeline = await asyncio.to_thread(pipeline_factory)
+    except Exception as e:
+        phases["error"] = repr(e)
+        logger.error("Query pipeline failed to start: %r", e)
+        raise
+    query_pipeline = pipeline
+    phases["ready"] = round(time.perf_counter() - _import_started, 3)
+    phases["error"] = None
+    logger.info("Ready after %.3f s", phases["ready"])
+    return pipeline
+
 
-from agent.query_pipeline import QueryPipeline
+async def get_query_pipeline():
+    if query_pipeline is not None:
+        return query_pipeline
+    # Shielded so a client disconnecting while we wait does not cancel the shared build
+    return await asyncio.shield(start_warm_up())
 
-app = FastAPI()
-query_pipeline = QueryPipeline()
+
+async def run_turn(user_query: str, session_id: str) -> str:
+    """
+    The full answer to one message, for front ends that don't stream (the WhatsApp webhook workers).
+    Called from another event loop, the turn runs on the app's loop, so every front end in the
+    process shares this query pipeline; without a running app it runs on the caller's loop.
+    """
+    if _app_loop is not None and _app_loop is not asyncio.get_running_loop():
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(run_turn(user_query, session_id), _app_loop))
+    pipeline = await get_query_pipeline()
+    return "".join([chunk async for chunk in pipeline.run(user_query=user_query, session_id=session_id)])
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _app_loop
+    # Configured when the app starts, not on import, so importing it leaves the caller's logging alone.
+    # Per-chunk and prompt dumps are logged at DEBUG; set LOG-LEVEL=DEBUG to see them
+    logging.basicConfig(level=os.getenv("LOG-LEVEL", "INFO").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    _app_loop = asyncio.get_running_loop()
+    phases["started"] = round(time.perf_counter() - _import_started, 3)
+    logger.info("Accepting connections after %.3f s", phases["started"])
+    start_warm_up()
+    yield
+    _app_loop = None
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Serve the static index.html
 @app.get("/", response_class=HTMLResponse)
@@ -16,17 +110,95 @@ async def get():
     with open(index_path, "r") as f:
         return HTMLResponse(f.read())
 
+# Liveness: the process is up and serving requests
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "started_after_s": phases["started"]}
+
+# Readiness: the query pipeline and its clients are built, so chat requests won't wait on startup work
+@app.get("/readyz")
+async def readyz():
+    if query_pipeline is not None:
+        return {"status": "ready", **phases}
+    start_warm_up()
+    status = "failed" if phases["error"] else "starting"
+    return JSONResponse({"status": status, **phases}, status_code=503)
+
+# Prometheus scrape endpoint: WebSocket streaming counters, and per-stage latency histograms and the cache,
+# single-flight, scheduler and session store counters of the query pipeline (and its prompt-eval totals in measurement mode)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    body = stream_stats.render()
+    if query_pipeline is not None:
+        body += query_pipeline.metrics.render() + query_pipeline.single_flight.render() + query_pipeline.scheduler.render()
+        body += query_pipeline.memory_store.render()
+        if query_pipeline.prompt_stats is not None:
+            body += query_pipeline.prompt_stats.render()
+        if query_pipeline.answer_cache is not None:
+            body += query_pipeline.answer_cache.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 # Simple WebSocket endpoint for chat
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    session_id = str(uuid4())
-    
-    try:    
+    # A client reconnects with ?session_id=... to resume its conversation, possibly on another worker
+    session_id = websocket.query_params.get("session_id", "")
+    if not SESSION_ID_PATTERN.fullmatch(session_id):
+        session_id = str(uuid4())
+    await websocket.send_json({"type": "session", "session_id": session_id})
+    # Replies are coalesced into a few JSON frames and closed with an end-of-message frame
+    streamer = CoalescingStreamer(websocket, stats=stream_stats)
+    pipeline = None
+    # Messages are read by their own task, so a disconnect is noticed while a reply is still
+    # being generated, and that generation is cancelled instead of running to the end
+    inbox = asyncio.Queue()
+    receiver = asyncio.create_task(_receive_messages(websocket, inbox))
+
+    try:
+        while True:
+            user_input = await inbox.get()
+            if user_input is None:
+                break
+            logger.info("Received message on session %s", session_id)
+            logger.debug("Message text: %s", user_input)
+            if pipeline is None:
+                try:
+                    pipeline = await get_query_pipeline()
+                except Exception:
+                    await websocket.send_json({"type": "error", "error": "The assistant is unavailable right now, please try again shortly."})
+                    continue
+                pipeline.open_session(session_id)
+
+            reply = asyncio.create_task(streamer.stream(pipeline.run(user_query=user_input, session_id=session_id), message_id=str(uuid4())))
+            await asyncio.wait({reply, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if not reply.done():
+                logger.info("Client left mid-reply, cancelling generation: %s", session_id)
+                reply.cancel()
+                await asyncio.gather(reply, return_exceptions=True)
+                break
+            reply.result()
+            if receiver.done():
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        logger.info("Client disconnected: %s", session_id)
+        if pipeline is not None:
+            pipeline.release_session(session_id)
+
+
+async def _receive_messages(websocket: WebSocket, inbox: asyncio.Queue):
+    """
+    Queues the client's text messages; None marks the end of the connection.
+    """
+    try:
         while True:
-            user_input = await websocket.receive_text()
-            print(f"Received text {user_input} with session id {session_id}")
-            async for chunk in query_pipeline.run(user_query=user_input, session_id=session_id):
-                await websocket.send_text(chunk)
+            inbox.put_nowait(await websocket.receive_text())
     except WebSocketDisconnect:
-        print(f"🔌 Client disconnected: {session_id}")
+        pass
+    except Exception as e:
+        logger.warning("Stopped reading from the client: %r", e)
+    finally:
+        inbox.put_nowait(None)
@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+
+class StreamStats:
+    """
+    Process-wide counters for the WebSocket streaming layer. `chunks / frames` is the
+    coalescing ratio; `producer_stalls` counts how often a slow client paused the LLM stream.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.chunks = 0
+        self.frames = 0
+        self.producer_stalls = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "messages": self.messages,
+            "chunks": self.chunks,
+            "frames": self.frames,
+            "chunks_per_frame": round(self.chunks / self.frames, 2) if self.frames else 0.0,
+            "producer_stalls": self.producer_stalls,
+        }
+
+    def render(self, prefix: str = "assistant") -> str:
+        """
+        Streaming counters in the Prometheus text format, appended to the /metrics output.
+        """
+        lines = []
+        for metric, help_text, value in (
+            ("messages_total", "Replies streamed over the WebSocket.", self.messages),
+            ("chunks_total", "LLM chunks received for streamed replies.", self.chunks),
+            ("frames_total", "Delta frames sent after coalescing chunks.", self.frames),
+            ("producer_stalls_total", "Times a slow client paused reading from the LLM.", self.producer_stalls),
+        ):
+            name = f"{prefix}_stream_{metric}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+class CoalescingStreamer:
+    """
+    Streams a reply to a WebSocket as JSON frames instead of one text frame per LLM chunk.
+
+    Frames:
+    - {"type": "delta", "text": ...}  a run of coalesced chunks
+    - {"type": "end", "message_id": ..., "chars": ..., "frames": ..., "elapsed_ms": ...}
+    - {"type": "error", "message_id": ..., "error": ...}
+
+    Chunks are buffered and flushed once `max_chars` accumulate or `flush_interval`
+    seconds have passed since the first unsent chunk, whichever comes first.
+
+    Backpressure: the LLM stream is read by a separate task. While a send is in
+    progress, chunks keep accumulating in the buffer, so a slow client simply gets
+    fewer, larger frames. Once `max_buffer_chars` are pending, the reader stops pulling
+    from the LLM until the buffer drains.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_chars: int = 256,
+        flush_interval: float = 0.05,
+        max_buffer_chars: int = 16384,
+        stats: StreamStats = None,
+    ):
+        self.websocket = websocket
+        self.max_chars = max_chars
+        self.flush_interval = flush_interval
+        self.max_buffer_chars = max(max_buffer_chars, max_chars)
+        self.stats = stats or StreamStats()
+
+
+    async def stream(self, chunks: AsyncIterator[str], message_id: str):
+        """
+        Sends every chunk of `chunks`, followed by an end frame (or an error frame if the stream fails).
+        """
+        started = time.perf_counter()
+        buffer = []
+        buffered_chars = 0
+        total_chars = 0
+        frames = 0
+        finished = False
+        failure = None
+
+        data_ready = asyncio.Event()   # set when the buffer has something to send or the stream ended
+        drained = asyncio.Event()      # set when the buffer is below the high-water mark
+        drained.set()
+
+        async def read():
+            nonlocal buffered_chars, finished, failure
+            try:
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    if not drained.is_set():
+                        self.stats.producer_stalls += 1
+                        await drained.wait()
+                    buffer.append(chunk)
+                    buffered_chars += len(chunk)
+                    self.stats.chunks += 1
+                    if buffered_chars >= self.max_buffer_chars:
+                        drained.clear()
+                    data_ready.set()
+            except Exception as e:
+                failure = e
+            finally:
+                finished = True
+                data_ready.set()
+
+        reader = asyncio.create_task(read())
+        try:
+            while True:
+                await data_ready.wait()
+                if not finished and buffered_chars < self.max_chars:
+                    # Give the model a moment to produce more before paying for a frame
+                    deadline = time.perf_counter() + self.flush_interval
+                    while not finished and buffered_chars < self.max_chars:
+                        remaining = deadline - time.perf_counter()
+                        if remaining <= 0:
+                            break
+                        data_ready.clear()
+                        try:
+                            await asyncio.wait_for(data_ready.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            break
+
+                if buffer:
+                    text = "".join(buffer)
+                    buffer.clear()
+                    buffered_chars = 0
+                    drained.set()
+                    await self.websocket.send_text(json.dumps({"type": "delta", "text": text}))
+                    total_chars += len(text)
+                    frames += 1
+                    self.stats.frames += 1
+
+                if finished and not buffer:
+                    break
+                data_ready.clear()
+                if buffer or finished:
+                    data_ready.set()
+        finally:
+            if not reader.done():
+                # The client went away mid-reply; stop generating
+                reader.cancel()
+                await asyncio.gather(reader, return_exceptions=True)
+
+        self.stats.messages += 1
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        if failure is not None:
+            logger.error("Streaming reply %s failed: %r", message_id, failure)
+            await self.websocket.send_text(json.dumps({"type": "error", "message_id": message_id, "error": "Something went wrong while answering."}))
+            return
+
+        logger.debug("Sent reply %s: %d chars in %d frames, %.1f ms", message_id, total_chars, frames, elapsed_ms)
+        await self.websocket.send_text(json.dumps({
+            "type": "end",
+            "message_id": message_id,
+            "chars": total_chars,
+            "frames": frames,
+            "elapsed_ms": elapsed_ms,
+        }))
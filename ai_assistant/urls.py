@@ -1,8 +1,9 @@
 from django.contrib import admin
 from django.urls import path
-from apps.chat.views import WhatsAppWebhookView
+from apps.chat.views import WhatsAppWebhookView, WhatsAppWebhookStatsView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
-    path("webhook/", WhatsAppWebhookView.as_view(), name="whatsapp_webhook")
+    path("webhook/", WhatsAppWebhookView.as_view(), name="whatsapp_webhook"),
+    path("webhook/stats/", WhatsAppWebhookStatsView.as_view(), name="whatsapp_webhook_stats")
 ]
@@ -5,7 +5,7 @@ from fastapi.staticfiles import StaticFiles
 from starlette.routing import Mount
 from starlette.applications import Starlette
 
-from ai_assistant.chat_interface.main import app as fastapi_app
+from ai_assistant.chat_interface.main import app as fastapi_app, lifespan as fastapi_lifespan
 
 # Set Django settings
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ai_assistant.settings")
@@ -24,4 +24,5 @@ routes = [
     Mount("/", app=django_asgi_app),     # Django at root
 ]
 
-application = Starlette(routes=routes)
+# Mounted apps don't get lifespan events, so the FastAPI warm-up is started from here
+application = Starlette(routes=routes, lifespan=lambda app: fastapi_lifespan(fastapi_app))
@@ -0,0 +1,201 @@
+"""
+Event extraction before and after schema-constrained output, against a scripted model.
+
+Runs IntentDetector.extract_event on messages the temporal parser leaves to the LLM, once
+with free-form output (one generation, accepted only if it is valid as a whole) and once
+with the ExtractedEvents schema as the output format (streamed, closed once the object
+is complete, invalid fields repaired, a full retry only when that fails).
+
+The scripted model streams its answers at `--token-rate` tokens per second and makes the
+mistakes local models make, at configurable rates:
+
+- `--invalid-rate`: one field is wrong ("TBD" times, "Eastern" as a zone, a name
+  among the attendee emails, an empty summary)
+- `--truncate-rate`: the output stops mid-object (the token limit was hit)
+- `--prose-rate`: free-form only, the JSON comes wrapped in prose and a code fence
+- `--padding-rate`: constrained only, whitespace follows the object until the token limit
+  (`--padding-tokens`), as grammar-constrained decoding is known to do
+
+Reports failure and retry rates, repairs and extraction latency for both modes.
+
+    python -m benchmarks.extraction --rounds 10 --token-rate 200
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+# Message -> the events a well-behaved model extracts from it
+CORPUS = {
+    "Schedule a review on 3/7 at 2pm": [
+        {"summary": "Review", "start_time": "2025-07-03T14:00:00", "end_time": "2025-07-03T15:00:00", "time_zone": "UTC"},
+    ],
+    "Book a meeting with the design team": [
+        {"summary": "Meeting with the design team", "start_time": "2025-06-05T10:00:00", "end_time": "2025-06-05T11:00:00", "time_zone": "UTC"},
+    ],
+    "Lunch with Ana sometime next week, say Tuesday": [
+        {"summary": "Lunch with Ana", "start_time": "2025-06-10T12:00:00", "end_time": "2025-06-10T13:00:00", "time_zone": "UTC"},
+    ],
+    "Schedule 1:1 with john@example.com on 2025-06-10 at 14:00": [
+        {"summary": "1:1 with John", "start_time": "2025-06-10T14:00:00", "end_time": "2025-06-10T15:00:00",
+         "time_zone": "UTC", "attendees_emails": ["john@example.com"]},
+    ],
+    "Call the bank tomorrow": [
+        {"summary": "Call the bank", "start_time": "2025-06-05T09:00:00", "end_time": "2025-06-05T09:30:00", "time_zone": "UTC"},
+    ],
+    "Meeting at 3 with 2 people from finance": [
+        {"summary": "Meeting with finance", "start_time": "2025-06-04T15:00:00", "end_time": "2025-06-04T16:00:00", "time_zone": "UTC"},
+    ],
+    "Block Mon-Fri 9am standup": [
+        {"summary": "Standup", "start_time": f"2025-06-{day:02d}T09:00:00", "end_time": f"2025-06-{day:02d}T09:15:00", "time_zone": "UTC"}
+        for day in range(9, 14)
+    ],
+    "Dinner with the in-laws on the 14th, around 7-ish, at Carnivore": [
+        {"summary": "Dinner with the in-laws", "location": "Carnivore", "start_time": "2025-06-14T19:00:00",
+         "end_time": "2025-06-14T21:00:00", "time_zone": "Africa/Nairobi"},
+    ],
+    "Put the quarterly planning offsite in, first Monday of July, all day": [
+        {"summary": "Quarterly planning offsite", "start_time": "2025-07-07T09:00:00", "end_time": "2025-07-07T17:00:00", "time_zone": "UTC"},
+    ],
+    "Set up a call with the Lagos office when they open on Thursday": [
+        {"summary": "Call with the Lagos office", "start_time": "2025-06-05T08:00:00", "end_time": "2025-06-05T08:30:00", "time_zone": "Africa/Lagos"},
+    ],
+}
+
+FIELD_MISTAKES = (
+    ("end_time", "TBD"),
+    ("time_zone", "Eastern"),
+    ("attendees_emails", ["the design team"]),
+    ("summary", ""),
+    ("start_time", "later"),
+)
+
+
+def query_of(request: str) -> str:
+    # The request block ends with the user's message between two "---" lines
+    return request.rsplit("---", 2)[-2].strip()
+
+
+class ScriptedExtractionModel:
+    """
+    Stands in for `ollama.AsyncClient`: answers extraction requests with the corpus events,
+    generated at `token_rate` tokens per second (4 characters each) and with injected mistakes.
+    """
+
+    def __init__(self, args, seed: int = 0):
+        self.args = args
+        self.rng = random.Random(seed)
+        self.generated_tokens = 0
+
+
+    async def chat(self, model: str, messages: list, options=None, stream: bool = False, format=None, **kwargs):
+        events = [dict(event) for event in CORPUS[query_of(messages[-1]["content"])]]
+        if self.rng.random() < self.args.invalid_rate:
+            field, value = self.rng.choice(FIELD_MISTAKES)
+            events[self.rng.randrange(len(events))][field] = value
+        content = json.dumps({"events": events})
+
+        if self.rng.random() < self.args.truncate_rate:
+            content = content[:int(len(content) * self.rng.uniform(0.5, 0.95))]
+        elif format is None and self.rng.random() < self.args.prose_rate:
+            content = f"Sure! Here is the event:\n```json\n{content}\n```\nLet me know if you want to change anything."
+        elif format is not None and self.rng.random() < self.args.padding_rate:
+            content += "\n" * self.args.padding_tokens
+
+        tokens = [content[offset:offset + 4] for offset in range(0, len(content), 4)]
+        if stream:
+            return self._stream(tokens)
+        await asyncio.sleep(self.args.prefill + len(tokens) / self.args.token_rate)
+        self.generated_tokens += len(tokens)
+        return {"message": {"role": "assistant", "content": content}, "done": True}
+
+
+    async def _stream(self, tokens: list[str]):
+        loop = asyncio.get_running_loop()
+        started = loop.time() + self.args.prefill
+        for index, token in enumerate(tokens, start=1):
+            # Against a deadline, so the per-token sleeps don't add up their overhead
+            await asyncio.sleep(max(0.0, started + index / self.args.token_rate - loop.time()))
+            self.generated_tokens += 1
+            yield {"message": {"role": "assistant", "content": token}, "done": False}
+        yield {"message": {"role": "assistant", "content": ""}, "done": True}
+
+
+async def run_mode(args, structured: bool) -> dict:
+    from agent.service.intents import IntentDetector
+    from agent.service.ollama_client import AsyncOllamaClient
+
+    model = ScriptedExtractionModel(args)
+    detector = IntentDetector(ollama_client=AsyncOllamaClient(client=model, max_concurrency=args.concurrency), structured_output=structured)
+    queries = list(CORPUS) * args.rounds
+    pending = list(queries)
+    latencies, failures = [], 0
+
+    # `concurrency` sessions extracting one message at a time, so latency is not queueing time
+    async def session():
+        nonlocal failures
+        while pending:
+            query = pending.pop()
+            started = time.perf_counter()
+            try:
+                await detector.extract_event(query)
+            except ValueError:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(session() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    stats = detector.structured_output.stats()
+    latencies.sort()
+    return {
+        "extractions": len(queries),
+        "llm_extractions": stats["calls"],
+        "failures": failures,
+        "failure_rate": round(failures / len(queries), 3),
+        "retries": stats["retries"],
+        "retry_rate": stats["retry_rate"],
+        "repaired_events": stats["repaired_events"],
+        "repaired_fields": stats["repaired_fields"],
+        "truncated_outputs_salvaged": stats["truncated"],
+        "streams_closed_early": stats["stopped_early"],
+        "generated_tokens": model.generated_tokens,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 1),
+            "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+            "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+        },
+        "elapsed_seconds": round(elapsed, 2),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=10, help="passes over the message corpus per mode")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--token-rate", type=float, default=200.0)
+    parser.add_argument("--prefill", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--invalid-rate", type=float, default=0.1)
+    parser.add_argument("--truncate-rate", type=float, default=0.03)
+    parser.add_argument("--prose-rate", type=float, default=0.1)
+    parser.add_argument("--padding-rate", type=float, default=0.2)
+    parser.add_argument("--padding-tokens", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    report = {
+        "free_form": asyncio.run(run_mode(args, structured=False)),
+        "structured": asyncio.run(run_mode(args, structured=True)),
+    }
+    print(json.dumps(report, indent=2))
+
+    if report["structured"]["failure_rate"] > report["free_form"]["failure_rate"]:
+        print("FAIL: schema-constrained extraction failed more often than free-form", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
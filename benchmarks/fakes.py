@@ -0,0 +1,312 @@
+"""
+Deterministic local stand-ins for the services QueryPipeline talks to, so the
+benchmarks run offline and give the same numbers for the same settings:
+
+- FakeModelServer: the Ollama server's capacity, `parallel` requests at a time.
+- FakeChatOllama: the streaming chat model, emitting tokens at a fixed rate.
+- FakeOllamaClient: the raw Ollama client used for intent classification and event extraction.
+- FakeVectorSearch: the retriever (MongoDB Atlas vector search), with a fixed lookup latency.
+- FakeEmbeddings: the query embedding model, as hashed bags of words.
+- FakeCalendar: the Google Calendar service, with a fixed API latency.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Iterator, Optional
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from agent.models import EventCreate, EventCreateResult, EventSummary, UpcomingEventsResponse
+
+_VOCABULARY = (
+    "sure here is what I found about your question the calendar looks clear and the "
+    "meeting is confirmed let me know if you need anything else today or later this week"
+).split()
+
+
+def _seed(text: str) -> int:
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+
+
+def _reply_tokens(prompt: str, count: int) -> list[str]:
+    seed = _seed(prompt)
+    return [f" {_VOCABULARY[(seed + i * 7) % len(_VOCABULARY)]}" for i in range(count)]
+
+
+class FakeModelServer:
+    """
+    Stands in for the Ollama server's request slots (OLLAMA_NUM_PARALLEL): at most
+    `parallel` generations run at once, later ones wait first come, first served.
+    Shared by the fake chat model and the fake raw client, like the real server.
+    """
+
+    def __init__(self, parallel: int = 4):
+        self.parallel = parallel
+        self._slots = None
+
+
+    def slot(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.parallel)
+        return self._slots
+
+
+class FakeChatOllama(BaseChatModel):
+    """
+    Stands in for ChatOllama. Waits `prompt_latency` seconds (prompt evaluation), then
+    streams `reply_tokens` tokens at `token_rate` tokens per second. The final chunk
+    carries Ollama-style timing metadata (done, eval_count, eval_duration).
+    Async calls hold a slot of `server` (a FakeModelServer), when given, while they run.
+    """
+
+    token_rate: float = 50.0
+    prompt_latency: float = 0.05
+    reply_tokens: int = 40
+    server: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-ollama"
+
+
+    def _generate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = _reply_tokens(self._prompt(messages), self.reply_tokens)
+        time.sleep(self.prompt_latency + len(tokens) / self.token_rate)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+
+    async def _agenerate(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = _reply_tokens(self._prompt(messages), self.reply_tokens)
+        async with self._server_slot():
+            await asyncio.sleep(self.prompt_latency + len(tokens) / self.token_rate)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens).strip()))])
+
+
+    def _stream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        prompt = self._prompt(messages)
+        time.sleep(self.prompt_latency)
+        for token in _reply_tokens(prompt, self.reply_tokens):
+            time.sleep(1 / self.token_rate)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", response_metadata=self._done_metadata(prompt)))
+
+
+    async def _astream(
+        self,
+        messages: list[BaseMessage],
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        prompt = self._prompt(messages)
+        async with self._server_slot():
+            await asyncio.sleep(self.prompt_latency)
+            for token in _reply_tokens(prompt, self.reply_tokens):
+                await asyncio.sleep(1 / self.token_rate)
+                chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+                if run_manager:
+                    await run_manager.on_llm_new_token(token, chunk=chunk)
+                yield chunk
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", response_metadata=self._done_metadata(prompt)))
+
+
+    def _server_slot(self):
+        return self.server.slot() if self.server is not None else contextlib.nullcontext()
+
+
+    def _done_metadata(self, prompt: str) -> dict:
+        return {
+            "done": True,
+            "prompt_eval_count": len(prompt) // 4,
+            "prompt_eval_duration": int(self.prompt_latency * 1e9),
+            "eval_count": self.reply_tokens,
+            "eval_duration": int(self.reply_tokens / self.token_rate * 1e9),
+        }
+
+
+    @staticmethod
+    def _prompt(messages: list[BaseMessage]) -> str:
+        return "\n".join(str(message.content) for message in messages)
+
+
+class FakeOllamaClient:
+    """
+    Stands in for `ollama.AsyncClient` behind AsyncOllamaClient. Answers intent
+    classification with a keyword guess and event extraction with a one-hour
+    meeting tomorrow at 10:00 UTC, after `latency` seconds (holding a slot of `server`, when given).
+    With `stream=True` the same content comes back in small chunks.
+    """
+
+    def __init__(self, latency: float = 0.15, server: Optional[FakeModelServer] = None):
+        self.latency = latency
+        self.server = server
+        self.calls = 0
+
+
+    async def chat(self, model: str, messages: list, options: Optional[dict] = None, stream: bool = False, **kwargs):
+        self.calls += 1
+        async with self.server.slot() if self.server is not None else contextlib.nullcontext():
+            await asyncio.sleep(self.latency)
+        system, request = messages[0]["content"], messages[-1]["content"]
+
+        if "JSON" in system:
+            start = (datetime.now(timezone.utc) + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+            content = json.dumps({"events": [{
+                "summary": "Meeting",
+                "start_time": start.isoformat(),
+                "end_time": (start + timedelta(hours=1)).isoformat(),
+                "time_zone": "UTC",
+            }]})
+        else:
+            lowered = request.lower()
+            if any(word in lowered for word in ("schedule", "book", "add", "remind")):
+                content = "create_event"
+            elif any(word in lowered for word in ("calendar", "free", "busy", "agenda")):
+                content = "check_calendar"
+            else:
+                content = "general"
+
+        response = {
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "prompt_eval_count": sum(len(message["content"]) for message in messages) // 4,
+            "eval_count": len(content) // 4 + 1,
+        }
+        return self._chunks(response) if stream else response
+
+
+    @staticmethod
+    async def _chunks(response: dict):
+        content = response["message"]["content"]
+        for offset in range(0, len(content), 8):
+            yield {"message": {"role": "assistant", "content": content[offset:offset + 8]}, "done": False}
+        yield {**response, "message": {"role": "assistant", "content": ""}}
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Stands in for OllamaEmbeddings: a hashed bag of lower-cased words, so rephrasings with
+    the same words embed close together. Takes no time.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = [0.0] * self.dimensions
+        for word in re.findall(r"\w+", text.lower()):
+            vector[_seed(word) % self.dimensions] += 1.0
+        return vector
+
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+class FakeVectorSearch:
+    """
+    Stands in for EmbeddingModel (and the MongoDB Atlas vector search behind it).
+    `retrieve_context` blocks for `latency` seconds, like the synchronous driver call
+    it replaces, and returns the `k` corpus passages sharing the most words with the query.
+    """
+
+    def __init__(self, corpus: Optional[list[str]] = None, latency: float = 0.03, k: int = 3):
+        self.corpus = corpus or [
+            "Python is a popular general-purpose programming language known for readability.",
+            "Rust offers memory safety without a garbage collector.",
+            "JavaScript runs in every web browser and on servers with Node.js.",
+            "Go is designed for simple, concurrent network services.",
+            "The assistant can create calendar events and answer questions about your schedule.",
+            "Customer churn is reduced by onboarding, support quality and regular check-ins.",
+        ]
+        self.latency = latency
+        self.k = k
+        self.calls = 0
+        self.embedding = FakeEmbeddings()
+        self.kb_version = 0
+
+
+    def retrieve_context(self, user_query: str) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        words = set(user_query.lower().split())
+        ranked = sorted(self.corpus, key=lambda passage: (-len(words & set(passage.lower().split())), passage))
+        return "\n\n".join(ranked[:self.k])
+
+
+class FakeCalendar:
+    """
+    Stands in for GoogleCalendar. Every API call (insert, batch insert, list) blocks for
+    `latency` seconds; created events are kept in memory and show up in upcoming events.
+    """
+
+    def __init__(self, latency: float = 0.08):
+        self.latency = latency
+        self.events = []
+        self._lock = threading.Lock()
+
+
+    def add_event(self, event_data: EventCreate) -> dict:
+        time.sleep(self.latency)
+        return self._store(event_data)
+
+
+    def add_events(self, events: list[EventCreate]) -> list[EventCreateResult]:
+        time.sleep(self.latency)
+        return [EventCreateResult(index=index, event=self._store(event_data)) for index, event_data in enumerate(events)]
+
+
+    def get_upcoming_events(self, max_results: int = 10) -> UpcomingEventsResponse:
+        time.sleep(self.latency)
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event["start"]["dateTime"])[:max_results]
+        return UpcomingEventsResponse(events=[
+            EventSummary(
+                summary=event["summary"],
+                start_time=event["start"]["dateTime"],
+                end_time=event["end"]["dateTime"],
+                location=event.get("location"),
+                html_link=event["htmlLink"],
+            )
+            for event in events
+        ])
+
+
+    def _store(self, event_data: EventCreate) -> dict:
+        with self._lock:
+            event = {
+                "id": f"fake{len(self.events)}",
+                "summary": event_data.summary,
+                "location": event_data.location,
+                "start": {"dateTime": event_data.start_time.isoformat(), "timeZone": event_data.time_zone},
+                "end": {"dateTime": event_data.end_time.isoformat(), "timeZone": event_data.time_zone},
+                "htmlLink": f"https://calendar.example/event/fake{len(self.events)}",
+            }
+            self.events.append(event)
+        return event
@@ -0,0 +1,302 @@
+"""
+Offline load test for the chat WebSocket.
+
+Serves the real FastAPI app (ai_assistant/chat_interface/main.py) in-process with uvicorn,
+backed by the deterministic stand-ins in benchmarks/fakes.py, then opens N concurrent
+/ws sessions that replay scripted conversations (benchmarks/conversations.json) and the
+text messages of WhatsApp webhook payloads such as example.json.
+
+Reports throughput, end-to-end latency and time-to-first-token percentiles, and exits
+non-zero when a tracked metric regresses beyond the tolerance of the stored baseline.
+The baseline file keeps one run per settings; a run is compared with the one recorded
+with the same settings.
+
+The default run models a model server with 4 parallel slots behind a 4-slot scheduler.
+`--server-parallel 0 --llm-concurrency 0` is the comparison run with unlimited model
+capacity (the load test's only mode before the scheduler): the gap between the two is
+the cost of model-server contention, not of the pipeline.
+
+    python -m benchmarks.load_test --sessions 20 --token-rate 50
+    python -m benchmarks.load_test --server-parallel 0 --llm-concurrency 0
+    python -m benchmarks.load_test --update-baseline
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+# Stands in for "no limit" on the scheduler's concurrency
+UNLIMITED_CONCURRENCY = 1_000_000
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+DEFAULT_CONVERSATIONS = os.path.join(BENCHMARK_DIR, "conversations.json")
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_WHATSAPP_PAYLOADS = [os.path.join(REPO_ROOT, "example.json")]
+
+# metric -> True when lower is better
+TRACKED_METRICS = {
+    "e2e_p50_ms": True,
+    "e2e_p95_ms": True,
+    "ttft_p95_ms": True,
+    "throughput_turns_per_sec": False,
+}
+
+
+def load_conversations(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def whatsapp_conversations(paths: list[str]) -> list[dict]:
+    """
+    Turns WhatsApp Cloud API webhook payloads into conversations: one per sender (wa_id),
+    made of their text messages in payload order.
+    """
+    by_sender = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        for entry in payload.get("entry", []):
+            for change in entry.get("changes", []):
+                for message in change.get("value", {}).get("messages", []):
+                    if message.get("type") == "text":
+                        by_sender.setdefault(message["from"], []).append(message["text"]["body"])
+    return [{"name": f"whatsapp:{wa_id}", "turns": turns} for wa_id, turns in by_sender.items()]
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def build_pipeline(args, spill_path: str):
+    from agent.query_pipeline import QueryPipeline
+    from agent.service.ollama_client import AsyncOllamaClient
+    from agent.service.session_store import SessionStore
+    from benchmarks.fakes import FakeCalendar, FakeChatOllama, FakeModelServer, FakeOllamaClient, FakeVectorSearch
+
+    server = FakeModelServer(parallel=args.server_parallel) if args.server_parallel else None
+    return QueryPipeline(
+        llm_max_concurrency=args.llm_concurrency or UNLIMITED_CONCURRENCY,
+        speculative_prefetch=args.speculative_prefetch,
+        answer_cache_size=0 if args.no_answer_cache else 1024,
+        measure_prompt_eval=args.measure_prompt_eval,
+        chat_llm=FakeChatOllama(token_rate=args.token_rate, prompt_latency=args.prompt_latency, reply_tokens=args.reply_tokens, server=server),
+        ollama_client=AsyncOllamaClient(client=FakeOllamaClient(latency=args.routing_latency, server=server)),
+        embedder=FakeVectorSearch(latency=args.retrieval_latency),
+        calendar=FakeCalendar(latency=args.calendar_latency),
+        memory_store=SessionStore(spill_path=spill_path),
+    )
+
+
+def install_pipeline(pipeline):
+    """
+    Imports the chat app with `pipeline` in place of the one it would build against the real services.
+    """
+    # Keep the app's own logging to warnings so it does not drown the report
+    os.environ.setdefault("LOG-LEVEL", "WARNING")
+
+    from ai_assistant.chat_interface import main
+    main.pipeline_factory = lambda: pipeline
+    return main.app
+
+
+def start_server(app) -> tuple:
+    import uvicorn
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="benchmark-server", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline or not thread.is_alive():
+            raise RuntimeError("The benchmark server did not start")
+        time.sleep(0.01)
+    return server, thread, port
+
+
+async def run_session(url: str, turns: list[str], think_time: float, results: list):
+    import websockets
+
+    async with websockets.connect(url, max_size=None) as websocket:
+        for turn in turns:
+            started = time.perf_counter()
+            first_frame = None
+            failed = False
+            await websocket.send(turn)
+            while True:
+                frame = json.loads(await websocket.recv())
+                if frame["type"] == "delta" and first_frame is None:
+                    first_frame = time.perf_counter()
+                elif frame["type"] in ("end", "error"):
+                    failed = frame["type"] == "error"
+                    break
+            finished = time.perf_counter()
+            results.append({
+                "e2e": finished - started,
+                "ttft": (first_frame or finished) - started,
+                "error": failed,
+            })
+            if think_time:
+                await asyncio.sleep(think_time)
+
+
+async def run_load(port: int, conversations: list[dict], sessions: int, think_time: float) -> dict:
+    url = f"ws://127.0.0.1:{port}/ws"
+    results = []
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(run_session(url, conversations[i % len(conversations)]["turns"], think_time, results) for i in range(sessions)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - started
+
+    e2e = [result["e2e"] * 1000 for result in results]
+    ttft = [result["ttft"] * 1000 for result in results]
+    return {
+        "sessions": sessions,
+        "turns": len(results),
+        "errors": sum(result["error"] for result in results) + sum(isinstance(outcome, Exception) for outcome in outcomes),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_turns_per_sec": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        "e2e_p50_ms": round(percentile(e2e, 0.50), 1),
+        "e2e_p95_ms": round(percentile(e2e, 0.95), 1),
+        "e2e_p99_ms": round(percentile(e2e, 0.99), 1),
+        "ttft_p50_ms": round(percentile(ttft, 0.50), 1),
+        "ttft_p95_ms": round(percentile(ttft, 0.95), 1),
+        "ttft_p99_ms": round(percentile(ttft, 0.99), 1),
+    }
+
+
+def check_regressions(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for metric, lower_is_better in TRACKED_METRICS.items():
+        if metric not in baseline:
+            continue
+        expected, actual = baseline[metric], report[metric]
+        if lower_is_better and actual > expected * (1 + tolerance):
+            regressions.append(f"{metric}: {actual} > {expected} (+{tolerance:.0%})")
+        elif not lower_is_better and actual < expected * (1 - tolerance):
+            regressions.append(f"{metric}: {actual} < {expected} (-{tolerance:.0%})")
+    return regressions
+
+
+def run_settings(args) -> dict:
+    """
+    The knobs that shape the numbers; a baseline only applies to runs with the same settings.
+    """
+    return {
+        "sessions": args.sessions,
+        "think_time": args.think_time,
+        "token_rate": args.token_rate,
+        "reply_tokens": args.reply_tokens,
+        "prompt_latency": args.prompt_latency,
+        "routing_latency": args.routing_latency,
+        "retrieval_latency": args.retrieval_latency,
+        "calendar_latency": args.calendar_latency,
+        "speculative_prefetch": args.speculative_prefetch,
+        "answer_cache": not args.no_answer_cache,
+        "server_parallel": args.server_parallel,
+        "llm_concurrency": args.llm_concurrency,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent /ws sessions")
+    parser.add_argument("--conversations", default=DEFAULT_CONVERSATIONS, help="JSON list of {name, turns}")
+    parser.add_argument("--whatsapp", nargs="*", default=DEFAULT_WHATSAPP_PAYLOADS, help="WhatsApp webhook payloads to replay")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between turns of a session")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="fake LLM tokens per second")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="tokens per fake LLM answer")
+    parser.add_argument("--prompt-latency", type=float, default=0.05, help="fake LLM prompt evaluation time")
+    parser.add_argument("--routing-latency", type=float, default=0.15, help="fake Ollama classification/extraction time")
+    parser.add_argument("--retrieval-latency", type=float, default=0.03, help="fake vector search time")
+    parser.add_argument("--calendar-latency", type=float, default=0.08, help="fake Calendar API time")
+    parser.add_argument("--server-parallel", type=int, default=4, help="generations the fake model server runs at once (0: unlimited)")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="model calls the pipeline's scheduler admits at once (0: unlimited)")
+    parser.add_argument("--speculative-prefetch", action="store_true")
+    parser.add_argument("--no-answer-cache", action="store_true", help="generate every GENERAL answer")
+    parser.add_argument("--measure-prompt-eval", action="store_true", help="report prompt-eval counts per call site")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    return parser.parse_args(argv)
+
+
+def load_baseline_runs(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    # Files written before the baseline kept several runs hold a single one
+    return baseline.get("runs", [baseline])
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    conversations = load_conversations(args.conversations) + whatsapp_conversations(args.whatsapp or [])
+
+    with tempfile.TemporaryDirectory() as workdir:
+        pipeline = build_pipeline(args, os.path.join(workdir, "sessions.sqlite3"))
+        server, thread, port = start_server(install_pipeline(pipeline))
+        try:
+            report = asyncio.run(run_load(port, conversations, args.sessions, args.think_time))
+        finally:
+            server.should_exit = True
+            thread.join(timeout=10)
+    if pipeline.answer_cache is not None:
+        report["answer_cache"] = pipeline.answer_cache.stats()
+    report["single_flight"] = pipeline.single_flight.stats()
+    report["scheduler"] = pipeline.scheduler.stats()
+    report["extraction"] = pipeline.intent_detector.extraction_path_stats()
+    report["structured_output"] = pipeline.intent_detector.structured_output.stats()
+    if pipeline.prompt_stats is not None:
+        report["prompt_eval"] = pipeline.prompt_stats.snapshot()
+
+    print(json.dumps(report, indent=2))
+
+    runs = load_baseline_runs(args.baseline)
+    settings = run_settings(args)
+    if args.update_baseline:
+        runs = [run for run in runs if run["settings"] != settings]
+        runs.append({"settings": settings, **{metric: report[metric] for metric in TRACKED_METRICS}})
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"runs": runs}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if report["errors"]:
+        print(f"FAIL: {report['errors']} turns failed", file=sys.stderr)
+        return 1
+
+    if runs:
+        baseline = next((run for run in runs if run["settings"] == settings), None)
+        if baseline is None:
+            print("SKIP: no baseline run was recorded with these settings; rerun with --update-baseline to compare")
+            return 0
+        regressions = check_regressions(report, baseline, args.tolerance)
+        if regressions:
+            print("FAIL: regression against baseline\n  " + "\n  ".join(regressions), file=sys.stderr)
+            return 1
+        print("OK: within baseline tolerance")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
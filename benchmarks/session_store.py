@@ -0,0 +1,137 @@
+"""
+Append and read latency of the session-history backends under concurrent workers.
+
+Each worker process owns `--sessions` conversations and plays `--turns` turns on each,
+round-robin, like a chat worker serving many clients: append a human/AI message pair,
+then read the history back (as the next prompt would). Backends:
+
+- memory:      SessionStore, private to each worker
+- sqlite:      SharedSessionStore with batched (group-committed) appends
+- sqlite-sync: SharedSessionStore committing every append on its own
+
+For the shared backends, the parent process then reopens the database and checks
+that every conversation is complete, i.e. another worker could resume it.
+
+    python -m benchmarks.session_store --workers 4 --sessions 50 --turns 20
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+BACKENDS = ("memory", "sqlite", "sqlite-sync")
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+def open_store(backend: str, workdir: str, worker: int):
+    from agent.service.session_store import SessionStore, SharedSessionStore
+
+    if backend == "memory":
+        return SessionStore(spill_path=os.path.join(workdir, f"spill-{worker}.sqlite3"))
+    flush_interval = 0.01 if backend == "sqlite" else 0
+    return SharedSessionStore(os.path.join(workdir, "shared.sqlite3"), flush_interval=flush_interval)
+
+
+def run_worker(backend: str, workdir: str, worker: int, sessions: int, turns: int) -> dict:
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    store = open_store(backend, workdir, worker)
+    session_ids = [f"worker{worker:03d}-session{i:05d}" for i in range(sessions)]
+    appends, reads = [], []
+
+    started = time.perf_counter()
+    for turn in range(turns):
+        for session_id in session_ids:
+            history = store.get(session_id)
+            pair = [HumanMessage(content=f"question {turn} " * 8), AIMessage(content=f"answer {turn} " * 40)]
+
+            t = time.perf_counter()
+            history.add_messages(pair)
+            appends.append(time.perf_counter() - t)
+
+            t = time.perf_counter()
+            messages = history.messages
+            reads.append(time.perf_counter() - t)
+            assert len(messages) == 2 * (turn + 1), f"{session_id} lost messages"
+
+    for session_id in session_ids:
+        store.release(session_id)
+    elapsed = time.perf_counter() - started
+    if hasattr(store, "close"):
+        store.close()
+    return {"appends": appends, "reads": reads, "elapsed": elapsed}
+
+
+def _worker_entry(args):
+    return run_worker(*args)
+
+
+def verify_shared(workdir: str, workers: int, sessions: int, turns: int) -> int:
+    """
+    Returns how many conversations a fresh process could not resume in full.
+    """
+    from agent.service.session_store import SharedSessionStore
+
+    store = SharedSessionStore(os.path.join(workdir, "shared.sqlite3"), flush_interval=0)
+    incomplete = 0
+    for worker in range(workers):
+        for i in range(sessions):
+            if len(store.get(f"worker{worker:03d}-session{i:05d}").messages) != 2 * turns:
+                incomplete += 1
+    store.close()
+    return incomplete
+
+
+def run_backend(backend: str, workers: int, sessions: int, turns: int) -> dict:
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            results = pool.map(_worker_entry, [(backend, workdir, worker, sessions, turns) for worker in range(workers)])
+        elapsed = time.perf_counter() - started
+        incomplete = verify_shared(workdir, workers, sessions, turns) if backend != "memory" else None
+
+    appends = [latency * 1e6 for result in results for latency in result["appends"]]
+    reads = [latency * 1e6 for result in results for latency in result["reads"]]
+    turns_played = workers * sessions * turns
+    return {
+        "backend": backend,
+        "turns": turns_played,
+        "turns_per_sec": round(turns_played / max(result["elapsed"] for result in results), 1),
+        "append_p50_us": round(percentile(appends, 0.50), 1),
+        "append_p99_us": round(percentile(appends, 0.99), 1),
+        "read_p50_us": round(percentile(reads, 0.50), 1),
+        "read_p99_us": round(percentile(reads, 0.99), 1),
+        "wall_seconds": round(elapsed, 3),
+        "incomplete_sessions": incomplete,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sessions", type=int, default=50, help="conversations per worker")
+    parser.add_argument("--turns", type=int, default=20, help="turns per conversation")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    args = parser.parse_args(argv)
+
+    reports = [run_backend(backend, args.workers, args.sessions, args.turns) for backend in args.backends]
+    print(json.dumps(reports, indent=2))
+
+    if any(report["incomplete_sessions"] for report in reports):
+        print("FAIL: some conversations could not be resumed from the shared store", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
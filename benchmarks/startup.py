@@ -0,0 +1,111 @@
+"""
+Startup-time benchmark for the chat app.
+
+Each run launches a fresh server process (ai_assistant/chat_interface/main.py under uvicorn,
+with the query pipeline built from the stand-ins in benchmarks/fakes.py) and measures, from
+process launch:
+
+- startup: until /healthz answers, i.e. the worker accepts connections
+- ready:   until /readyz answers 200, i.e. the query pipeline and its clients are built
+
+Exits non-zero when the median startup time exceeds --max-startup seconds.
+
+    python -m benchmarks.startup --runs 5 --max-startup 1.0
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def serve(port: int):
+    """
+    Child process: serves the real app, with the pipeline factory swapped for one using local stand-ins.
+    """
+    import uvicorn
+    from ai_assistant.chat_interface import main
+    from benchmarks.load_test import build_pipeline, parse_args
+
+    workdir = tempfile.mkdtemp()
+    main.pipeline_factory = lambda: build_pipeline(parse_args([]), os.path.join(workdir, "sessions.sqlite3"))
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def wait_for(client: httpx.Client, url: str, deadline: float, status: int = 200) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            if client.get(url).status_code == status:
+                return time.perf_counter()
+        except httpx.TransportError:
+            pass
+        time.sleep(0.005)
+    raise TimeoutError(f"{url} did not answer {status} in time")
+
+
+def measure_once(timeout: float) -> dict:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    base_url = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "LOG-LEVEL": "WARNING"}
+    launched = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.startup", "--serve", str(port)],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(timeout=1.0) as client:
+            deadline = launched + timeout
+            healthy = wait_for(client, f"{base_url}/healthz", deadline)
+            ready = wait_for(client, f"{base_url}/readyz", deadline)
+            phases = client.get(f"{base_url}/readyz").json()
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    return {
+        "startup_s": round(healthy - launched, 3),
+        "ready_s": round(ready - launched, 3),
+        "server_started_s": phases["started"],
+        "server_ready_s": phases["ready"],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-startup", type=float, default=1.0, help="budget for the median startup time, in seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-run limit for reaching readiness")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve)
+        return 0
+
+    runs = [measure_once(args.timeout) for _ in range(args.runs)]
+    report = {
+        "runs": runs,
+        "startup_median_s": round(statistics.median(run["startup_s"] for run in runs), 3),
+        "ready_median_s": round(statistics.median(run["ready_s"] for run in runs), 3),
+    }
+    print(json.dumps(report, indent=2))
+
+    if report["startup_median_s"] > args.max_startup:
+        print(f"FAIL: median startup {report['startup_median_s']} s exceeds {args.max_startup} s", file=sys.stderr)
+        return 1
+    print(f"OK: median startup within {args.max_startup} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Coverage and latency of the rule-based temporal parser used before LLM event extraction.
+
+Parses every phrasing of `--corpus` (benchmarks/temporal_phrasings.json) at the corpus'
+fixed "now" and compares the result with the expected event, or with the expectation
+that the parser leaves the message to the LLM (`"expected": null`).
+
+Reports coverage (messages resolved without a model call), accuracy of the resolved
+ones and parse latency percentiles, and exits non-zero when the parser resolves a
+message wrongly or claims one it should have left to the LLM.
+
+    python -m benchmarks.temporal_parser --repeat 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CORPUS = os.path.join(BENCHMARK_DIR, "temporal_phrasings.json")
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def describe(parse) -> dict:
+    described = {
+        "summary": parse.summary,
+        "start": parse.start.isoformat(),
+        "end": parse.end.isoformat(),
+        "time_zone": parse.time_zone,
+        "recurrence": parse.recurrence,
+    }
+    if parse.location:
+        described["location"] = parse.location
+    if parse.attendees_emails:
+        described["attendees_emails"] = parse.attendees_emails
+    return described
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=200, help="parses per phrasing for the latency figures")
+    args = parser.parse_args(argv)
+
+    from agent.service.temporal_parser import TemporalParser
+
+    with open(args.corpus) as f:
+        corpus = json.load(f)
+    now = datetime.fromisoformat(corpus["now"])
+    temporal_parser = TemporalParser(time_zone=corpus["time_zone"])
+
+    resolved, correct, wrong, latencies = 0, 0, [], []
+    for phrasing in corpus["phrasings"]:
+        text, expected = phrasing["text"], phrasing["expected"]
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            parse = temporal_parser.parse(text, now)
+            latencies.append(time.perf_counter() - started)
+
+        if not parse.complete:
+            continue
+        resolved += 1
+        if describe(parse) == expected:
+            correct += 1
+        else:
+            wrong.append({"text": text, "expected": expected, "got": describe(parse)})
+
+    total = len(corpus["phrasings"])
+    report = {
+        "phrasings": total,
+        "resolved_without_llm": resolved,
+        "coverage": round(resolved / total, 3),
+        "expected_coverage": round(sum(p["expected"] is not None for p in corpus["phrasings"]) / total, 3),
+        "accuracy": round(correct / resolved, 3) if resolved else 0.0,
+        "parse_us": {
+            "p50": round(percentile(latencies, 0.5) * 1e6, 1),
+            "p99": round(percentile(latencies, 0.99) * 1e6, 1),
+            "max": round(max(latencies) * 1e6, 1),
+        },
+        "wrong": wrong,
+    }
+    print(json.dumps(report, indent=2))
+
+    if wrong:
+        print("FAIL: the parser resolved messages differently than expected", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Outbound WhatsApp throughput against a local mock Graph endpoint.
+
+Serves a stand-in for POST /{version}/{phone_number_id}/messages with uvicorn (fixed
+latency, and a configurable share of 429 and 500 responses), then sends `--messages`
+answers to `--recipients` users through WhatsAppDispatcher. Some answers are longer than
+the 4096-character limit, so they go out as several parts.
+
+Reports send throughput, per-part latency and retries, and checks that every part
+arrived and that each recipient got the parts of an answer in order.
+
+    python -m benchmarks.whatsapp_dispatch --messages 500 --recipients 50 --rate 80
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_chat_app():
+    """
+    The user-interface directory is deployed as the `apps.chat` package; alias it when running from the repo.
+    """
+    try:
+        import apps.chat  # noqa: F401
+        return
+    except ImportError:
+        pass
+    import types
+    package = types.ModuleType("apps")
+    package.__path__ = []
+    sys.modules["apps"] = package
+    directory = os.path.join(REPO_ROOT, "user-interface")
+    spec = importlib.util.spec_from_file_location("apps.chat", os.path.join(directory, "__init__.py"), submodule_search_locations=[directory])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["apps.chat"] = module
+    spec.loader.exec_module(module)
+
+
+def mock_graph_app(latency: float, throttle_rate: float, error_rate: float, received: list):
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    rng = random.Random(0)
+
+    async def messages(request):
+        await asyncio.sleep(latency)
+        roll = rng.random()
+        if roll < throttle_rate:
+            return JSONResponse({"error": {"code": 130429, "message": "Rate limit hit"}}, status_code=429, headers={"retry-after": "0.05"})
+        if roll < throttle_rate + error_rate:
+            return JSONResponse({"error": {"code": 1, "message": "Unknown error"}}, status_code=500)
+        payload = await request.json()
+        received.append((payload["to"], payload["text"]["body"]))
+        return JSONResponse({"messaging_product": "whatsapp", "messages": [{"id": f"wamid.{len(received)}"}]})
+
+    return Starlette(routes=[Route("/{version}/{phone_number_id}/messages", messages, methods=["POST"])])
+
+
+def start_server(app) -> tuple:
+    import uvicorn
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="mock-graph", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, port
+
+
+def build_answers(messages: int, recipients: int, long_share: float) -> list[tuple[str, str]]:
+    rng = random.Random(1)
+    answers = []
+    for i in range(messages):
+        to = f"2547{i % recipients:08d}"
+        length = 9000 if rng.random() < long_share else 600
+        # Numbered sentences let the check below see whether parts arrived in order
+        sentences = [f"Answer {i} sentence {n:04d}." for n in range(length // 26)]
+        answers.append((to, " ".join(sentences)))
+    return answers
+
+
+async def send_all(dispatcher, answers: list[tuple[str, str]]):
+    # One task per recipient, like the worker pool (one answer at a time per sender)
+    by_recipient = {}
+    for to, text in answers:
+        by_recipient.setdefault(to, []).append(text)
+
+    async def send_to(to, texts):
+        for text in texts:
+            await dispatcher.send_text(to, text)
+
+    await asyncio.gather(*(send_to(to, texts) for to, texts in by_recipient.items()))
+
+
+def in_order(received: list[tuple[str, str]]) -> bool:
+    last_seen = {}
+    for to, body in received:
+        for sentence in body.split(". "):
+            words = sentence.strip(".").split()
+            key = (int(words[1]), int(words[3]))
+            if last_seen.get(to, (-1, -1)) >= key:
+                return False
+            last_seen[to] = key
+    return True
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--recipients", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=80.0, help="dispatcher messages per second")
+    parser.add_argument("--latency", type=float, default=0.02, help="mock Graph response time")
+    parser.add_argument("--throttle-rate", type=float, default=0.02, help="share of 429 responses")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="share of 500 responses")
+    parser.add_argument("--long-share", type=float, default=0.1, help="share of answers above the length limit")
+    args = parser.parse_args(argv)
+
+    import_chat_app()
+    from apps.chat.clients.whatsapp_dispatcher import WhatsAppDispatcher, split_message
+    from apps.chat.config import WhatsAppConfig
+
+    received = []
+    server, thread, port = start_server(mock_graph_app(args.latency, args.throttle_rate, args.error_rate, received))
+    answers = build_answers(args.messages, args.recipients, args.long_share)
+    expected_parts = sum(len(split_message(text)) for _, text in answers)
+
+    async def run():
+        dispatcher = WhatsAppDispatcher(
+            config=WhatsAppConfig(), api_url=f"http://127.0.0.1:{port}/v19.0/123/messages", messages_per_second=args.rate, backoff_base=0.05
+        )
+        started = time.perf_counter()
+        try:
+            await send_all(dispatcher, answers)
+        finally:
+            await dispatcher.aclose()
+        return dispatcher.stats(), time.perf_counter() - started
+
+    try:
+        stats, elapsed = asyncio.run(run())
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    report = {
+        "answers": len(answers),
+        "parts": expected_parts,
+        "delivered": len(received),
+        "elapsed_seconds": round(elapsed, 3),
+        "parts_per_sec": round(len(received) / elapsed, 1),
+        **stats,
+        "in_order": in_order(received),
+    }
+    print(json.dumps(report, indent=2))
+
+    if len(received) != expected_parts or not report["in_order"]:
+        print("FAIL: parts were lost or arrived out of order", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
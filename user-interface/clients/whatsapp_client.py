@@ -4,12 +4,20 @@ from apps.chat.config import WhatsAppConfig
 
 
 class WhatsAppClient:
-    def __init__(self):
+    """
+    Blocking sender for one-off messages. The webhook replies go through the pooled,
+    rate-limited WhatsAppDispatcher instead.
+    """
+
+    def __init__(self, timeout: float = 10.0):
         self.config = WhatsAppConfig()
-        self.headers = {
+        self.timeout = timeout
+        # A session keeps the connection to graph.facebook.com alive between messages
+        self.session = requests.Session()
+        self.session.headers.update({
             'Authorization': f'Bearer {self.config.access_token}',
             'Content-Type': 'application/json',
-        }
+        })
 
 
     def send_message(self, to, text):
@@ -18,17 +26,13 @@ class WhatsAppClient:
             "to": to,
             "text": {"body": text}
         }
-        response = requests.post(self.config.api_url, headers=self.headers, json=payload)
+        response = self.session.post(self.config.api_url, json=payload, timeout=self.timeout)
         self.log_http_response(response)
         return response.json()
     
 
     def log_http_response(self, response):
-        logging.info(f"Status: {response.status_code}")
-        logging.info(f"Content-type: {response.headers.get('content-type')}")
-        logging.info(f"Body: {response.text}")
-    
-
-    
-
-
+        if response.ok:
+            logging.debug(f"Status: {response.status_code}")
+        else:
+            logging.warning(f"Status: {response.status_code}, body: {response.text[:500]}")
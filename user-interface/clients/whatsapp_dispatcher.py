@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import Optional
+import httpx
+from agent.service.metrics import Histogram
+from apps.chat.config import WhatsAppConfig
+
+MAX_TEXT_LENGTH = 4096  # Cloud API limit for a text message body
+# Graph error codes that mean "slow down" even when the HTTP status isn't 429
+RATE_LIMIT_ERROR_CODES = {4, 80007, 130429, 131056}
+# Transport errors raised before the request was sent, so retrying cannot deliver a message twice
+RETRYABLE_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def split_message(text: str, limit: int = MAX_TEXT_LENGTH) -> list[str]:
+    """
+    Splits text into ordered parts of at most `limit` characters, preferring paragraph,
+    then line, then sentence, then word boundaries.
+    """
+    parts = []
+    text = text.strip()
+    while len(text) > limit:
+        window = text[:limit]
+        cut = -1
+        for pattern in (r"\n\s*\n", r"\n", r"[.!?]\s", r"\s"):
+            matches = [match.end() for match in re.finditer(pattern, window)]
+            if matches and matches[-1] > limit // 2:
+                cut = matches[-1]
+                break
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class WhatsAppDispatcher:
+    """
+    Async outbound sender for the WhatsApp Cloud API.
+
+    - One pooled `httpx.AsyncClient` with keep-alive, so consecutive sends reuse connections.
+    - A token bucket holds sends to `messages_per_second` (the Graph API per-number throughput).
+    - 429s, 5xx responses, rate-limit error codes and failures to connect are retried up to
+      `max_retries` times with full-jitter exponential backoff (or the server's Retry-After,
+      capped at `backoff_max`). Errors after the request may have gone out, such as read
+      timeouts, are not retried: sending a message is not idempotent.
+    - Answers longer than the 4096-character limit are split into ordered parts.
+
+    The HTTP client is created on first use, on the event loop that sends. `transport`
+    (or `api_url`) can point it at a mock Graph endpoint.
+    """
+
+    def __init__(
+        self,
+        config: Optional[WhatsAppConfig] = None,
+        api_url: Optional[str] = None,
+        messages_per_second: Optional[float] = None,
+        max_connections: int = 20,
+        timeout: float = 10.0,
+        max_retries: int = 4,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+        split_long_messages: bool = True,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.config = config or WhatsAppConfig()
+        self.api_url = api_url or self.config.api_url
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.split_long_messages = split_long_messages
+        self.transport = transport
+        self.limiter = TokenBucket(messages_per_second or self.config.messages_per_second)
+
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency = Histogram()
+        self._first_send = None
+        self._last_send = None
+        self._client = None
+
+
+    async def send_text(self, to: str, text: str) -> list[dict]:
+        """
+        Sends `text` to `to`, as several ordered messages if it is too long.
+
+        Returns:
+            list[dict]: the Graph API response of each part.
+
+        Raises:
+            httpx.HTTPStatusError: if a part is rejected for good; later parts are not sent.
+        """
+        parts = split_message(text) if self.split_long_messages else [text[:MAX_TEXT_LENGTH]]
+        # Parts go out one after another so they arrive in order
+        return [await self.send_part(to, part) for part in parts]
+
+
+    async def send_part(self, to: str, body: str) -> dict:
+        payload = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": to,
+            "type": "text",
+            "text": {"body": body},
+        }
+        client = self._get_client()
+        started = time.perf_counter()
+
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            try:
+                response = await client.post(self.api_url, json=payload)
+            except httpx.TransportError as e:
+                if attempt == self.max_retries or not isinstance(e, RETRYABLE_TRANSPORT_ERRORS):
+                    self.failed += 1
+                    raise
+                logging.debug(f"[WhatsAppDispatcher] Transport error {e!r}, retrying")
+                await self._backoff(attempt)
+                continue
+
+            if response.is_success:
+                self._record_success(started)
+                return response.json()
+
+            if attempt < self.max_retries and self._is_retryable(response):
+                logging.debug(f"[WhatsAppDispatcher] Status {response.status_code}, retrying")
+                await self._backoff(attempt, response.headers.get("retry-after"))
+                continue
+
+            self.failed += 1
+            logging.warning(f"[WhatsAppDispatcher] Send to {to} failed with status {response.status_code}: {response.text[:500]}")
+            response.raise_for_status()
+
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+    def stats(self) -> dict:
+        window = (self._last_send - self._first_send) if self.sent > 1 else 0.0
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "messages_per_sec": round((self.sent - 1) / window, 2) if window else 0.0,
+            "latency_ms": {"p50": round(self.latency.quantile(0.5) * 1000, 1), "p99": round(self.latency.quantile(0.99) * 1000, 1)},
+        }
+
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                headers={"Authorization": f"Bearer {self.config.access_token}"},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                transport=self.transport,
+            )
+        return self._client
+
+
+    def _record_success(self, started: float):
+        now = time.perf_counter()
+        self.latency.observe(now - started)
+        self.sent += 1
+        self._first_send = self._first_send or now
+        self._last_send = now
+
+
+    @staticmethod
+    def _is_retryable(response: httpx.Response) -> bool:
+        if response.status_code == 429 or response.status_code >= 500:
+            return True
+        try:
+            body = response.json()
+        except ValueError:
+            return False
+        return isinstance(body, dict) and body.get("error", {}).get("code") in RATE_LIMIT_ERROR_CODES
+
+
+    async def _backoff(self, attempt: int, retry_after: Optional[str] = None):
+        self.retries += 1
+        try:
+            # A misbehaving server must not park the sender for minutes
+            delay = min(max(float(retry_after), 0.0), self.backoff_max)
+        except (TypeError, ValueError):
+            # Full jitter keeps retries from many senders from lining up
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        await asyncio.sleep(delay)
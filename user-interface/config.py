@@ -8,7 +8,11 @@ class WhatsAppConfig:
         self.access_token = os.getenv("ACCESS_TOKEN")
         self.phone_number_id = os.getenv("PHONE_NUMBER_ID")
         self.verify_token = os.getenv("VERIFY_TOKEN")
+        # Meta signs webhook payloads with the app secret (X-Hub-Signature-256)
+        self.app_secret = os.getenv("APP_SECRET")
         self.graph_api_version = os.getenv("GRAPH_API_VERSION")
+        # Cloud API throughput per business phone number (80 by default, higher on upgraded numbers)
+        self.messages_per_second = float(os.getenv("MESSAGES_PER_SECOND", "80"))
 
     @property
     def api_url(self):
@@ -1,3 +1,264 @@
-from django.test import TestCase
+import asyncio
+import copy
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from unittest import mock
+import httpx
+from django.conf import settings
+from django.test import SimpleTestCase
+from rest_framework.test import APIRequestFactory
+from apps.chat import views
+from apps.chat.clients.whatsapp_dispatcher import TokenBucket, WhatsAppDispatcher, split_message
+from apps.chat.webhook_worker import InboundMessage, SeenMessages, WebhookWorkerPool, parse_text_messages, signature_valid
 
-# Create your tests here.
+EXAMPLE_PAYLOAD = os.path.join(settings.BASE_DIR, "example.json")
+APP_SECRET = "test-app-secret"
+
+
+def load_example() -> dict:
+    with open(EXAMPLE_PAYLOAD) as f:
+        return json.load(f)
+
+
+def sign(body: bytes, app_secret: str = APP_SECRET) -> str:
+    return "sha256=" + hmac.new(app_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+class RecordingTurns:
+    """
+    Stands in for the query pipeline and the WhatsApp sender: records every turn and reply,
+    and sets `done` once `expected` replies went out.
+    """
+
+    def __init__(self, expected: int, delay: float = 0.0):
+        self.expected = expected
+        self.delay = delay
+        self.turns = []
+        self.replies = []
+        self.done = threading.Event()
+
+
+    async def run_turn(self, user_query: str, session_id: str) -> str:
+        self.turns.append((session_id, user_query))
+        await asyncio.sleep(self.delay)
+        return f"answer to {user_query}"
+
+
+    async def send_reply(self, wa_id: str, text: str):
+        self.replies.append((wa_id, text))
+        if len(self.replies) >= self.expected:
+            self.done.set()
+
+
+class ParseTextMessagesTests(SimpleTestCase):
+
+    def test_text_messages_are_extracted(self):
+        messages = parse_text_messages(load_example())
+        self.assertEqual([(message.wa_id, message.text) for message in messages], [("254712345678", "What is the best programming Language?")])
+
+
+    def test_status_updates_and_other_message_types_are_skipped(self):
+        payload = load_example()
+        value = payload["entry"][0]["changes"][0]["value"]
+        value["messages"][0]["type"] = "image"
+        self.assertEqual(parse_text_messages(payload), [])
+        self.assertEqual(parse_text_messages({"entry": [{"changes": [{"value": {"statuses": [{"id": "x"}]}}]}]}), [])
+
+
+class SignatureTests(SimpleTestCase):
+
+    def test_only_the_app_secret_signature_of_the_exact_body_is_accepted(self):
+        body = b'{"entry": []}'
+        self.assertTrue(signature_valid(body, sign(body), APP_SECRET))
+        self.assertFalse(signature_valid(body + b" ", sign(body), APP_SECRET))
+        self.assertFalse(signature_valid(body, sign(body, "other-secret"), APP_SECRET))
+        self.assertFalse(signature_valid(body, sign(body)[len("sha256="):], APP_SECRET))
+        self.assertFalse(signature_valid(body, "", APP_SECRET))
+        # Without a configured secret nothing can be verified, so nothing is accepted
+        self.assertFalse(signature_valid(body, sign(body, ""), None))
+
+
+class SeenMessagesTests(SimpleTestCase):
+
+    def test_ids_are_accepted_once(self):
+        seen = SeenMessages()
+        self.assertTrue(seen.add("a"))
+        self.assertFalse(seen.add("a"))
+        seen.discard("a")
+        self.assertTrue(seen.add("a"))
+
+
+    def test_only_the_most_recent_ids_are_remembered(self):
+        seen = SeenMessages(max_entries=2)
+        for message_id in ("a", "b", "c"):
+            seen.add(message_id)
+        self.assertTrue(seen.add("a"))
+        self.assertFalse(seen.add("c"))
+
+
+class WebhookWorkerPoolTests(SimpleTestCase):
+
+    def test_messages_of_a_sender_are_answered_in_arrival_order(self):
+        turns = RecordingTurns(expected=6, delay=0.01)
+        pool = WebhookWorkerPool(turns.run_turn, turns.send_reply, workers=4)
+        for number in range(3):
+            for wa_id in ("a", "b"):
+                self.assertTrue(pool.submit(InboundMessage(f"{wa_id}{number}", wa_id, f"{wa_id} {number}")))
+
+        self.assertTrue(turns.done.wait(5))
+        for wa_id in ("a", "b"):
+            self.assertEqual([text for sender, text in turns.replies if sender == wa_id], [f"answer to {wa_id} {number}" for number in range(3)])
+        self.assertEqual((pool.stats()["processed"], pool.stats()["failed"]), (6, 0))
+
+
+    def test_a_failed_turn_is_counted_and_the_worker_keeps_going(self):
+        turns = RecordingTurns(expected=1)
+
+        async def run_turn(user_query, session_id):
+            if user_query == "boom":
+                raise RuntimeError("model unavailable")
+            return await turns.run_turn(user_query, session_id)
+
+        pool = WebhookWorkerPool(run_turn, turns.send_reply, workers=1)
+        with self.assertLogs(level="ERROR"):
+            pool.submit(InboundMessage("1", "a", "boom"))
+            pool.submit(InboundMessage("2", "a", "hello"))
+            self.assertTrue(turns.done.wait(5))
+        self.assertEqual((pool.processed, pool.failed), (1, 1))
+
+
+    def test_a_full_queue_rejects_new_messages(self):
+        turns = RecordingTurns(expected=1)
+        pool = WebhookWorkerPool(turns.run_turn, turns.send_reply, workers=1, max_queue=0)
+        self.assertFalse(pool.submit(InboundMessage("1", "a", "hello")))
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+
+@mock.patch.dict(os.environ, {"APP_SECRET": APP_SECRET})
+class WhatsAppWebhookViewTests(SimpleTestCase):
+
+    def setUp(self):
+        self.turns = RecordingTurns(expected=1)
+        pool = WebhookWorkerPool(self.turns.run_turn, self.turns.send_reply, workers=2)
+        for patcher in (mock.patch.object(views, "_worker_pool", pool), mock.patch.object(views, "seen_messages", SeenMessages())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+    def post(self, payload: dict, signature=None):
+        body = json.dumps(payload).encode("utf-8")
+        request = APIRequestFactory().post(
+            "/webhook/", body, content_type="application/json",
+            HTTP_X_HUB_SIGNATURE_256=sign(body) if signature is None else signature,
+        )
+        return views.WhatsAppWebhookView.as_view()(request)
+
+
+    def test_a_redelivered_webhook_is_processed_once(self):
+        payload = load_example()
+        for _ in range(3):
+            self.assertEqual(self.post(copy.deepcopy(payload)).status_code, 200)
+
+        self.assertTrue(self.turns.done.wait(5))
+        self.assertEqual(self.turns.turns, [("254712345678", "What is the best programming Language?")])
+        self.assertEqual(views._worker_pool.stats()["processed"], 1)
+
+
+    def test_unsigned_or_forged_payloads_are_rejected(self):
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(self.post(load_example(), signature="").status_code, 403)
+            self.assertEqual(self.post(load_example(), signature=sign(b"something else")).status_code, 403)
+        self.assertEqual(self.turns.turns, [])
+
+
+class ScriptedGraph:
+    """
+    Stands in for the Graph messages endpoint: answers each request with the next scripted
+    outcome (a status code, a response, or an exception to raise) and records the bodies it got.
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.bodies = []
+
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if isinstance(outcome, Exception):
+            raise outcome
+        self.bodies.append(json.loads(request.content)["text"]["body"])
+        if isinstance(outcome, httpx.Response):
+            return outcome
+        return httpx.Response(outcome, json={"messages": [{"id": f"wamid.{len(self.bodies)}"}]})
+
+
+def dispatcher(graph: ScriptedGraph, **kwargs) -> WhatsAppDispatcher:
+    kwargs = {"api_url": "https://graph.test/v1/123/messages", "messages_per_second": 1000, "backoff_base": 0.001, "backoff_max": 0.01, **kwargs}
+    return WhatsAppDispatcher(transport=httpx.MockTransport(graph), **kwargs)
+
+
+class WhatsAppDispatcherTests(SimpleTestCase):
+
+    def test_long_answers_are_split_on_the_nicest_boundary(self):
+        paragraph = "word " * 30
+        parts = split_message(f"{paragraph}\n\n{paragraph}\n\n{paragraph}", limit=400)
+        self.assertEqual(parts, [f"{paragraph}\n\n{paragraph}".strip(), paragraph.strip()])
+        self.assertTrue(all(len(part) <= 100 for part in split_message("x" * 250, limit=100)))
+        self.assertEqual("".join(split_message("x" * 250, limit=100)), "x" * 250)
+
+
+    async def test_parts_of_a_long_answer_are_sent_in_order(self):
+        graph = ScriptedGraph()
+        sender = dispatcher(graph)
+        text = " ".join(f"sentence {i}." for i in range(1000))
+        responses = await sender.send_text("254700000000", text)
+        await sender.aclose()
+        self.assertGreater(len(graph.bodies), 1)
+        self.assertEqual(" ".join(graph.bodies), text)
+        self.assertEqual(len(responses), len(graph.bodies))
+
+
+    async def test_throttling_and_connect_failures_are_retried(self):
+        graph = ScriptedGraph(
+            httpx.ConnectError("connection refused"),
+            httpx.Response(400, json={"error": {"code": 130429}}),
+            httpx.Response(429, headers={"retry-after": "3600"}),
+            200,
+        )
+        sender = dispatcher(graph)
+        # The server's Retry-After is capped at backoff_max
+        response = await asyncio.wait_for(sender.send_part("254700000000", "hello"), 1)
+        await sender.aclose()
+        self.assertEqual(response["messages"][0]["id"], "wamid.3")
+        self.assertEqual((sender.sent, sender.retries, sender.failed), (1, 3, 0))
+
+
+    async def test_errors_after_the_request_went_out_are_not_retried(self):
+        graph = ScriptedGraph(httpx.ReadTimeout("no response"), 200)
+        sender = dispatcher(graph)
+        with self.assertRaises(httpx.ReadTimeout):
+            await sender.send_part("254700000000", "hello")
+        await sender.aclose()
+        self.assertEqual((sender.retries, sender.failed), (0, 1))
+        self.assertEqual(graph.outcomes, [200])
+
+
+    async def test_rejected_sends_raise_after_the_last_retry(self):
+        graph = ScriptedGraph(500, 500, 400)
+        sender = dispatcher(graph, max_retries=1)
+        with self.assertLogs(level="WARNING"), self.assertRaises(httpx.HTTPStatusError):
+            await sender.send_part("254700000000", "hello")
+        await sender.aclose()
+        self.assertEqual((sender.retries, sender.failed, len(graph.bodies)), (1, 1, 2))
+
+
+    async def test_sends_are_held_to_the_rate_limit(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        started = time.monotonic()
+        for _ in range(6):
+            await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.045)
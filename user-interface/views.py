@@ -1,11 +1,14 @@
 from datetime import datetime
 import json
+import threading
+from django.http import HttpResponse
 from django.shortcuts import render
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import status
-from apps.chat.clients.whatsapp_client import WhatsAppClient
+from apps.chat.clients.whatsapp_dispatcher import WhatsAppDispatcher
 from apps.chat.config import WhatsAppConfig
+from apps.chat.webhook_worker import SeenMessages, WebhookWorkerPool, parse_text_messages, signature_valid
 import logging
 
 logging.basicConfig(
@@ -13,17 +16,83 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+# Shared by every request: the view class is instantiated per request
+seen_messages = SeenMessages()
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+
+async def run_turn(user_query: str, session_id: str) -> str:
+    # Imported lazily so that loading the URL conf doesn't pull in the chat app. Turns run on its
+    # query pipeline, so the deployment keeps one scheduler, one set of clients and one session store
+    from ai_assistant.chat_interface.main import run_turn
+    return await run_turn(user_query, session_id)
+
+
+def get_worker_pool() -> WebhookWorkerPool:
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            # Replies go out through the pooled, rate-limited async sender on the worker loop
+            dispatcher = WhatsAppDispatcher()
+            _worker_pool = WebhookWorkerPool(run_turn, send_reply=dispatcher.send_text)
+            _worker_pool.dispatcher = dispatcher
+        return _worker_pool
+
+
 class WhatsAppWebhookView(APIView):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.whatsapp = WhatsAppClient()
         self.config = WhatsAppConfig()
 
     
     def post(self, request):
-        pass
+        """
+        Acknowledges the webhook immediately; the answers are produced by the worker pool.
+        Messages already seen (Meta redelivering a webhook) are acknowledged without being processed again.
+        Payloads without a valid signature from Meta are rejected before they are parsed.
+        """
+        if not signature_valid(request.body, request.headers.get("X-Hub-Signature-256", ""), self.config.app_secret):
+            logging.warning("Rejected a webhook with a missing or invalid X-Hub-Signature-256")
+            return Response(status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            messages = parse_text_messages(request.data)
+        except (AttributeError, KeyError, TypeError) as e:
+            logging.warning(f"Malformed webhook payload: {e!r}")
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        pool = get_worker_pool()
+        for message in messages:
+            if not seen_messages.add(message.message_id):
+                continue
+            if not pool.submit(message):
+                # Queue full: forget the id so Meta's redelivery is accepted, and ask it to retry
+                seen_messages.discard(message.message_id)
+                return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        return Response(status=status.HTTP_200_OK)
+
+
+    def get(self, request):
+        """
+        Webhook verification handshake: echo hub.challenge when the verify token matches.
+        """
+        mode = request.query_params.get("hub.mode")
+        token = request.query_params.get("hub.verify_token")
+        challenge = request.query_params.get("hub.challenge", "")
+
+        if mode == "subscribe" and token and token == self.config.verify_token:
+            return HttpResponse(challenge, content_type="text/plain")
+        return Response(status=status.HTTP_403_FORBIDDEN)
+
 
+class WhatsAppWebhookStatsView(APIView):
 
     def get(self, request):
-        pass
\ No newline at end of file
+        """
+        Queue depth and per-message latency of the webhook worker pool, and outbound send stats.
+        """
+        pool = get_worker_pool()
+        return Response({**pool.stats(), "outbound": pool.dispatcher.stats()})
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from agent.service.metrics import Histogram
+
+
+@dataclass
+class InboundMessage:
+    message_id: str
+    wa_id: str
+    text: str
+    received_at: float = field(default_factory=time.perf_counter)
+
+
+def parse_text_messages(payload: dict) -> list[InboundMessage]:
+    """
+    Extracts the text messages of a WhatsApp Cloud API webhook payload (see example.json).
+    Status updates and non-text messages are skipped.
+    """
+    messages = []
+    for entry in payload.get("entry", []):
+        for change in entry.get("changes", []):
+            for message in change.get("value", {}).get("messages", []):
+                if message.get("type") == "text" and message.get("id") and message.get("from"):
+                    messages.append(InboundMessage(message["id"], message["from"], message["text"]["body"]))
+    return messages
+
+
+def signature_valid(body: bytes, signature: str, app_secret: str) -> bool:
+    """
+    Checks the X-Hub-Signature-256 header Meta sends with every webhook: "sha256=" followed
+    by the hex HMAC-SHA256 of the raw request body, keyed with the app secret.
+    """
+    if not app_secret or not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(app_secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature[len("sha256="):], expected)
+
+
+class SeenMessages:
+    """
+    Bounded set of recently seen message ids. Meta redelivers a webhook it considers
+    slow or failed, so a message id seen before is acknowledged but not processed again.
+    Only the `max_entries` most recent ids are remembered.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def add(self, message_id: str) -> bool:
+        """
+        Returns True if the id is new (and remembers it), False if it was already seen.
+        """
+        with self._lock:
+            if message_id in self._ids:
+                self._ids.move_to_end(message_id)
+                return False
+            self._ids[message_id] = None
+            while len(self._ids) > self.max_entries:
+                self._ids.popitem(last=False)
+            return True
+
+
+    def discard(self, message_id: str):
+        with self._lock:
+            self._ids.pop(message_id, None)
+
+
+class WebhookWorkerPool:
+    """
+    Processes inbound WhatsApp messages off the request path, so the webhook can answer
+    Meta right away.
+
+    - Runs `workers` coroutines on a dedicated event loop thread, fed by a bounded queue.
+    - Each message is answered by `run_turn(text, session_id)`, with the sender's wa_id as
+      session id, and the answer is sent back with `send_reply(wa_id, text)` (a coroutine
+      function runs on the worker loop, a plain function in a worker thread).
+    - Messages of the same sender are processed one at a time, in arrival order, so
+      their turns don't interleave in the session history.
+    """
+
+    def __init__(self, run_turn, send_reply, workers: int = 4, max_queue: int = 1000):
+        self.run_turn = run_turn
+        self.send_reply = send_reply
+        self.workers = workers
+        self.max_queue = max_queue
+
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.queue_wait = Histogram()
+        self.processing = Histogram()
+
+        self._senders = {}
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name="whatsapp-workers", daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+
+    def submit(self, message: InboundMessage) -> bool:
+        """
+        Queues a message. Returns False when the queue is full, so the caller can ask Meta to retry later.
+        """
+        if self._queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            return False
+        self._loop.call_soon_threadsafe(self._enqueue, message)
+        return True
+
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_depth,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "queue_wait_ms": {"p50": round(self.queue_wait.quantile(0.5) * 1000, 1), "p99": round(self.queue_wait.quantile(0.99) * 1000, 1)},
+            "processing_ms": {"p50": round(self.processing.quantile(0.5) * 1000, 1), "p99": round(self.processing.quantile(0.99) * 1000, 1)},
+        }
+
+
+    def _run_loop(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._queue = asyncio.Queue()
+        for _ in range(self.workers):
+            self._loop.create_task(self._work())
+        self._loop.call_soon(self._started.set)
+        self._loop.run_forever()
+
+
+    def _enqueue(self, message: InboundMessage):
+        self._queue.put_nowait(message)
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+
+    async def _work(self):
+        while True:
+            message = await self._queue.get()
+            try:
+                await self._process(message)
+            finally:
+                self._queue.task_done()
+
+
+    async def _process(self, message: InboundMessage):
+        # [lock, messages holding or waiting for it]; dropped once the sender has nothing queued
+        sender = self._senders.setdefault(message.wa_id, [asyncio.Lock(), 0])
+        sender[1] += 1
+        try:
+            async with sender[0]:
+                started = time.perf_counter()
+                self.queue_wait.observe(started - message.received_at)
+                try:
+                    answer = await self.run_turn(message.text, message.wa_id)
+                    if asyncio.iscoroutinefunction(self.send_reply):
+                        await self.send_reply(message.wa_id, answer)
+                    else:
+                        await asyncio.to_thread(self.send_reply, message.wa_id, answer)
+                    self.processed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logging.error(f"[WebhookWorkerPool] Message {message.message_id} failed: {e!r}")
+                finally:
+                    self.processing.observe(time.perf_counter() - started)
+        finally:
+            sender[1] -= 1
+            if not sender[1]:
+                del self._senders[message.wa_id]